@@ -0,0 +1,168 @@
+import random
+import string
+import time
+
+ALPHA_CHARS = string.ascii_uppercase + string.digits + " "
+BASE_DATE = 946684800  # 2000-01-01
+SECONDS_PER_DAY = 86400
+
+
+def parse_row_type_mix(mix):
+    """
+    Parses a row type mix given on the command line
+    :param mix: string like 'H=1,D=20' giving the relative weight of each row type
+    :return: a dictionary {row_type: weight}
+    """
+    result = {}
+    for item in mix.split(','):
+        row_type, weight = item.split('=')
+        result[row_type] = float(weight)
+    return result
+
+
+class FlatFileGenerator(object):
+    """
+    Generates synthetic flat files matching a FlatFileStructure, with an optional density of erroneous fields
+    """
+    def __init__(self, file_structure, width=10, row_type_mix=None, error_density=0.0, quoted_density=0.0,
+                 group_size=5, seed=0):
+        """
+        :param file_structure: FlatFileStructure object the generated files should match
+        :param width: length of the alphanumeric fields of csv files. Positional fields keep their structure length
+        :param row_type_mix: (optional) dictionary {row_type: weight}. By default all row types have the same weight
+        :param error_density: probability for a row to contain an erroneous field
+        :param quoted_density: probability for an alphanumeric csv field to be quoted and contain the separator
+        :param group_size: maximum number of consecutive rows sharing the same key
+        :param seed: seed of the random generator, so that runs can be compared
+        """
+        self.structure = file_structure
+        self.width = width
+        self.error_density = error_density
+        self.quoted_density = quoted_density
+        self.group_size = group_size
+        self.random = random.Random(seed)
+
+        row_structures = {row_structure.type: row_structure for row_structure in file_structure.row_structures}
+        if row_type_mix is None:
+            row_type_mix = {row_type: 1 for row_type in row_structures}
+        unknown_types = [row_type for row_type in row_type_mix if row_type not in row_structures]
+        if unknown_types:
+            raise Exception("Unknown row types in mix : " + ", ".join(unknown_types))
+        self.row_structures = [row_structures[row_type] for row_type in row_type_mix]
+        self.weights = [row_type_mix[row_type] for row_type in row_type_mix]
+
+    def field_lengths(self, row_structure):
+        if self.structure.conf_type == 'pos':
+            return row_structure.lengths
+        lengths = [self.width] * row_structure.length
+        for position, length in getattr(row_structure, 'fixed_lengths', []):
+            lengths[position - 1] = length
+        return lengths
+
+    def make_digits(self, length):
+        return "".join(self.random.choice(string.digits) for i in range(length))
+
+    def make_decimal(self, length):
+        if length < 3:
+            return self.make_digits(length)
+        decimals = min(2, length - 2)
+        return self.make_digits(length - decimals - 1) + self.structure.decimal_sep + self.make_digits(decimals)
+
+    def make_date(self):
+        timestamp = BASE_DATE + self.random.randrange(0, 10000) * SECONDS_PER_DAY
+        return time.strftime(self.structure.date_fmt, time.gmtime(timestamp))
+
+    def make_alpha(self, length):
+        return "".join(self.random.choice(ALPHA_CHARS) for i in range(length))
+
+    def make_row(self, row_structure, key):
+        """
+        Builds the fields of a valid row
+        :param row_structure: RowStructure of the row
+        :param key: value of the key field of the row
+        :return: a list of fields
+        """
+        lengths = self.field_lengths(row_structure)
+        is_pos = self.structure.conf_type == 'pos'
+        fields = []
+        for position, length in enumerate(lengths, 1):
+            if position == self.structure.type_pos:
+                field = row_structure.type
+            elif position == row_structure.key_pos:
+                field = str(key).zfill(length)[-length:]
+            elif position in row_structure.date_fields:
+                field = self.make_date()
+            elif position in row_structure.digit_fields:
+                field = self.make_digits(length)
+            elif position in row_structure.decimal_fields:
+                field = self.make_decimal(length)
+            elif not is_pos and self.quoted_density and self.random.random() < self.quoted_density:
+                quotechar = self.structure.quotechar
+                field = quotechar + self.make_alpha(length // 2) + self.structure.sep + self.make_alpha(length // 2) \
+                    + quotechar
+            else:
+                field = self.make_alpha(length)
+            if is_pos:
+                field = field.ljust(length)[:length]
+            fields.append(field)
+        return fields
+
+    def corrupt_row(self, row_structure, fields):
+        """
+        Replaces a random checked field of a row with an erroneous value
+        :param row_structure: RowStructure of the row
+        :param fields: list of fields of the row, modified in place
+        :return: None
+        """
+        candidates = [(position, 'date') for position in row_structure.date_fields] \
+            + [(position, 'digit') for position in row_structure.digit_fields] \
+            + [(position, 'decimal') for position in row_structure.decimal_fields]
+        if self.structure.conf_type == 'csv':
+            candidates += [(position, 'required') for position in range(1, row_structure.length + 1)
+                           if position not in row_structure.optional_fields and position != self.structure.type_pos]
+        if not candidates:
+            return
+        position, kind = self.random.choice(candidates)
+        length = len(fields[position - 1])
+        if kind == 'required':
+            value = ""
+        else:
+            value = "X" * max(length, 1)
+        if self.structure.conf_type == 'pos':
+            value = value.ljust(length)[:length]
+        fields[position - 1] = value
+
+    def iter_lines(self, rows):
+        """
+        Generates the lines of a synthetic file
+        :param rows: number of rows to generate
+        :return: a generator of lines, with the carriage return of the structure
+        """
+        carriage_return = self.structure.carriage_return
+        key = 0
+        group_remaining = 0
+        for idx in range(rows):
+            if group_remaining == 0:
+                key += 1
+                group_remaining = self.random.randint(1, self.group_size)
+            group_remaining -= 1
+            row_structure = self.random.choices(self.row_structures, self.weights)[0]
+            fields = self.make_row(row_structure, key)
+            if self.error_density and self.random.random() < self.error_density:
+                self.corrupt_row(row_structure, fields)
+            if self.structure.conf_type == 'pos':
+                line = "".join(fields)
+            else:
+                line = self.structure.sep.join(fields)
+            yield line + carriage_return
+
+    def write(self, path, rows):
+        """
+        Writes a synthetic file
+        :param path: path of the file to write
+        :param rows: number of rows to generate
+        :return: the number of bytes written
+        """
+        with open(path, "w", encoding=self.structure.encoding, newline='') as file:
+            file.writelines(self.iter_lines(rows))
+            return file.tell()
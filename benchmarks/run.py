@@ -0,0 +1,251 @@
+import argparse
+import json
+import multiprocessing
+import os.path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from ffparser import compression, ffchecker, structure, testcase
+from benchmarks.generator import FlatFileGenerator, parse_row_type_mix
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_peak_rss_kb():
+    """
+    :return: the peak resident set size of the current process in kilobytes, None when it cannot be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+    return peak
+
+
+def get_ffparser_version():
+    try:
+        from importlib.metadata import version
+        return version('ffparser')
+    except Exception:
+        return None
+
+
+def load_flat_file(path, file_structure):
+    # same binary path as ffchecker.load_flat_file: the blocks are decoded by decoding.BlockDecoder
+    with compression.open_binary(path) as file:
+        return ffchecker.FlatFile(file, file_structure, filename=path)
+
+
+def bench_load(path, file_structure):
+    start = time.perf_counter()
+    flat_file = load_flat_file(path, file_structure)
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'rows': len(flat_file.rows)}
+
+
+def bench_test(path, file_structure, test_name):
+    flat_file = load_flat_file(path, file_structure)
+    start = time.perf_counter()
+    try:
+        result = flat_file.run_test_case(test_name)
+    except testcase.TestExecException as err:
+        return {'seconds': time.perf_counter() - start, 'rows': len(flat_file.rows), 'error': err.msg}
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'rows': len(flat_file.rows), 'errors_found': result.count_failed()}
+
+
+def bench_parse_groups(path, file_structure):
+    flat_file = load_flat_file(path, file_structure)
+    start = time.perf_counter()
+    groups = flat_file.parse_groups()
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'rows': len(flat_file.rows), 'groups': len(groups)}
+
+
+def bench_pipeline(path, file_structure, structures_dir, rows):
+    output_dir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        return_code = ffchecker.main([path, '--config-dir', structures_dir, '--file-structure', file_structure.name,
+                                      '--output-dir', output_dir, '-q'])
+        seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return {'seconds': seconds, 'rows': rows, 'return_code': return_code}
+
+
+def _run_child(queue, func, args):
+    try:
+        result = func(*args)
+    except Exception as err:
+        result = {'seconds': None, 'error': repr(err)}
+    result['peak_rss_kb'] = get_peak_rss_kb()
+    queue.put(result)
+
+
+def run_isolated(func, *args):
+    """
+    Runs a benchmark phase in a forked process so that its peak memory is measured separately from the other phases.
+    Phases are run in the current process when fork is not available
+    :param func: function running the phase and returning a dictionary of measures
+    :param args: arguments of the function
+    :return: the dictionary of measures, with the peak RSS of the process
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        result = func(*args)
+        result['peak_rss_kb'] = get_peak_rss_kb()
+        return result
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_run_child, args=(queue, func, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def add_throughput(result, file_size):
+    seconds = result.get('seconds')
+    result['bytes'] = file_size
+    if seconds:
+        result['rows_per_sec'] = result.get('rows', 0) / seconds
+        result['mb_per_sec'] = file_size / seconds / 1000000
+    return result
+
+
+def run_benchmarks(struct_path, rows, width=10, row_type_mix=None, error_density=0.0, quoted_density=0.0,
+                   tests=None, seed=0, work_dir=None):
+    """
+    Generates a synthetic file from a structure and measures each stage of its validation
+    :param struct_path: path to a structure json file
+    :param rows: number of rows of the generated file
+    :param width: length of the alphanumeric csv fields
+    :param row_type_mix: (optional) dictionary {row_type: weight}
+    :param error_density: probability for a row to contain an erroneous field
+    :param quoted_density: probability for an alphanumeric csv field to be quoted
+    :param tests: (optional) names of the tests to measure. By default the tests of the structure
+    :param seed: seed of the generator
+    :param work_dir: (optional) directory where the generated file is kept. By default a temporary directory removed
+    at the end of the run
+    :return: a dictionary with the parameters of the run and the measures of each phase
+    """
+    file_structure = structure.get_structure_from_json(struct_path)
+    if tests is None:
+        tests = file_structure.tests
+
+    remove_work_dir = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp()
+    try:
+        structures_dir = os.path.join(work_dir, 'structures')
+        os.makedirs(structures_dir, exist_ok=True)
+        shutil.copy(struct_path, os.path.join(structures_dir, "struct_" + file_structure.name + ".json"))
+
+        path = os.path.join(work_dir, "bench_" + file_structure.name + "." + file_structure.conf_type)
+        generator = FlatFileGenerator(file_structure, width=width, row_type_mix=row_type_mix,
+                                      error_density=error_density, quoted_density=quoted_density, seed=seed)
+        start = time.perf_counter()
+        file_size = generator.write(path, rows)
+        generation_seconds = time.perf_counter() - start
+
+        phases = []
+        result = run_isolated(bench_load, path, file_structure)
+        phases.append(dict(name='load', **add_throughput(result, file_size)))
+        for test_name in tests:
+            result = run_isolated(bench_test, path, file_structure, test_name)
+            phases.append(dict(name='test:' + test_name, **add_throughput(result, file_size)))
+        result = run_isolated(bench_parse_groups, path, file_structure)
+        phases.append(dict(name='parse_groups', **add_throughput(result, file_size)))
+        result = run_isolated(bench_pipeline, path, file_structure, structures_dir, rows)
+        phases.append(dict(name='pipeline', **add_throughput(result, file_size)))
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'ffparser_version': get_ffparser_version(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'parameters': {'structure': file_structure.name, 'conf_type': file_structure.conf_type, 'rows': rows,
+                       'width': width, 'row_type_mix': row_type_mix, 'error_density': error_density,
+                       'quoted_density': quoted_density, 'seed': seed, 'file_size': file_size,
+                       'generation_seconds': generation_seconds},
+        'phases': phases,
+    }
+
+
+def format_results(results, baseline=None):
+    """
+    Formats the measures of a run as a table, compared with a baseline run when given
+    :param results: dictionary returned by run_benchmarks
+    :param baseline: (optional) dictionary of a previous run
+    :return: the table as a string
+    """
+    baseline_phases = {}
+    if baseline is not None:
+        baseline_phases = {phase['name']: phase for phase in baseline['phases']}
+    lines = ["%-32s %12s %14s %10s %12s %10s" % ('PHASE', 'SECONDS', 'ROWS/SEC', 'MB/SEC', 'PEAK_RSS_KB',
+                                                 'VS_BASE')]
+    for phase in results['phases']:
+        if phase.get('seconds') is None:
+            lines.append("%-32s ERROR %s" % (phase['name'], phase.get('error')))
+            continue
+        change = ""
+        old_phase = baseline_phases.get(phase['name'])
+        if old_phase and old_phase.get('rows_per_sec') and phase.get('rows_per_sec'):
+            change = "%+.1f%%" % ((phase['rows_per_sec'] / old_phase['rows_per_sec'] - 1) * 100)
+        lines.append("%-32s %12.3f %14.0f %10.2f %12s %10s" % (phase['name'], phase['seconds'],
+                                                                phase.get('rows_per_sec', 0),
+                                                                phase.get('mb_per_sec', 0),
+                                                                phase.get('peak_rss_kb'), change))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ffparser on a synthetic flat file')
+    parser.add_argument('structure', metavar='STRUCT_FILE', help='Structure json file used to generate the file')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of rows to generate. Default : 100000')
+    parser.add_argument('--width', type=int, default=10, help='Length of the alphanumeric csv fields. Default : 10')
+    parser.add_argument('--mix', metavar='TYPE=WEIGHT,...', help='Row type mix, e.g. H=1,D=20. By default all row '
+                                                                 'types have the same weight')
+    parser.add_argument('--error-density', type=float, default=0.0, help='Probability for a row to contain an '
+                                                                         'erroneous field. Default : 0')
+    parser.add_argument('--quoted-density', type=float, default=0.0, help='Probability for an alphanumeric csv field '
+                                                                          'to be quoted. Default : 0')
+    parser.add_argument('--tests', metavar='TEST', nargs='+', help='Tests to measure. By default the tests of the '
+                                                                   'structure')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generator. Default : 0')
+    parser.add_argument('--work-dir', help='Keep the generated file in this directory')
+    parser.add_argument('--output', metavar='JSON_FILE', help='Save the results in this json file')
+    parser.add_argument('--compare', metavar='JSON_FILE', help='Compare the results with a previous run')
+    args = parser.parse_args(argv)
+
+    row_type_mix = parse_row_type_mix(args.mix) if args.mix else None
+    results = run_benchmarks(args.structure, args.rows, width=args.width, row_type_mix=row_type_mix,
+                             error_density=args.error_density, quoted_density=args.quoted_density, tests=args.tests,
+                             seed=args.seed, work_dir=args.work_dir)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+    print(format_results(results, baseline))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, sort_keys=True, indent=4, separators=(',', ': '))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from ffparser import structure
+from benchmarks.generator import FlatFileGenerator
+
+
+def time_command(command, repeat, env=None):
+    """
+    Runs a command several times in a new interpreter
+    :param command: list of arguments
+    :param repeat: number of runs
+    :param env: (optional) environment of the command
+    :return: a dictionary with the median, min and max wall time in seconds
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return {'median': statistics.median(timings), 'min': min(timings), 'max': max(timings), 'runs': repeat}
+
+
+def run_startup_benchmarks(struct_path, rows=10, repeat=20, python_path=None):
+    """
+    Measures the startup of ffchecker: the import of the entry point, the parsing of the command line and a complete
+    run on a small file, each in a new interpreter as a cron job would run it
+    :param struct_path: path to a structure json file used to generate the small file
+    :param rows: number of rows of the small file
+    :param repeat: number of runs of each command
+    :param python_path: (optional) directory of the ffparser version to measure. By default the installed version
+    :return: a dictionary with the timings of each command
+    """
+    env = dict(os.environ)
+    if python_path:
+        env['PYTHONPATH'] = python_path
+
+    file_structure = structure.get_structure_from_json(struct_path)
+    work_dir = tempfile.mkdtemp()
+    try:
+        structures_dir = os.path.join(work_dir, 'structures')
+        os.makedirs(structures_dir)
+        shutil.copy(struct_path, os.path.join(structures_dir, "struct_" + file_structure.name + ".json"))
+        path = os.path.join(work_dir, "startup_" + file_structure.name + "." + file_structure.conf_type)
+        FlatFileGenerator(file_structure).write(path, rows)
+
+        commands = {
+            'python': [sys.executable, '-c', 'pass'],
+            'import': [sys.executable, '-c', 'import ffparser.ffchecker'],
+            'help': [sys.executable, '-m', 'ffparser.ffchecker', '--help'],
+            'run': [sys.executable, '-m', 'ffparser.ffchecker', path, '--config-dir', structures_dir,
+                    '--file-structure', file_structure.name, '--output-dir', work_dir, '-q'],
+        }
+        timings = {name: time_command(command, repeat, env) for name, command in commands.items()}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {'python_path': python_path, 'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), 'timings': timings}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the startup of ffchecker')
+    parser.add_argument('structure', metavar='STRUCT_FILE', help='Structure json file used to generate a small file')
+    parser.add_argument('--rows', type=int, default=10, help='Number of rows of the small file. Default : 10')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of runs of each command. Default : 20')
+    parser.add_argument('--python-path', metavar='DIR', help='Directory of the ffparser version to measure, e.g. a '
+                                                             'checkout of a previous version')
+    parser.add_argument('--output', metavar='JSON_FILE', help='Save the results in this json file')
+    parser.add_argument('--compare', metavar='JSON_FILE', help='Compare the results with a previous run')
+    args = parser.parse_args(argv)
+
+    results = run_startup_benchmarks(args.structure, args.rows, args.repeat, args.python_path)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+    print("%-10s %12s %12s %10s" % ('COMMAND', 'MEDIAN_MS', 'MIN_MS', 'VS_BASE'))
+    for name, timing in results['timings'].items():
+        change = ""
+        if baseline is not None and name in baseline['timings']:
+            # the minimum is the least sensitive to the load of the machine
+            change = "%+.1f%%" % ((timing['min'] / baseline['timings'][name]['min'] - 1) * 100)
+        print("%-10s %12.1f %12.1f %10s" % (name, timing['median'] * 1000, timing['min'] * 1000, change))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, sort_keys=True, indent=4, separators=(',', ': '))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import array
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import os.path
+import pickle
+import struct
+from ffparser import tokenizer
+
+CACHE_MAGIC = b"FFC1"
+CACHE_VERSION = 1
+CACHE_EXTENSION = ".ffc"
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+FIELD_SEPARATOR = "\x1f"
+HEADER_LENGTH_STRUCT = struct.Struct("<I")
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def hash_file(path):
+    """
+    :param path: path of the file
+    :return: the sha256 hex digest of the content of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(HASH_BLOCK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def hash_structure(file_structure):
+    """
+    :param file_structure: a FlatFileStructure object
+    :return: a digest of the definition of the structure, including its row structures
+    """
+    definition = dict(file_structure.__dict__)
+    definition['row_structures'] = [row_structure.__dict__ for row_structure in file_structure.row_structures]
+    return hashlib.sha256(json.dumps(definition, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ParseCache(object):
+    """
+    Local cache of parsed flat files, shared by the processes using the same cache directory. Files are stored in a
+    columnar format: the values of each field position are joined in one utf-8 block, so that a file is rebuilt with a
+    few C level splits instead of being parsed again. Cache files are memory mapped when read and written atomically.
+    Entries are keyed by the content hash of the file and the definition of its structure. When the size of the
+    cache exceeds its limit, the least recently used entries are removed
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        """
+        :param cache_dir: directory of the cache files. Created if needed
+        :param max_size: maximum total size of the cache files in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hashes_path = os.path.join(cache_dir, "hashes.pickle")
+
+    def get_content_hash(self, path):
+        """
+        Hashes the content of a file. Hashes are memorized with the size and modification time of the file so that an
+        unmodified file is not read again
+        :param path: path of the file
+        :return: the content hash
+        """
+        stat = os.stat(path)
+        file_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        hashes = self.read_hashes()
+        content_hash = hashes.get(file_key)
+        if content_hash is None:
+            content_hash = hash_file(path)
+            # hashes of files since modified or removed are dropped
+            hashes = {key: value for key, value in hashes.items()
+                      if key[0] != file_key[0] and os.path.exists(key[0])}
+            hashes[file_key] = content_hash
+            self.write_atomic(self.hashes_path, [pickle.dumps(hashes, pickle.HIGHEST_PROTOCOL)])
+        return content_hash
+
+    def read_hashes(self):
+        """
+        :return: the memorized content hashes, a dict of (path, size, mtime_ns): content_hash
+        """
+        try:
+            with open(self.hashes_path, "rb") as hashes_file:
+                return pickle.load(hashes_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return {}
+
+    def prune_hashes(self):
+        """
+        Drops the memorized hashes of the files which were removed or modified since they were hashed
+        :return: the number of dropped hashes
+        """
+        hashes = self.read_hashes()
+        kept = {}
+        for key, content_hash in hashes.items():
+            try:
+                stat = os.stat(key[0])
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == key[1:]:
+                kept[key] = content_hash
+        if len(kept) != len(hashes):
+            try:
+                self.write_atomic(self.hashes_path, [pickle.dumps(kept, pickle.HIGHEST_PROTOCOL)])
+            except OSError:
+                return 0
+        return len(hashes) - len(kept)
+
+    def get_cache_path(self, path, file_structure):
+        key = hashlib.sha256((self.get_content_hash(path) + hash_structure(file_structure)
+                              + str(CACHE_VERSION)).encode('ascii')).hexdigest()
+        return os.path.join(self.cache_dir, key + CACHE_EXTENSION)
+
+    def get(self, path, file_structure):
+        """
+        Reads the parsed rows of a file from the cache
+        :param path: path of the flat file
+        :param file_structure: structure used to parse the file
+        :return: a (rows, encoding_errors) tuple or None if the file is not in the cache
+        """
+        cache_path = self.get_cache_path(path, file_structure)
+        try:
+            with open(cache_path, "rb") as cache_file:
+                with mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as data, tokenizer.paused_gc():
+                    entry = read_entry(data)
+        except (OSError, ValueError):
+            return None
+        try:
+            # the modification time of an entry is its last use
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, path, file_structure, rows, encoding_errors=None):
+        """
+        Stores the parsed rows of a file and evicts the least recently used entries if the cache is full
+        :param path: path of the flat file
+        :param file_structure: structure used to parse the file
+        :param rows: list of rows, a row being a list of fields
+        :param encoding_errors: (optional) decoding errors found while reading the file
+        :return: True if the rows were stored. Rows holding the field separator of the cache format are not stored
+        """
+        chunks = build_entry(rows, encoding_errors or [])
+        if chunks is None:
+            return False
+        cache_path = self.get_cache_path(path, file_structure)
+        try:
+            self.write_atomic(cache_path, chunks)
+        except OSError:
+            return False
+        self.evict()
+        return True
+
+    def write_atomic(self, path, chunks):
+        tmp_path = path + "." + str(os.getpid()) + ".tmp"
+        try:
+            with open(tmp_path, "wb") as tmp_file:
+                for chunk in chunks:
+                    tmp_file.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache size is under its limit. The memorized hashes of the
+        files since removed or modified are dropped along with them
+        :return: list of the removed cache files
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total_size = sum(size for mtime, size, name in entries)
+        removed = []
+        for mtime, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total_size -= size
+            removed.append(name)
+        if removed:
+            self.prune_hashes()
+        return removed
+
+
+def build_entry(rows, encoding_errors):
+    """
+    Serializes rows in the columnar cache format:
+    CACHE_MAGIC, the length of the json header (uint32 little endian), the json header, then the data blocks which
+    [offset, length] from the end of the header are listed in the header. Each 'columns' block holds the utf-8 values
+    of a field position joined by FIELD_SEPARATOR, missing fields of short rows being empty. The optional
+    'row_lengths' block holds the number of fields of each row as uint32 when the rows do not all have the same length
+    :param rows: list of rows
+    :param encoding_errors: list of (line_number, byte_offset, message) tuples
+    :return: list of bytes chunks, or None if a value holds FIELD_SEPARATOR
+    """
+    row_lengths = array.array('I', map(len, rows))
+    width = max(row_lengths) if rows else 0
+    min_width = min(row_lengths) if rows else 0
+    blocks = []
+    for position in range(width):
+        if min_width > position:
+            column = FIELD_SEPARATOR.join([row[position] for row in rows])
+        else:
+            column = FIELD_SEPARATOR.join([row[position] if len(row) > position else "" for row in rows])
+        if column.count(FIELD_SEPARATOR) != len(rows) - 1:
+            return None
+        blocks.append(column.encode('utf-8', errors='surrogatepass'))
+    columns_count = len(blocks)
+    if min_width != width:
+        blocks.append(row_lengths.tobytes())
+
+    offset = 0
+    positions = []
+    for block in blocks:
+        positions.append([offset, len(block)])
+        offset += len(block)
+    header = json.dumps({'version': CACHE_VERSION, 'rows': len(rows), 'columns': positions[:columns_count],
+                         'row_lengths': positions[columns_count] if len(blocks) > columns_count else None,
+                         'encoding_errors': encoding_errors}).encode('utf-8')
+    return [CACHE_MAGIC, HEADER_LENGTH_STRUCT.pack(len(header)), header] + blocks
+
+
+def read_entry(data):
+    """
+    Rebuilds the rows of a cache entry
+    :param data: bytes like object holding the entry, e.g. a mmap
+    :return: a (rows, encoding_errors) tuple
+    """
+    if data[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+        raise ValueError("Not a parse cache file")
+    start = len(CACHE_MAGIC) + HEADER_LENGTH_STRUCT.size
+    header_length = HEADER_LENGTH_STRUCT.unpack(data[len(CACHE_MAGIC):start])[0]
+    header = json.loads(data[start:start + header_length].decode('utf-8'))
+    if header['version'] != CACHE_VERSION:
+        raise ValueError("Unsupported parse cache version " + str(header['version']))
+    start += header_length
+    row_count = header['rows']
+    encoding_errors = [tuple(error) for error in header['encoding_errors']]
+    if row_count == 0:
+        return [], encoding_errors
+
+    columns = []
+    for offset, length in header['columns']:
+        column = data[start + offset:start + offset + length].decode('utf-8', errors='surrogatepass')
+        columns.append(column.split(FIELD_SEPARATOR))
+    if not columns:
+        return [[] for idx in range(row_count)], encoding_errors
+    rows = list(map(list, zip(*columns)))
+
+    if header['row_lengths'] is not None:
+        offset, length = header['row_lengths']
+        row_lengths = array.array('I')
+        row_lengths.frombytes(data[start + offset:start + offset + length])
+        width = len(columns)
+        for idx in itertools.compress(range(row_count), map(width.__ne__, row_lengths)):
+            del rows[idx][row_lengths[idx]:]
+    return rows, encoding_errors
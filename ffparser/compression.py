@@ -0,0 +1,86 @@
+import io
+import os.path
+
+MAGIC_NUMBERS = [(b"\x1f\x8b", 'gzip'),
+                 (b"BZh", 'bz2'),
+                 (b"\xfd7zXZ\x00", 'xz'),
+                 (b"PK\x03\x04", 'zip')]
+# a bzip2 header is followed by the block size digit and by the magic of the first block, or of the end of an empty
+# stream, so that text files starting with 'BZh' are not taken for bzip2 files
+BZIP2_BLOCK_SIZES = b"123456789"
+BZIP2_BLOCK_MAGICS = (b"1AY&SY", b"\x17rE8P\x90")
+
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zip': '.zip'}
+
+
+def detect_compression(path):
+    """
+    Detects the compression of a file from its first bytes
+    :param path: path to the file
+    :return: 'gzip', 'bz2', 'xz', 'zip' or None if the file is not compressed
+    """
+    with open(path, "rb") as file:
+        head = file.read(10)
+    for magic, compression in MAGIC_NUMBERS:
+        if not head.startswith(magic):
+            continue
+        if compression == 'bz2' and (head[3:4] not in BZIP2_BLOCK_SIZES or head[3:4] == b""
+                                     or head[4:10] not in BZIP2_BLOCK_MAGICS):
+            continue
+        return compression
+    return None
+
+
+def strip_compression_extension(filename):
+    """
+    Removes the compression extension of a filename, e.g. 'ART_01.csv.gz' becomes 'ART_01.csv'
+    :param filename: name or path of a file
+    :return: the filename without its compression extension
+    """
+    root, ext = os.path.splitext(filename)
+    if ext.lower() in COMPRESSION_EXTENSIONS.values():
+        return root
+    return filename
+
+
+def open_binary(path):
+    """
+    Opens a file in binary mode. Compressed files are decompressed on the fly while being read
+    :param path: path to the file
+    :return: a binary file object
+    """
+    # decompression modules are imported on use to keep the startup of ffchecker short
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, "rb")
+    if compression == 'gzip':
+        import gzip
+        return gzip.open(path, "rb")
+    if compression == 'bz2':
+        import bz2
+        return bz2.open(path, "rb")
+    if compression == 'xz':
+        import lzma
+        return lzma.open(path, "rb")
+
+    import zipfile
+    with zipfile.ZipFile(path) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if len(members) != 1:
+            raise Exception("Zip archive " + path + " must contain exactly one file. Found " + str(len(members)))
+        # the archive file stays open until the member is closed
+        return archive.open(members[0])
+
+
+def open_text(path, encoding=None, newline=None, errors=None):
+    """
+    Opens a file in text mode as the built-in open would. Compressed files are decompressed on the fly
+    :param path: path to the file
+    :param encoding: encoding of the file content
+    :param newline: newline mode, see the built-in open
+    :param errors: decoding error handler, see the built-in open
+    :return: a text file object
+    """
+    if detect_compression(path) is None:
+        return open(path, "r", encoding=encoding, newline=newline, errors=errors)
+    return io.TextIOWrapper(open_binary(path), encoding=encoding, newline=newline, errors=errors)
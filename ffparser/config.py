@@ -1,12 +1,12 @@
 import json
 import os
-import platform
+import sys
 import glob
 import argparse
 
 
-
-system = platform.system().lower()
+# sys.platform is used rather than the platform module which is slow to import
+system = {'win32': 'windows'}.get(sys.platform, sys.platform)
 if system not in ('linux','windows'):
     raise Exception("Unknown OS. Must be Linux or Windows")
 
@@ -21,6 +21,7 @@ CONF_DATA_TYPES = ['plugins', 'structures', 'schemas']
 
 GLOBAL_CONFIG_PATH = os.path.join(CONF_DIR[system], "global_config.json")
 TEST_CONFIGS_PATH = os.path.join(DATA_DIR[system], "test_configs.json")
+TEST_INDEX_PATH = os.path.join(DATA_DIR[system], "test_index.json")
 SCHEMAS = ['csv','pos']
 
 
@@ -76,10 +77,38 @@ class GlobalConfig:
         self.structures_dir = cfg['structures_dir']
         self.schemas_dir = cfg['schemas_dir']
         self.test_configs = cfg['test_configs']
-        self.schemas = {}
-        for schema in SCHEMAS:
-            with open(os.path.join(self.schemas_dir, cfg['schemas'][schema])) as csv_schema_path:
-                self.schemas[schema] = json.load(csv_schema_path)
+        self.schema_files = cfg['schemas']
+        self._schemas = None
+
+    @property
+    def schemas(self):
+        """
+        Json schemas of the structure files, read on first access
+        """
+        if self._schemas is None:
+            schemas = {}
+            for schema in SCHEMAS:
+                with open(os.path.join(self.schemas_dir, self.schema_files[schema])) as csv_schema_path:
+                    schemas[schema] = json.load(csv_schema_path)
+            self._schemas = schemas
+        return self._schemas
+
+
+_global_configs = {}
+
+
+def get_global_config(file_path=None):
+    """
+    Returns the global config, loaded once per process on first use
+    :param file_path: (optional) path to the global config file. By default GLOBAL_CONFIG_PATH
+    :return: a GlobalConfig object
+    """
+    if file_path is None:
+        file_path = GLOBAL_CONFIG_PATH
+    global_config = _global_configs.get(file_path)
+    if global_config is None:
+        global_config = _global_configs[file_path] = GlobalConfig(file_path)
+    return global_config
 
 
 if __name__ == "__main__":
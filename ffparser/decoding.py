@@ -0,0 +1,172 @@
+import codecs
+import io
+import locale
+from ffparser import progress
+
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+# line boundaries of str.splitlines other than the line feed and the carriage return, which are not line ends
+OTHER_LINE_BOUNDARIES = ("\x0b", "\x0c", "\x1c", "\x1d", "\x1e", "\x85", "\u2028", "\u2029")
+
+
+def is_ascii_compatible(encoding):
+    """
+    Tells if the ASCII characters of an encoding, and in particular the line feed, are encoded on one byte as in
+    ASCII. Lines of such encodings can be split in the raw bytes
+    :param encoding: name of the encoding
+    :return: True if the encoding is ASCII compatible
+    """
+    try:
+        codec = codecs.lookup(encoding)
+    except LookupError:
+        return False
+    try:
+        return codec.encode("\n\r;\"azAZ09")[0] == b"\n\r;\"azAZ09"
+    except UnicodeError:
+        return False
+
+
+class BlockDecoder(object):
+    """
+    Decodes a binary file by large blocks of whole lines, each block being decoded once and split into lines. In blocks
+    with invalid byte sequences, these sequences are replaced by the replacement character and recorded in errors, so
+    that the decoding of the rest of the file goes on. Lines end with a line feed only, as counted by the line numbers
+    of the errors and by the line index: a carriage return followed by a line feed is read as a line feed, a lone
+    carriage return stays in its line. Files which lines end with carriage returns only are rejected, as they would be
+    read as a single line. Use iter_text_lines to read the decoded lines
+    """
+    def __init__(self, file, encoding=None, block_size=DEFAULT_BLOCK_SIZE, line_index=None):
+        """
+        :param file: file object opened in binary mode
+        :param encoding: encoding of the file content. Must be ASCII compatible. By default the locale encoding
+        :param block_size: number of bytes read at once
+        :param line_index: (optional) LineIndex object receiving the offsets of the lines
+        """
+        self.file = file
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.block_size = block_size
+        # list of (line_number, byte_offset, message) tuples
+        self.errors = []
+        self.text = ""
+        self.remainder = b""
+        self.eof = False
+        self.line_number = 1
+        self.offset = 0
+        self.line_index = line_index
+        self.tracker = progress.get_tracker()
+
+    def iter_lines(self):
+        """
+        :return: a generator of the decoded lines, with their line feed
+        """
+        while self.next_block():
+            text = self.text
+            self.text = ""
+            if "\r" in text:
+                text = text.replace("\r\n", "\n")
+            # str.splitlines also splits on lone carriage returns and on other line boundaries, which are rare
+            if "\r" in text or any(separator in text for separator in OTHER_LINE_BOUNDARIES):
+                lines = io.StringIO(text, newline="\n")
+            else:
+                lines = text.splitlines(True)
+            del text
+            for line in lines:
+                yield line
+
+    def next_block(self):
+        """
+        Reads and decodes the next block of whole lines
+        :return: False at the end of the file
+        """
+        chunks = [self.remainder] if self.remainder else []
+        self.remainder = b""
+        while not self.eof:
+            data = self.file.read(self.block_size)
+            if not data:
+                self.eof = True
+                break
+            # blocks are cut after their last line feed so that no line nor multi bytes character is split. The reads
+            # without line feed are gathered in a list and only the new data is searched
+            end = data.rfind(b"\n") + 1
+            if not end and self.offset == 0 and not chunks and b"\r" in data:
+                raise Exception("Lines end with carriage returns only, which is not supported. Convert the line ends "
+                                "of the file to line feeds")
+            if end:
+                chunks.append(data[:end] if end < len(data) else data)
+                self.remainder = data[end:]
+                break
+            chunks.append(data)
+        block = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+        del chunks
+        if not block:
+            return False
+
+        line_count = block.count(b"\n")
+        block_size = len(block)
+        if self.line_index is not None:
+            # offsets are those of the original bytes, before invalid sequences are replaced
+            self.line_index.add_block(block, self.offset)
+        try:
+            self.text = block.decode(self.encoding)
+        except UnicodeDecodeError:
+            self.text = self.decode_errors(block)
+        self.line_number += line_count
+        self.offset += block_size
+        self.tracker.add_read(block_size, self.offset)
+        return True
+
+    def decode_errors(self, block):
+        """
+        Decodes a block holding invalid byte sequences. Each sequence is recorded in errors and replaced by the
+        replacement character, the rest of its line being decoded again from the end of the sequence
+        :param block: bytes of the block
+        :return: the decoded text of the block
+        """
+        encoding = self.encoding
+        line_number = self.line_number
+        line_offset = self.offset
+        lines = []
+        for raw_line in block.split(b"\n"):
+            parts = []
+            start = 0
+            while True:
+                try:
+                    parts.append(raw_line[start:].decode(encoding))
+                    break
+                except UnicodeDecodeError as err:
+                    error_start = start + err.start
+                    error_end = start + err.end
+                    self.errors.append((line_number, line_offset + error_start,
+                                        "Invalid " + encoding + " byte sequence " + repr(raw_line[error_start:error_end])
+                                        + " at byte offset " + str(line_offset + error_start) + " : " + err.reason))
+                    parts.append(raw_line[start:error_start].decode(encoding))
+                    parts.append("\ufffd")
+                    start = error_end
+            lines.append("".join(parts))
+            line_number += 1
+            line_offset += len(raw_line) + 1
+        return "\n".join(lines)
+
+    def close(self):
+        self.file.close()
+
+
+def iter_text_lines(file, encoding=None, errors=None, block_size=DEFAULT_BLOCK_SIZE, line_index=None):
+    """
+    Iterates over the lines of a file. Binary files are decoded by blocks when the encoding is ASCII compatible,
+    otherwise through a text wrapper
+    :param file: file object opened in text or binary mode
+    :param encoding: encoding of the file content
+    :param errors: (optional) list receiving the (line_number, byte_offset, message) decoding errors of binary files
+    :param block_size: number of bytes read at once
+    :param line_index: (optional) LineIndex object receiving the offsets of the lines of binary files decoded by
+    blocks. It stays empty for other files
+    :return: an iterable of text lines
+    """
+    if isinstance(file, io.TextIOBase):
+        return file
+    if encoding is not None and not is_ascii_compatible(encoding):
+        return io.TextIOWrapper(file, encoding=encoding)
+    decoder = BlockDecoder(file, encoding, block_size, line_index)
+    if errors is not None:
+        decoder.errors = errors
+    return decoder.iter_lines()
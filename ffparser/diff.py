@@ -0,0 +1,266 @@
+import argparse
+import itertools
+import math
+import os
+import os.path
+import sys
+import time
+from ffparser import compression, config, duplicates, ffchecker, memory, structure, writers
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+MAX_PARTITIONS = 4096
+
+
+class FileDiff(object):
+    """
+    Compares two versions of a flat file by key. As in FlatFile.parse_groups, the record of a key is the group of the
+    rows holding this key at the key_pos of their row structure. Each row is read once from each file, the files being
+    streamed. When the files do not fit in the memory budget, their rows are first partitioned on disk by the hash of
+    their key, then the partitions are compared one at a time
+    """
+    def __init__(self, old_filename, new_filename, file_structure, memory_budget=None, spill_dir=None):
+        """
+        :param old_filename: path of the previous version of the file
+        :param new_filename: path of the new version of the file
+        :param file_structure: structure of both files
+        :param memory_budget: (optional) approximate memory used by the groups of a partition in bytes. By default
+        half of the memory left by the memory governor, or DEFAULT_MEMORY_BUDGET
+        :param spill_dir: (optional) directory of the partition files
+        """
+        self.old_filename = old_filename
+        self.new_filename = new_filename
+        self.file_structure = file_structure
+        if memory_budget is None:
+            available = memory.get_governor().available()
+            memory_budget = available // 2 if available is not None else DEFAULT_MEMORY_BUDGET
+        self.memory_budget = max(1, memory_budget)
+        self.spill_dir = spill_dir
+        # rows without row structure or key, which cannot be compared
+        self.unkeyed_rows = [0, 0]
+        self.type_index = file_structure.type_pos - 1
+
+    def get_partition_count(self):
+        size = 0
+        for filename in (self.old_filename, self.new_filename):
+            file_size = os.path.getsize(filename)
+            # compressed files are estimated to be five times larger once decompressed
+            size += file_size * 5 if compression.detect_compression(filename) is not None else file_size
+        return min(MAX_PARTITIONS, max(1, int(math.ceil(float(size * memory.ROWS_MEMORY_FACTOR)
+                                                         / self.memory_budget))))
+
+    def iter_keyed_rows(self, filename, side):
+        """
+        :param filename: path of the file
+        :param side: 0 for the old file, 1 for the new file
+        :return: a generator of (line_number, key, row) tuples of the rows with a key
+        """
+        flat_file = ffchecker.FlatFile(compression.open_binary(filename), self.file_structure, filename=filename,
+                                       stream=True)
+        type_index = self.type_index
+        key_positions = {}
+        line_number = 0
+        for batch in flat_file.iter_batches():
+            for row in batch:
+                line_number += 1
+                row_type = row[type_index] if len(row) > type_index else ""
+                key_pos = key_positions.get(row_type)
+                if key_pos is None:
+                    row_struct = flat_file.get_row_structure_from_type(row_type)
+                    key_pos = key_positions[row_type] = row_struct.key_pos if not isinstance(row_struct, str) else 0
+                if not key_pos or len(row) < key_pos:
+                    self.unkeyed_rows[side] += 1
+                    continue
+                yield line_number, row[key_pos - 1], row
+
+    def iter_partitions(self):
+        """
+        :return: a generator of (old_groups, new_groups) tuples, dictionaries key -> list of (line_number, row) of the
+        keys of a partition
+        """
+        partition_count = self.get_partition_count()
+        if partition_count == 1:
+            yield tuple(self.group_rows(self.iter_keyed_rows(filename, side))
+                        for side, filename in enumerate((self.old_filename, self.new_filename)))
+            return
+
+        sides = []
+        try:
+            for side, filename in enumerate((self.old_filename, self.new_filename)):
+                partitions = duplicates.SpillPartitions(self.spill_dir, partition_count, "ffparser_diff_")
+                sides.append(partitions)
+                for line_number, key, row in self.iter_keyed_rows(filename, side):
+                    partitions.add(hash(key), line_number, (key, row), sum(map(len, row)) + 8 * len(row))
+            for old_records, new_records in zip(*[self.iter_all_partitions(partitions) for partitions in sides]):
+                yield (self.group_rows((line_number, key, row) for line_number, (key, row) in old_records),
+                       self.group_rows((line_number, key, row) for line_number, (key, row) in new_records))
+        finally:
+            for partitions in sides:
+                partitions.close()
+
+    def iter_all_partitions(self, partitions):
+        # empty partitions are read as empty so that the partitions of both files stay aligned
+        partitions.flush()
+        for path in partitions.paths:
+            yield partitions.iter_records(path) if os.path.exists(path) else iter(())
+
+    def group_rows(self, keyed_rows):
+        groups = {}
+        for line_number, key, row in keyed_rows:
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [(line_number, row)]
+            else:
+                group.append((line_number, row))
+        return groups
+
+    def iter_changes(self):
+        """
+        Compares the files
+        :return: a generator of (change_type, key, old_group, new_group, changes) tuples, change_type being 'ADDED_KEY',
+        'REMOVED_KEY' or 'MODIFIED_KEY', the groups being lists of (line_number, row) or None, and changes a list of
+        (old_line_number, new_line_number, field positions) of the modified rows. Changes are ordered by partition,
+        then by line of the new file, removed keys coming last
+        """
+        for old_groups, new_groups in self.iter_partitions():
+            for key, new_group in sorted(new_groups.items(), key=lambda item: item[1][0][0]):
+                old_group = old_groups.pop(key, None)
+                if old_group is None:
+                    yield 'ADDED_KEY', key, None, new_group, []
+                    continue
+                changes = compare_groups(old_group, new_group, self.type_index)
+                if changes:
+                    yield 'MODIFIED_KEY', key, old_group, new_group, changes
+            for key, old_group in sorted(old_groups.items(), key=lambda item: item[1][0][0]):
+                yield 'REMOVED_KEY', key, old_group, None, []
+
+
+def compare_groups(old_group, new_group, type_index=0):
+    """
+    Compares the rows of a key in both files. Identical rows are matched whatever their order, then the rows left are
+    paired by row type in the order of the files
+    :param old_group: list of (line_number, row) of the old file
+    :param new_group: list of (line_number, row) of the new file
+    :param type_index: index of the row type in a row
+    :return: list of (old_line_number, new_line_number, field_positions) of the rows which differ, sorted by line of
+    the new file. A row missing on one side has None as line number and all its positions
+    """
+    unmatched = {}
+    for line_number, row in old_group:
+        unmatched.setdefault(tuple(row), []).append(line_number)
+    new_rows = []
+    for line_number, row in new_group:
+        old_lines = unmatched.get(tuple(row))
+        if old_lines:
+            old_lines.pop(0)
+        else:
+            new_rows.append((line_number, row))
+    old_rows = sorted((line_number, list(row)) for row, old_lines in unmatched.items() for line_number in old_lines)
+
+    def by_type(entries):
+        types = {}
+        for line_number, row in entries:
+            types.setdefault(row[type_index] if len(row) > type_index else "", []).append((line_number, row))
+        return types
+
+    changes = []
+    old_types = by_type(old_rows)
+    new_types = by_type(new_rows)
+    for row_type in set(old_types) | set(new_types):
+        for old_entry, new_entry in itertools.zip_longest(old_types.get(row_type, []), new_types.get(row_type, [])):
+            old_row = old_entry[1] if old_entry is not None else []
+            new_row = new_entry[1] if new_entry is not None else []
+            positions = [pos + 1 for pos, (old_value, new_value)
+                         in enumerate(itertools.zip_longest(old_row, new_row)) if old_value != new_value]
+            changes.append((old_entry[0] if old_entry is not None else None,
+                            new_entry[0] if new_entry is not None else None, positions))
+    changes.sort(key=lambda change: (change[1] is None, change[1] or change[0]))
+    return changes
+
+
+def format_change(change_type, key, old_group, new_group, changes):
+    """
+    :return: the message describing a change, see FileDiff.iter_changes
+    """
+    if change_type == 'ADDED_KEY':
+        return "Key '" + key + "' added with " + str(len(new_group)) + " rows"
+    if change_type == 'REMOVED_KEY':
+        return "Key '" + key + "' removed. It had " + str(len(old_group)) + " rows"
+    descriptions = []
+    for old_line, new_line, positions in changes:
+        if old_line is None:
+            descriptions.append("row added at line " + str(new_line))
+        elif new_line is None:
+            descriptions.append("row of old line " + str(old_line) + " removed")
+        else:
+            descriptions.append("fields " + ", ".join(map(str, positions)) + " changed at line " + str(new_line)
+                                + " (old line " + str(old_line) + ")")
+    return "Key '" + key + "' modified : " + "; ".join(descriptions)
+
+
+def main(argv=None):
+    """
+    Entry point of the ffdiff command
+    :param argv: (optional) list of command line arguments. By default the arguments of the process
+    :return: the exit code of the command: 0 if the files have the same records, 1 if they differ, 2 on error
+    """
+    parser = argparse.ArgumentParser(description='Compare two versions of a flat file by key')
+    parser.add_argument('old_file', metavar='OLD_FILE', help='Previous version of the file')
+    parser.add_argument('new_file', metavar='NEW_FILE', help='New version of the file')
+    parser.add_argument('--config-dir', metavar='CONFIG-DIR', help='Directory with the file structures. Default : the '
+                                                                   'structures directory of the global config')
+    parser.add_argument('--file-structure', metavar='STRUCT_NAME', help='Name of the file structure of both files. By '
+                                                                        'default detected from the name of the new '
+                                                                        'file')
+    parser.add_argument('--output-dir', metavar='OUTPUT_DIR', help='Directory of the diff file. Default : current '
+                                                                   'directory')
+    parser.add_argument('--output-format', choices=sorted(writers.RESULT_WRITERS), default='csv',
+                        help='Format of the diff file. Default : csv')
+    parser.add_argument('--max-memory', type=int, metavar='MB', help='Memory used to compare the files in megabytes. '
+                                                                     'Larger files are partitioned on disk. Default : '
+                                                                     + str(DEFAULT_MEMORY_BUDGET // (1024 * 1024)))
+    parser.add_argument('--spill-dir', metavar='DIR', help='Directory of the partition files')
+    parser.add_argument('-q', '--quiet', action='store_true', help='If enabled nothing is prompted on screen')
+    args = parser.parse_args(argv)
+
+    config_dir = args.config_dir or config.get_global_config().structures_dir
+    structure_index = structure.load_structure_index(config_dir)
+    if args.file_structure:
+        file_structure = structure_index.structures.get(args.file_structure)
+    else:
+        file_structure = structure_index.get_struct_from_pattern(args.new_file)
+    if file_structure is None:
+        print("ERROR. Could not find any file structure for file '" + args.new_file + "'")
+        return 2
+
+    output_dir = args.output_dir or os.getcwd()
+    output_filename = os.path.join(output_dir, "diff_" + time.strftime("%Y%m%d%H%M%S")
+                                   + writers.RESULT_WRITERS[args.output_format].extension)
+    file_diff = FileDiff(args.old_file, args.new_file, file_structure,
+                         args.max_memory * 1024 * 1024 if args.max_memory else None, args.spill_dir)
+    counts = {'ADDED_KEY': 0, 'REMOVED_KEY': 0, 'MODIFIED_KEY': 0}
+    old_name = os.path.basename(args.old_file)
+    new_name = os.path.basename(args.new_file)
+    output_writer = writers.open_result_writer(output_filename, args.output_format)
+    try:
+        for change in file_diff.iter_changes():
+            change_type, key, old_group, new_group, changes = change
+            counts[change_type] += 1
+            if change_type == 'REMOVED_KEY':
+                output_writer.write_record(old_name, old_group[0][0], False, change_type, format_change(*change))
+            else:
+                output_writer.write_record(new_name, new_group[0][0], False, change_type, format_change(*change))
+    finally:
+        output_writer.close()
+
+    if not args.quiet:
+        print(str(counts['ADDED_KEY']) + " keys added, " + str(counts['REMOVED_KEY']) + " removed, "
+              + str(counts['MODIFIED_KEY']) + " modified between " + args.old_file + " and " + args.new_file)
+        if any(file_diff.unkeyed_rows):
+            print(str(file_diff.unkeyed_rows[0]) + " and " + str(file_diff.unkeyed_rows[1])
+                  + " rows without key were not compared")
+        print("Differences logged in file " + output_filename)
+    return 1 if any(counts.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
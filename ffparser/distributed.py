@@ -0,0 +1,419 @@
+import collections
+import io
+import json
+import os
+import os.path
+import socket
+import threading
+import time
+from ffparser import compression, ffchecker, structure, testcase
+
+CONNECT_TIMEOUT = 30
+MAX_ATTEMPTS = 3
+
+
+def parse_address(address, default_host="127.0.0.1"):
+    """
+    :param address: 'HOST:PORT', ':PORT' or 'PORT'
+    :param default_host: host used when the address has none
+    :return: a (host, port) tuple
+    """
+    host, sep, port = str(address).rpartition(":")
+    return host or default_host, int(port)
+
+
+def send_message(file, message):
+    file.write(json.dumps(message).encode('utf-8') + b"\n")
+    file.flush()
+
+
+def read_message(file):
+    """
+    :param file: binary file object of a socket
+    :return: the next message, or None if the connection is closed
+    """
+    line = file.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+class WorkUnit(object):
+    """
+    Part of a file checked by a worker: the whole file, or the lines starting in a byte range of an uncompressed file
+    """
+    def __init__(self, unit_id, filename, structure_name, start=0, end=None):
+        """
+        :param unit_id: identifier of the unit
+        :param filename: path of the file, readable by the workers
+        :param structure_name: name of the file structure
+        :param start: offset of the range
+        :param end: (optional) end of the range, excluded. By default the end of the file
+        """
+        self.unit_id = unit_id
+        self.filename = filename
+        self.structure_name = structure_name
+        self.start = start
+        self.end = end
+        self.attempts = 0
+
+    def to_dict(self):
+        return {'type': 'unit', 'id': self.unit_id, 'filename': self.filename, 'structure': self.structure_name,
+                'start': self.start, 'end': self.end}
+
+
+def has_whole_file_tests(file_structure):
+    """
+    :param file_structure: structure of a file
+    :return: True if a test of the structure needs the whole file (see testcase.whole_file_test), or cannot be found
+    """
+    from ffparser import config
+    plugin_dirs = [config.get_global_config().plugin_dir]
+    try:
+        return any(testcase.is_whole_file_test(testcase.get_test_callable_by_name(test_name, plugin_dirs))
+                   for test_name in file_structure.tests)
+    except Exception:
+        # missing tests are reported by the worker checking the file
+        return True
+
+
+def split_file(filename, file_structure, split_size, first_id=0):
+    """
+    Splits a file into work units. Only uncompressed positional files and csv files without quote character are split
+    by byte range, as a quoted csv field may hold a line break. Files of which structure has tests needing the whole
+    file, e.g. control totals, duplicates or key order, are not split: their results on each range would be wrong
+    :param filename: path of the file
+    :param file_structure: structure of the file
+    :param split_size: (optional) size in bytes of the ranges. By default files are not split
+    :param first_id: identifier of the first unit
+    :return: list of WorkUnit objects in the order of the file
+    """
+    splittable = file_structure.conf_type == 'pos' or not getattr(file_structure, 'quotechar', None)
+    splittable = splittable and not has_whole_file_tests(file_structure)
+    size = os.path.getsize(filename)
+    if not split_size or not splittable or size <= split_size or compression.detect_compression(filename) is not None:
+        return [WorkUnit(first_id, filename, file_structure.name)]
+    return [WorkUnit(first_id + idx, filename, file_structure.name, start, min(start + split_size, size))
+            for idx, start in enumerate(range(0, size, split_size))]
+
+
+def read_range(filename, start, end):
+    """
+    Reads the lines starting in a byte range of a file
+    :param filename: path of an uncompressed file
+    :param start: offset of the range
+    :param end: end of the range, excluded
+    :return: the bytes of the lines
+    """
+    with open(filename, "rb") as file:
+        if start > 0:
+            # the line running over the start of the range belongs to the previous range
+            file.seek(start - 1)
+            file.readline()
+        data_start = file.tell()
+        if data_start >= end:
+            return b""
+        data = file.read(end - data_start)
+        if not data.endswith(b"\n"):
+            data += file.readline()
+    return data
+
+
+class RangeFlatFile(ffchecker.FlatFile):
+    """
+    FlatFile holding the lines of a byte range of a file. Line numbers of its results are relative to the range
+    """
+    def __init__(self, data, file_structure, filename):
+        self.data = data
+        ffchecker.FlatFile.__init__(self, io.BytesIO(data), file_structure, filename=filename)
+
+    def open_raw(self, encoding=None, newline=None, errors=None):
+        return io.TextIOWrapper(io.BytesIO(self.data), encoding=encoding, newline=newline, errors=errors)
+
+
+def check_unit(unit, structures, test_sandbox=None):
+    """
+    Runs the tests of a work unit
+    :param unit: unit message sent by the coordinator
+    :param structures: dictionary name -> FlatFileStructure of the worker
+    :param test_sandbox: (optional) Sandbox object running the tests in worker processes
+    :return: the result message
+    """
+    file_structure = structures.get(unit['structure'])
+    if file_structure is None:
+        return {'type': 'result', 'id': unit['id'], 'error': "Unknown file structure '" + unit['structure'] + "'"}
+    try:
+        if unit['end'] is None:
+            flat_file = ffchecker.load_flat_file(unit['filename'], file_structure)
+        else:
+            flat_file = RangeFlatFile(read_range(unit['filename'], unit['start'], unit['end']), file_structure,
+                                      unit['filename'])
+        suite_result = flat_file.run_defined_tests(test_sandbox)
+    except testcase.TestExecException as err:
+        return {'type': 'result', 'id': unit['id'], 'exec_error': [err.test_name, err.msg]}
+    except Exception as err:
+        return {'type': 'result', 'id': unit['id'], 'error': str(err) or type(err).__name__}
+    tcs = [[getattr(tc, 'test_name', None),
+            [[step.line_number, step.status, step.error_type, step.message, step.filename, step.field_pos,
+              step.last_line, step.ref_line] for step in tc.steps]] for tc in suite_result.tcs]
+    return {'type': 'result', 'id': unit['id'], 'rows': len(flat_file.rows), 'tcs': tcs}
+
+
+def run_worker(address, config_dir=None, test_sandbox=None, connect_timeout=CONNECT_TIMEOUT):
+    """
+    Connects to a coordinator and checks the work units it sends until it has no more. The files of the units must be
+    readable at the same paths as on the coordinator, and the worker must have the same file structures
+    :param address: (host, port) of the coordinator
+    :param config_dir: (optional) directory of the file structures. By default the one of the global config
+    :param test_sandbox: (optional) Sandbox object running the tests in worker processes
+    :param connect_timeout: number of seconds the worker retries to connect, for a coordinator still starting
+    :return: the number of units checked
+    """
+    from ffparser import config
+    structures = structure.load_structure_index(config_dir or config.get_global_config().structures_dir).structures
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            connection = socket.create_connection(address)
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    units = 0
+    with connection, connection.makefile("rwb") as file:
+        while True:
+            send_message(file, {'type': 'ready', 'pid': os.getpid()})
+            message = read_message(file)
+            if message is None or message['type'] == 'done':
+                return units
+            send_message(file, check_unit(message, structures, test_sandbox))
+            units += 1
+
+
+class Coordinator(object):
+    """
+    Hands work units to the workers connecting to it over TCP and collects their results. Messages are JSON objects,
+    one per line: a worker sends {"type": "ready"}, and receives either a unit {"type": "unit", ...} to which it
+    answers {"type": "result", ...}, or {"type": "done"}. The unit of a worker which disconnects or exceeds the unit
+    timeout is handed to another worker, up to MAX_ATTEMPTS times
+    """
+    def __init__(self, address, units, unit_timeout=None):
+        """
+        :param address: (host, port) the coordinator listens on. Port 0 picks a free port
+        :param units: list of WorkUnit objects
+        :param unit_timeout: (optional) number of seconds a worker may spend on a unit
+        """
+        self.units = {unit.unit_id: unit for unit in units}
+        self.pending = collections.deque(units)
+        self.results = {}
+        # number of workers connected
+        self.connected = 0
+        self.unit_timeout = unit_timeout
+        self.condition = threading.Condition()
+        self.server_socket = socket.create_server(address)
+        self.address = self.server_socket.getsockname()[:2]
+
+    def is_done(self):
+        return len(self.results) == len(self.units)
+
+    def next_unit(self):
+        """
+        :return: the next unit to check, or None when all the units have a result
+        """
+        with self.condition:
+            while not self.pending and not self.is_done():
+                # units in progress may come back if their worker dies
+                self.condition.wait(1.0)
+            if self.is_done():
+                return None
+            unit = self.pending.popleft()
+            unit.attempts += 1
+            return unit
+
+    def requeue(self, unit, reason):
+        with self.condition:
+            if unit.unit_id in self.results:
+                return
+            if unit.attempts >= MAX_ATTEMPTS:
+                self.results[unit.unit_id] = {'type': 'result', 'id': unit.unit_id,
+                                              'error': "Unit failed on " + str(unit.attempts) + " workers. Last "
+                                                       "error : " + reason}
+            else:
+                self.pending.appendleft(unit)
+            self.condition.notify_all()
+
+    def add_result(self, unit, result):
+        with self.condition:
+            self.results.setdefault(unit.unit_id, result)
+            self.condition.notify_all()
+
+    def fail_units(self, reason):
+        """
+        Gives an error result to the units without result
+        :param reason: error message
+        :return: None
+        """
+        with self.condition:
+            for unit_id in self.units:
+                self.results.setdefault(unit_id, {'type': 'result', 'id': unit_id, 'error': reason})
+            self.pending.clear()
+            self.condition.notify_all()
+
+    def handle_worker(self, connection):
+        with self.condition:
+            self.connected += 1
+        try:
+            self.serve_worker(connection)
+        finally:
+            with self.condition:
+                self.connected -= 1
+                self.condition.notify_all()
+
+    def serve_worker(self, connection):
+        connection.settimeout(self.unit_timeout)
+        with connection, connection.makefile("rwb") as file:
+            while True:
+                try:
+                    message = read_message(file)
+                except (OSError, ValueError):
+                    return
+                if message is None:
+                    return
+                unit = self.next_unit()
+                if unit is None:
+                    try:
+                        send_message(file, {'type': 'done'})
+                    except OSError:
+                        pass
+                    return
+                try:
+                    send_message(file, unit.to_dict())
+                    result = read_message(file)
+                except socket.timeout:
+                    self.requeue(unit, "worker timed out")
+                    return
+                except (OSError, ValueError) as err:
+                    self.requeue(unit, str(err) or type(err).__name__)
+                    return
+                if result is None or result.get('id') != unit.unit_id:
+                    self.requeue(unit, "worker disconnected")
+                    return
+                self.add_result(unit, result)
+
+    def accept_workers(self):
+        while True:
+            try:
+                connection, address = self.server_socket.accept()
+            except OSError:
+                # the server socket is closed once all the results are collected
+                return
+            threading.Thread(target=self.handle_worker, args=(connection,), daemon=True).start()
+
+    def run(self, processes=None):
+        """
+        Serves the units until all of them have a result
+        :param processes: (optional) list of the multiprocessing.Process objects of the local workers. Once none of
+        them is alive and no worker is connected, the units left get an error result instead of waiting for workers
+        :return: dictionary unit_id -> result message
+        """
+        threading.Thread(target=self.accept_workers, daemon=True).start()
+        try:
+            with self.condition:
+                while not self.is_done():
+                    self.condition.wait(1.0)
+                    if processes and not self.connected and not any(process.is_alive() for process in processes):
+                        self.fail_units("No worker left to check the unit, the local workers exited with codes "
+                                        + ", ".join(str(process.exitcode) for process in processes))
+        finally:
+            self.server_socket.close()
+        return self.results
+
+
+def start_local_workers(address, count, config_dir=None):
+    """
+    Starts worker processes on this host
+    :param address: (host, port) of the coordinator
+    :param count: number of workers
+    :param config_dir: (optional) directory of the file structures
+    :return: list of the started multiprocessing.Process objects
+    """
+    import multiprocessing
+    processes = []
+    for idx in range(count):
+        process = multiprocessing.Process(target=run_worker, args=(address, config_dir), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def merge_unit_results(filename, units, results):
+    """
+    Builds the result of a file from the results of its units, line numbers of the ranges being shifted by the number
+    of rows of the ranges before them
+    :param filename: path of the file
+    :param units: WorkUnit objects of the file, in the order of the file
+    :param results: dictionary unit_id -> result message
+    :return: a TestSuiteResult object, or a (error_type, test_name, message) tuple if a unit could not be checked
+    """
+    suite_result = testcase.TestSuiteResult()
+    tcs = collections.OrderedDict()
+    first_line = 0
+    for unit in units:
+        result = results[unit.unit_id]
+        if 'exec_error' in result:
+            return 'TEST_EXEC_ERROR_' + result['exec_error'][0], result['exec_error'][0], result['exec_error'][1]
+        if 'error' in result:
+            return 'WORKER_ERROR', None, result['error'] + ". File " + filename
+        for test_name, steps in result['tcs']:
+            tc = tcs.get(test_name)
+            if tc is None:
+                tc = tcs[test_name] = testcase.TestCaseResult()
+                tc.test_name = test_name
+            for line_number, status, error_type, message, step_filename, field_pos, last_line, ref_line in steps:
+                if isinstance(line_number, int):
+                    line_number += first_line
+                    last_line += first_line
+                if isinstance(ref_line, int):
+                    ref_line += first_line
+                tc.steps.append(testcase.TestCaseStepResult(line_number, status, error_type, message, step_filename,
+                                                            field_pos=field_pos, last_line=last_line,
+                                                            ref_line=ref_line))
+        first_line += result['rows']
+    suite_result.tcs = list(tcs.values())
+    return suite_result
+
+
+def check_files(file_structures, address, local_workers=0, config_dir=None, split_size=None, unit_timeout=None,
+                quiet=False):
+    """
+    Checks files with the workers connecting to a coordinator
+    :param file_structures: list of (filename, FlatFileStructure) tuples
+    :param address: (host, port) the coordinator listens on
+    :param local_workers: number of worker processes started on this host
+    :param config_dir: (optional) directory of the file structures of the local workers
+    :param split_size: (optional) size in bytes of the byte ranges large files are split in
+    :param unit_timeout: (optional) number of seconds a worker may spend on a unit
+    :param quiet: if enabled nothing is printed
+    :return: dictionary filename -> TestSuiteResult or (error_type, test_name, message) tuple, see merge_unit_results
+    """
+    file_units = []
+    units = []
+    for filename, file_structure in file_structures:
+        file_units.append((filename, split_file(filename, file_structure, split_size, len(units))))
+        units.extend(file_units[-1][1])
+    coordinator = Coordinator(address, units, unit_timeout)
+    host, port = coordinator.address
+    if not quiet:
+        print("Coordinator listening on " + host + ":" + str(port) + " with " + str(len(units)) + " work units")
+    if host in ("0.0.0.0", "::", ""):
+        host = "127.0.0.1"
+    processes = start_local_workers((host, port), local_workers, config_dir)
+    try:
+        results = coordinator.run(processes)
+    finally:
+        for process in processes:
+            process.join(CONNECT_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+    return {filename: merge_unit_results(filename, units_of_file, results) for filename, units_of_file in file_units}
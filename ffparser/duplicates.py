@@ -0,0 +1,238 @@
+import os
+import pickle
+import shutil
+import tempfile
+from ffparser import memory
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 3
+MIN_ROW_SIZE = 8
+# approximate memory used by a key in a set or dictionary, besides the key itself
+ENTRY_OVERHEAD = 100
+SPILL_PARTITIONS = 64
+SPILL_CHUNK_SIZE = 4 * 1024 * 1024
+HASH_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+class BloomFilter(object):
+    """
+    Set membership test with false positives but no false negatives, in a fixed memory of size bits. Values are
+    hashed with the built-in hash so filters of different processes must not be compared
+    """
+    def __init__(self, size, hashes=BLOOM_HASHES):
+        """
+        :param size: number of bits of the filter
+        :param hashes: number of bits set per value
+        """
+        self.size = max(8, size)
+        self.hashes = hashes
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, hashed):
+        """
+        Adds a value to the filter
+        :param hashed: 64 bits hash of the value
+        :return: True if the value was possibly already in the filter, False if it was not
+        """
+        bits = self.bits
+        size = self.size
+        # double hashing: the positions are derived from the two halves of the hash
+        position = hashed & 0xFFFFFFFF
+        step = (hashed >> 32) | 1
+        found = True
+        for idx in range(self.hashes):
+            bit = position % size
+            mask = 1 << (bit & 7)
+            if not bits[bit >> 3] & mask:
+                bits[bit >> 3] |= mask
+                found = False
+            position += step
+        return found
+
+
+class SpillPartitions(object):
+    """
+    Temporary files holding (line_number, key) records partitioned by the hash of the key, so that each partition can
+    be processed alone in memory. Records are written by pickled chunks and read back in the order of writing
+    """
+    def __init__(self, spill_dir=None, partitions=SPILL_PARTITIONS, prefix="ffparser_duplicates_"):
+        """
+        :param spill_dir: (optional) directory of the temporary files. By default the temporary directory of the system
+        :param partitions: number of partitions
+        :param prefix: prefix of the name of the temporary directory
+        """
+        self.directory = tempfile.mkdtemp(prefix=prefix, dir=spill_dir)
+        self.paths = [os.path.join(self.directory, "partition_" + str(idx)) for idx in range(partitions)]
+        self.buffers = [[] for idx in range(partitions)]
+        self.buffered_size = 0
+
+    def add(self, hashed, line_number, key, size=None):
+        """
+        :param hashed: hash of the key, selecting the partition
+        :param line_number: line of the record
+        :param key: key of the record, or any picklable value
+        :param size: (optional) approximate size of the value in bytes. By default the length of the key
+        :return: None
+        """
+        self.buffers[hashed % len(self.buffers)].append((line_number, key))
+        self.buffered_size += (len(key) if size is None else size) + ENTRY_OVERHEAD
+        if self.buffered_size > SPILL_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        for path, buffer in zip(self.paths, self.buffers):
+            if buffer:
+                with open(path, "ab") as partition_file:
+                    pickle.dump(buffer, partition_file, pickle.HIGHEST_PROTOCOL)
+                del buffer[:]
+        self.buffered_size = 0
+
+    def iter_partitions(self):
+        """
+        :return: a generator of iterators over the (line_number, key) records of each partition
+        """
+        self.flush()
+        for path in self.paths:
+            if os.path.exists(path):
+                yield self.iter_records(path)
+
+    def iter_records(self, path):
+        with open(path, "rb") as partition_file:
+            while True:
+                try:
+                    records = pickle.load(partition_file)
+                except EOFError:
+                    return
+                for record in records:
+                    yield record
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class DuplicateFinder(object):
+    """
+    Finds the rows of a flat file sharing the same key in a bounded memory, reading the rows twice.
+    The first pass hashes the keys into a Bloom filter: keys possibly seen before are candidates. The second pass keeps
+    the first line of each candidate key in a dictionary and reports the following lines with the same key. When the
+    memory budget is exceeded, the candidate keys are spilled to partitions on disk which are then processed one at a
+    time. In stream mode the rows themselves are never held in memory
+    """
+    def __init__(self, key_function, memory_budget=DEFAULT_MEMORY_BUDGET, spill_dir=None):
+        """
+        :param key_function: function returning the key of a row as a string, or None if the row has no key
+        :param memory_budget: approximate number of bytes used by the Bloom filter, the candidates and the keys in
+        memory
+        :param spill_dir: (optional) directory of the spill files
+        """
+        self.key_function = key_function
+        available = memory.get_governor().available()
+        if available is not None:
+            # the finder takes at most half of the memory left in the budget of the run
+            memory_budget = max(1024 * 1024, min(memory_budget, available // 2))
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+
+    def iter_keys(self, flat_file_object):
+        """
+        :param flat_file_object: FlatFile object
+        :return: a generator of (line_number, key) tuples of the rows with a key
+        """
+        key_function = self.key_function
+        line_number = 0
+        for batch in flat_file_object.iter_batches():
+            for row in batch:
+                line_number += 1
+                key = key_function(row)
+                if key is not None:
+                    yield line_number, key
+
+    def get_candidates(self, flat_file_object):
+        """
+        First pass: hashes of the keys found more than once by the Bloom filter
+        :param flat_file_object: FlatFile object
+        :return: a set of hashes, or None if there are too many candidates to be held in the memory budget, in which
+        case all the keys are candidates
+        """
+        if flat_file_object.rows is not None:
+            expected_keys = len(flat_file_object.rows)
+        else:
+            # stream mode: at most one row every MIN_ROW_SIZE bytes. Compressed files get a smaller filter, with more
+            # false positives
+            expected_keys = os.path.getsize(flat_file_object.filename) // MIN_ROW_SIZE
+        bloom_size = min(expected_keys * BLOOM_BITS_PER_KEY, self.memory_budget * 8 // 2)
+        bloom_filter = BloomFilter(bloom_size)
+        max_candidates = (self.memory_budget - len(bloom_filter.bits)) // ENTRY_OVERHEAD
+        candidates = set()
+        add = bloom_filter.add
+        for line_number, key in self.iter_keys(flat_file_object):
+            hashed = hash(key) & HASH_MASK
+            if add(hashed):
+                candidates.add(hashed)
+                if len(candidates) > max_candidates:
+                    return None
+        return candidates
+
+    def find(self, flat_file_object):
+        """
+        Finds the duplicate keys of a file
+        :param flat_file_object: FlatFile object
+        :return: a list of (line_number, first_line_number, key) tuples sorted by line, one per row which key was found
+        on a previous row, first_line_number being the line of the first occurrence of the key
+        """
+        candidates = self.get_candidates(flat_file_object)
+        if candidates is not None and not candidates:
+            return []
+        duplicates = []
+        first_lines = {}
+        used_memory = len(candidates) * ENTRY_OVERHEAD if candidates is not None else 0
+        partitions = None
+        try:
+            for line_number, key in self.iter_keys(flat_file_object):
+                hashed = hash(key) & HASH_MASK
+                if candidates is not None and hashed not in candidates:
+                    continue
+                if partitions is not None:
+                    partitions.add(hashed, line_number, key)
+                    continue
+                first_line = first_lines.get(key)
+                if first_line is not None:
+                    duplicates.append((line_number, first_line, key))
+                    continue
+                first_lines[key] = line_number
+                used_memory += len(key) + ENTRY_OVERHEAD
+                if used_memory > self.memory_budget:
+                    # the first occurrences kept so far precede the following records in each partition
+                    partitions = SpillPartitions(self.spill_dir)
+                    for first_key, first_line in first_lines.items():
+                        partitions.add(hash(first_key) & HASH_MASK, first_line, first_key)
+                    first_lines = {}
+
+            if partitions is not None:
+                for records in partitions.iter_partitions():
+                    first_lines = {}
+                    for line_number, key in records:
+                        first_line = first_lines.get(key)
+                        if first_line is None:
+                            first_lines[key] = line_number
+                        else:
+                            duplicates.append((line_number, first_line, key))
+        finally:
+            if partitions is not None:
+                partitions.close()
+        duplicates.sort()
+        return duplicates
+
+
+def get_duplicate_finder(flat_file_object, key_function):
+    """
+    :param flat_file_object: the FlatFile object containing the content of the flat file and file structure
+    :param key_function: function returning the key of a row, or None if the row has no key
+    :return: a DuplicateFinder object using the optional 'duplicates_memory_budget' (megabytes) and
+    'duplicates_spill_dir' of the file structure
+    """
+    memory_budget = getattr(flat_file_object.structure, 'duplicates_memory_budget', None)
+    memory_budget = memory_budget * 1024 * 1024 if memory_budget else DEFAULT_MEMORY_BUDGET
+    spill_dir = getattr(flat_file_object.structure, 'duplicates_spill_dir', None)
+    return DuplicateFinder(key_function, memory_budget, spill_dir)
@@ -1,53 +1,97 @@
-import csv
-from ffparser import config, structure, testcase
-import ffparser.testlib
-import ffparser.testlib.common
+from ffparser import compression, config, decoding, groups, lineindex, memory, profiling, progress, stats, structure, summary, testcase, tokenizer, writers
+import io
+import json
 import os.path
 import re
 import argparse
 import sys
 import glob
 import time
-import traceback
 
 
-GLOBAL_CONFIG = config.GlobalConfig(config.GLOBAL_CONFIG_PATH)
+def __getattr__(name):
+    # the global config used to be loaded at import time, it is now loaded on first access
+    if name == 'GLOBAL_CONFIG':
+        return config.get_global_config()
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
 
 
 class FlatFile(object):
-    def __init__(self, file, file_structure):
+    def __init__(self, file, file_structure, filename=None, stream=False, line_index=False):
         """
         Object holding the data and the file structure of a flat file. According to the file type "csv" or "pos"
         the lines are parsed with different methods
-        :param file: file object of the file to be treated
+        :param file: file object of the file to be treated. A file opened in binary mode is decoded by blocks with the
+        encoding of the structure, invalid byte sequences being reported as ENCODING_ERROR results instead of stopping
+        the load
         :param file_structure: file structure used to parse the file
+        :param filename: (optional) path of the file. By default the name of the file object. Must be given for
+        decompressed streams which name is not the path of the file
+        :param stream: if enabled the rows are not loaded in memory. They are tokenized from the file on each call of
+        iter_batches, the file being opened again after the first pass. Tests using the rows attribute cannot be run
+        :param line_index: if enabled the byte offsets of the lines are recorded while the file is read, in the
+        line_index attribute, so that the raw lines of the results can be read again directly. Only binary files with an
+        ASCII compatible encoding are indexed, otherwise and in stream mode line_index is None
         """
         self.structure = file_structure
-        self.filename = file.name
+        self.filename = filename if filename is not None else file.name
         # if the file structure is not csv
         if file_structure.conf_type == 'csv':
-            rows = list(csv.reader(file, delimiter=self.structure.sep, quotechar="\""))
+            file_tokenizer = tokenizer.CsvTokenizer.from_structure(file_structure)
         elif file_structure.conf_type == 'pos':
-            # strip is used to remove carriage return
-            raw_rows = [line.rstrip() for line in file]
-            rows = []
-            for idx, raw_row in enumerate(raw_rows):
-                row = []
-                line_index = 0
-                # to correctly cut the fields we need to refer to the correct row structure. For this we use a line type
-                # which start and stop positions are defined in the structure object
-                row_type = raw_row[self.structure.type_limits[0] - 1:self.structure.type_limits[1]]
-                row_structure = self.get_row_structure_from_type(row_type)
-                for length in row_structure.lengths:
-                    # appends a field starting with the current position and ending at field length
-                    row.append(raw_row[line_index:line_index + length])
-                    line_index = line_index + length
-                rows.append(row)
+            # to correctly cut the fields we need to refer to the correct row structure. For this we use a line type
+            # which start and stop positions are defined in the structure object
+            file_tokenizer = tokenizer.PosTokenizer(file_structure, self.get_row_structure_from_type)
         else:
             raise Exception("Structure conf_type must be 'pos' or 'csv'. Not " + file_structure.conf_type)
+        self.tokenizer = file_tokenizer
+        self.file = None
+        # (line_number, byte_offset, message) of the invalid byte sequences found while decoding
+        self.encoding_errors = []
+        self.line_index = None
+        if stream:
+            self.file = file
+            self.rows = None
+            return
+
+        if line_index and not isinstance(file, io.TextIOBase) and decoding.is_ascii_compatible(file_structure.encoding):
+            self.line_index = lineindex.LineIndex()
+        profiler = profiling.get_profiler()
+        # with a memory budget, smaller blocks are read when the memory left is short
+        governor = memory.get_governor()
+        file_tokenizer.batch_size = governor.scale(file_tokenizer.batch_size, testcase.MIN_BATCH_SIZE)
+        tracker = progress.get_tracker()
+        rows = []
+        with profiler.phase('flat_file.load'), tokenizer.paused_gc():
+            lines = decoding.iter_text_lines(file, file_structure.encoding, self.encoding_errors,
+                                             governor.scale(decoding.DEFAULT_BLOCK_SIZE, memory.MIN_BLOCK_SIZE),
+                                             line_index=self.line_index)
+            for batch in file_tokenizer.iter_batches(lines):
+                rows.extend(batch)
+                tracker.add_rows(len(batch))
+        profiler.count('rows', len(rows))
 
         self.rows = rows
 
+    @classmethod
+    def from_rows(cls, rows, file_structure, filename):
+        """
+        Builds a FlatFile object from rows already parsed, e.g. by another process
+        :param rows: list of rows, a row being a list of fields
+        :param file_structure: file structure of the file
+        :param filename: path of the file
+        :return: a FlatFile object
+        """
+        flat_file = cls.__new__(cls)
+        flat_file.structure = file_structure
+        flat_file.filename = filename
+        flat_file.tokenizer = None
+        flat_file.file = None
+        flat_file.encoding_errors = []
+        flat_file.line_index = None
+        flat_file.rows = rows
+        return flat_file
+
     def get_row_structure_from_type(self, row_type):
         """
         Finds a row structure with the correct type within row structures available in the FlatFile object
@@ -68,6 +112,61 @@ class FlatFile(object):
 
         return matching_row_structure[0]
 
+    def open_raw(self, encoding=None, newline=None, errors=None):
+        """
+        Opens the file again to read its raw lines. Compressed files are decompressed on the fly
+        :param encoding: encoding of the file content
+        :param newline: newline mode, see the built-in open
+        :param errors: decoding error handler, see the built-in open. Tests reading the raw lines use 'replace' as
+        the invalid byte sequences are already reported as ENCODING_ERROR
+        :return: a text file object
+        """
+        return compression.open_text(self.filename, encoding=encoding, newline=newline, errors=errors)
+
+    def iter_batches(self, batch_size=tokenizer.DEFAULT_BATCH_SIZE):
+        """
+        Yields the rows of the file in batches, for tests processing several rows at once
+        :param batch_size: maximum number of rows per batch
+        :return: a generator of lists of rows
+        """
+        if self.rows is not None:
+            for start in range(0, len(self.rows), batch_size):
+                yield self.rows[start:start + batch_size]
+            return
+
+        # stream mode: the file given to the constructor is used for the first pass only
+        file = self.file
+        self.file = None
+        if file is None:
+            file = compression.open_binary(self.filename)
+        self.tokenizer.batch_size = batch_size
+        encoding_errors = []
+        tracker = progress.get_tracker()
+        try:
+            with tokenizer.paused_gc():
+                lines = decoding.iter_text_lines(file, self.structure.encoding, encoding_errors)
+                for batch in self.tokenizer.iter_batches(lines):
+                    tracker.add_rows(len(batch))
+                    yield batch
+        finally:
+            file.close()
+        self.encoding_errors = encoding_errors
+
+    def collect_statistics(self, top_n=stats.DEFAULT_TOP_N, hll_precision=stats.DEFAULT_HLL_PRECISION):
+        """
+        Collects statistics per row type and per field in a single pass over the rows: null rate, min/max length,
+        estimated number of distinct values, most frequent values and numeric ranges of the digit and decimal
+        fields. In stream mode the file is read in bounded memory
+        :param top_n: number of most frequent values reported per field
+        :param hll_precision: precision of the distinct values estimators, see stats.HyperLogLog
+        :return: a FileStatistics object
+        """
+        file_stats = stats.FileStatistics(self.structure, self.get_row_structure_from_type, top_n, hll_precision)
+        with profiling.get_profiler().phase('flat_file.statistics'):
+            for batch in self.iter_batches():
+                file_stats.update(batch)
+        return file_stats
+
     def parse_groups(self):
         """
         Parses a group of a rows with a give common key
@@ -88,6 +187,14 @@ class FlatFile(object):
 
         return groups
 
+    def iter_key_groups(self, batch_size=tokenizer.DEFAULT_BATCH_SIZE):
+        """
+        Streams the groups of consecutive rows with a common key of a file sorted by key, see groups.iter_key_groups
+        :param batch_size: number of rows read at once
+        :return: a generator of KeyGroup objects
+        """
+        return groups.iter_key_groups(self, batch_size)
+
     def run_test_case(self, test_name):
         """
         Run the test test_name. It must be implemented in a submodule within the testlib module or in a module within
@@ -95,121 +202,537 @@ class FlatFile(object):
         :param test_name: name of the test. If two test have the same name, the first will be uesed
         :return: the result of the test inside a TestCaseResult object
         """
-        global_config = config.GlobalConfig(config.GLOBAL_CONFIG_PATH)
-        tc_config = testcase.get_test_case_config_from_name(test_name)
+        with profiling.get_profiler().phase('test_case.config'):
+            global_config = config.get_global_config()
+            tc_config = testcase.get_test_case_config_from_name(test_name)
         tc = testcase.TestCase(test_name, tc_config, [global_config.plugin_dir])
         return tc.run(self)
 
-    def run_test_suite(self, test_list):
+    def run_test_suite(self, test_list, test_sandbox=None):
         """
         Run a set of tests with given names
         :param test_list: list of tests
+        :param test_sandbox: (optional) Sandbox object running the tests in worker processes
         :return:
         """
-        suite_result = ffparser.testcase.TestSuiteResult()
-        for test in test_list:
-            tc_result = self.run_test_case(test)
-            suite_result.tcs.append(tc_result)
+        if test_sandbox is not None:
+            with profiling.get_profiler().phase('test_suite.sandbox'):
+                suite_result = test_sandbox.run_test_suite(self, test_list)
+        else:
+            suite_result = testcase.TestSuiteResult()
+            for test in test_list:
+                tc_result = self.run_test_case(test)
+                suite_result.tcs.append(tc_result)
+        # in stream mode the encoding errors are known once the tests have read the file
+        if self.encoding_errors:
+            suite_result.tcs.insert(0, self.get_encoding_result())
         return suite_result
 
-    def run_defined_tests(self):
-        return self.run_test_suite(self.structure.tests)
+    def get_encoding_result(self):
+        """
+        :return: a TestCaseResult with an ENCODING_ERROR step per invalid byte sequence found while decoding the file
+        """
+        result = testcase.TestCaseResult()
+        result.test_name = 'encoding'
+        filename = os.path.basename(self.filename)
+        for line_number, byte_offset, message in self.encoding_errors:
+            result.steps.append(testcase.TestCaseStepResult(line_number, False, 'ENCODING_ERROR', message, filename))
+        return result
+
+    def run_defined_tests(self, test_sandbox=None):
+        return self.run_test_suite(self.structure.tests, test_sandbox)
 
     def list_keys(self):
         return self.parse_groups().keys()
 
 
-def main():
+def load_flat_file(filename, file_structure, parse_cache=None, line_index=False):
+    """
+    Loads a flat file, from the parse cache if it holds the file
+    :param filename: path of the file
+    :param file_structure: structure of the file
+    :param parse_cache: (optional) ParseCache object. Files missing from the cache are added once parsed
+    :param line_index: if enabled the line index of the file is built, see FlatFile
+    :return: a FlatFile object
+    """
+    profiler = profiling.get_profiler()
+    if parse_cache is not None:
+        with profiler.phase('cache.get'):
+            entry = parse_cache.get(filename, file_structure)
+        if entry is not None:
+            profiler.count('cache_hits')
+            flat_file = FlatFile.from_rows(entry[0], file_structure, filename)
+            flat_file.encoding_errors = entry[1]
+            if line_index:
+                with profiler.phase('flat_file.line_index'):
+                    flat_file.line_index = lineindex.build_line_index(filename)
+            return flat_file
+
+    if not fits_in_memory(filename, file_structure):
+        # the tests read the rows by batches, the file is read again for each of them instead of being loaded
+        return FlatFile(compression.open_binary(filename), file_structure, filename=filename, stream=True)
+
+    with compression.open_binary(filename) as file:
+        flat_file = FlatFile(file, file_structure, filename=filename, line_index=line_index)
+    if parse_cache is not None:
+        with profiler.phase('cache.put'):
+            parse_cache.put(filename, file_structure, flat_file.rows, flat_file.encoding_errors)
+    return flat_file
+
+
+def fits_in_memory(filename, file_structure):
+    """
+    Tells if the rows of a file can be loaded in the memory left by the memory budget. A file which does not fit can
+    still be tested in stream mode if all the tests of its structure read the rows by batches, see
+    testcase.is_streaming_test
+    :param filename: path of the file
+    :param file_structure: structure of the file
+    :return: False if the file does not fit and can be tested in stream mode
+    """
+    governor = memory.get_governor()
+    if not governor.enabled or compression.detect_compression(filename) is not None:
+        return True
+    if governor.fits(os.path.getsize(filename) * memory.ROWS_MEMORY_FACTOR):
+        return True
+    plugin_dirs = [config.get_global_config().plugin_dir]
+    try:
+        test_callables = [testcase.get_test_callable_by_name(test_name, plugin_dirs)
+                          for test_name in file_structure.tests]
+        return not all(testcase.is_streaming_test(test_callable) for test_callable in test_callables)
+    except Exception:
+        # missing tests are reported when the tests are run
+        return True
+
+
+def main(argv=None):
+    """
+    Entry point of the ffchecker command
+    :param argv: (optional) list of command line arguments. By default the arguments of the process
+    :return: the exit code of the command
+    """
     parser = argparse.ArgumentParser(description='Check a csv file structure')
-    parser.add_argument('csv_files', metavar='FILES', nargs='+',
+    parser.add_argument('csv_files', metavar='FILES', nargs='*',
                         help='Files to be checked')
     parser.add_argument('--config-dir',
                         metavar='CONFIG-DIR',
-                        help='Directory with the file structures. Default : ' + GLOBAL_CONFIG.structures_dir,
-                        default=GLOBAL_CONFIG.structures_dir)
+                        help='Directory with the file structures. Default : the structures directory of the global '
+                             'config')
     parser.add_argument('--file-structure', metavar='STRUCT_NAME', help='Name of the file structure to use,'
                                                                         ' by default csvchecker detects the '
                                                                         'file structure from filename pattern')
     parser.add_argument('--output-dir', metavar='OUTPUT_DIR', help='Defines the output directory. By default the '
                                                                    'directory is current directory')
-    parser.add_argument('--no-output', action='store_true', help='If enabled no csv result file')
+    parser.add_argument('--no-output', action='store_true', help='If enabled no result file')
+    parser.add_argument('--output-format', choices=sorted(writers.RESULT_WRITERS), default='csv',
+                        help='Format of the result file. parquet requires pyarrow. Default : csv')
+    parser.add_argument('--coalesce', action='store_true', help='If enabled the identical errors of consecutive lines, '
+                                                                'with the same error type and field, are reported '
+                                                                'once with their range of lines')
+    parser.add_argument('--summary', action='store_true', help='If enabled a json summary of the results is written '
+                                                               'next to the result file, or instead of it with '
+                                                               '--no-output')
+    parser.add_argument('--summary-examples', type=int, default=5, metavar='N',
+                        help='Number of examples kept per error type in the summary. Default : 5')
+    parser.add_argument('--summary-top', type=int, default=10, metavar='N',
+                        help='Number of most offending fields listed in the summary. Default : 10')
+    parser.add_argument('--stats', action='store_true', help='If enabled the tests are not run. Statistics per row '
+                                                             'type and field are collected in a single streaming pass '
+                                                             'and written in stats_<timestamp>.json in the output '
+                                                             'directory')
+    parser.add_argument('--stats-top', type=int, default=stats.DEFAULT_TOP_N, metavar='N',
+                        help='Number of most frequent values reported per field with --stats. Default : '
+                             + str(stats.DEFAULT_TOP_N))
+    parser.add_argument('--sandbox', action='store_true', help='If enabled each test runs in a worker process with '
+                                                               'the time and memory limits below. A failing test is '
+                                                               'reported as TEST_EXEC_ERROR and the others keep '
+                                                               'running')
+    parser.add_argument('--sandbox-workers', type=int, metavar='N', help='With --sandbox, number of tests running at '
+                                                                         'the same time. Default : number of CPUs')
+    parser.add_argument('--test-timeout', type=float, metavar='SECONDS', help='With --sandbox, time limit of a test')
+    parser.add_argument('--test-memory-limit', type=int, metavar='MB', help='With --sandbox, memory limit of a test '
+                                                                            'worker in megabytes')
+    parser.add_argument('--cache-dir', metavar='CACHE_DIR', help='Directory of a cache of the parsed files shared by '
+                                                                 'the runs using it. A file already parsed with the '
+                                                                 'same structure is read from the cache')
+    parser.add_argument('--cache-size', type=int, metavar='MB', help='Size limit of the parse cache in megabytes. '
+                                                                      'Least recently used files are removed first. '
+                                                                      'Default : 1024')
+    parser.add_argument('--sample', type=int, metavar='N', help='If given the tests run on a random sample of N lines '
+                                                                'of each file, and the error rate of the file is '
+                                                                'estimated with a confidence interval. Tests needing '
+                                                                'the whole file, e.g. control totals and duplicates, '
+                                                                'are not run')
+    parser.add_argument('--sample-seed', type=int, metavar='SEED', help='Seed of the random sampling, for '
+                                                                        'reproducible samples')
+    parser.add_argument('--sample-confidence', type=float, default=0.95, metavar='LEVEL',
+                        help='Confidence level of the estimated error rate. Default : 0.95')
+    parser.add_argument('--coordinator', metavar='[HOST:]PORT', help='If given the files are checked by the workers '
+                                                                     'connecting to this address, see --worker. '
+                                                                     'The workers must read the files at the same '
+                                                                     'paths and have the same file structures')
+    parser.add_argument('--local-workers', type=int, default=0, metavar='N', help='With --coordinator, number of '
+                                                                                  'workers started on this host')
+    parser.add_argument('--split-size', type=int, metavar='MB', help='With --coordinator, uncompressed positional '
+                                                                     'files and csv files without quote character '
+                                                                     'larger than this size are split in byte '
+                                                                     'ranges checked apart. Files tested for control '
+                                                                     'totals, duplicates or key order are not split')
+    parser.add_argument('--unit-timeout', type=float, metavar='SECONDS', help='With --coordinator, time after which '
+                                                                              'the unit of a worker is given to '
+                                                                              'another worker')
+    parser.add_argument('--worker', metavar='HOST:PORT', help='If given ffchecker checks the work units of the '
+                                                              'coordinator at this address until it has no more')
+    parser.add_argument('--max-memory', type=int, metavar='MB', help='Memory budget of the run in megabytes. Blocks, '
+                                                                     'batches and workers are sized from the memory '
+                                                                     'left, results are spilled to disk before the '
+                                                                     'budget is reached and files too large for it '
+                                                                     'are streamed when all their tests read the '
+                                                                     'rows by batches')
+    parser.add_argument('--line-index', action='store_true', help='If enabled the byte offsets of the lines of the '
+                                                                  'checked files are saved next to the result file, '
+                                                                  'to show the lines of the results with '
+                                                                  'python -m ffparser.lineindex')
+    parser.add_argument('--context', type=int, metavar='N', help='If given each error is prompted with its line and '
+                                                                 'the N lines around it')
     parser.add_argument('-v', '--verbose', action='store_true', help='If enabled results will be prompted with more '
                                                                      'verbosity')
     parser.add_argument('-q', '--quiet', action='store_true', help='If enabled no result will be prompted on screen')
+    parser.add_argument('--profile', action='store_true', help='If enabled the time spent in each phase and test is '
+                                                               'measured and saved in a json stats file')
+    parser.add_argument('--profile-output', metavar='STATS_FILE', help='Path of the json stats file. By default '
+                                                                       'profile_<timestamp>.json in the output '
+                                                                       'directory')
+    parser.add_argument('--profile-cprofile', action='store_true', help='With --profile, also capture the run with '
+                                                                        'cProfile in STATS_FILE.prof')
+    parser.add_argument('--profile-tracemalloc', action='store_true', help='With --profile, also trace memory '
+                                                                           'allocations with tracemalloc')
+    parser.add_argument('--progress', action='store_true', help='If enabled a progress line with the rows and bytes '
+                                                                'processed, the throughput, the errors and the time '
+                                                                'left is updated on the standard error')
+    parser.add_argument('--progress-interval', type=float, metavar='SECONDS', default=progress.DEFAULT_INTERVAL,
+                        help='Number of seconds between two writes of the status files. Default : '
+                             + str(progress.DEFAULT_INTERVAL))
+    parser.add_argument('--status-file', metavar='JSON_FILE', help='Path of a json file where the progress of the run '
+                                                                   'is written at each interval')
+    parser.add_argument('--prometheus-file', metavar='PROM_FILE', help='Path of a Prometheus textfile where the '
+                                                                       'progress metrics are written at each interval, '
+                                                                       'e.g. for the node exporter textfile collector')
+
+    args = parser.parse_args(argv)
+    if not args.csv_files and not args.worker:
+        parser.error("the following arguments are required: FILES")
+    # the run changes process wide settings, restored for the next in process caller of main
+    previous_governor = memory.get_governor()
+    previous_coalescing = testcase.get_step_coalescing()
+    previous_tracker = progress.get_tracker()
+    try:
+        if args.max_memory:
+            memory.set_governor(memory.MemoryGovernor(args.max_memory * 1024 * 1024))
+        if args.coalesce:
+            testcase.set_step_coalescing(True)
+        if args.progress or args.status_file or args.prometheus_file:
+            progress.set_tracker(progress.ProgressTracker(console=args.progress and not args.quiet,
+                                                          status_file=args.status_file,
+                                                          prometheus_file=args.prometheus_file,
+                                                          interval=args.progress_interval))
+        if args.profile:
+            return run_profiled(args)
+        return run(args)
+    finally:
+        memory.set_governor(previous_governor)
+        testcase.set_step_coalescing(previous_coalescing)
+        progress.set_tracker(previous_tracker)
+
+
+def run_profiled(args):
+    """
+    Checks the files given on the command line with the profiler enabled, and saves the profiling stats
+    :param args: parsed command line arguments
+    :return: the exit code of the command
+    """
+    previous_profiler = profiling.get_profiler()
+    profiler = profiling.Profiler(cprofile=args.profile_cprofile, trace_memory=args.profile_tracemalloc)
+    profiling.set_profiler(profiler)
+    profiler.start()
+    try:
+        return run(args)
+    finally:
+        profiler.stop()
+        profiling.set_profiler(previous_profiler)
+        profile_output = args.profile_output
+        if not profile_output:
+            profile_output = os.path.join(args.output_dir or os.getcwd(),
+                                          "profile_" + time.strftime("%Y%m%d%H%M%S") + ".json")
+        profiler.save(profile_output)
+        if not args.quiet:
+            print("Profiling stats logged in file " + profile_output)
+
 
-    args = parser.parse_args()
+def run(args):
+    """
+    Checks the files given on the command line
+    :param args: parsed command line arguments
+    :return: the exit code of the command
+    """
+    if not args.config_dir:
+        args.config_dir = config.get_global_config().structures_dir
+
+    if args.worker:
+        from ffparser import distributed
+        test_sandbox = None
+        if args.sandbox:
+            from ffparser import sandbox
+            test_sandbox = sandbox.Sandbox(args.sandbox_workers, args.test_timeout, args.test_memory_limit)
+        units = distributed.run_worker(distributed.parse_address(args.worker), args.config_dir, test_sandbox)
+        if not args.quiet:
+            print("Checked " + str(units) + " work units")
+        return 0
 
     # default output is current directory
     if not args.output_dir:
         args.output_dir = os.getcwd()
 
-    output_filename = os.path.join(args.output_dir, "test_" + time.strftime("%Y%m%d%H%M%S") + ".csv")
+    writer_class = writers.RESULT_WRITERS[args.output_format]
+    timestamp = time.strftime("%Y%m%d%H%M%S")
+    output_filename = os.path.join(args.output_dir, "test_" + timestamp + writer_class.extension)
     try:
-        output_file = open(output_filename, "w", newline='')
+        output_writer = writers.open_result_writer(output_filename, args.output_format)
     except FileNotFoundError as e:
         print("ERROR. Could not open file ", output_filename)
         return -2
+    except Exception as err:
+        print("ERROR. " + err.args[0])
+        return -2
 
-    output_csv = csv.writer(output_file, delimiter=';', quotechar="\"")
-    output_csv.writerow(['FILENAME', 'LINE_NUMBER', 'STATUS', 'ERROR_TYPE', 'MESSAGE'])
+    summary_aggregator = None
+    if args.summary:
+        summary_aggregator = summary.SummaryAggregator(args.summary_examples, args.summary_top)
 
-    
     try:
-        config_obj = structure.get_structures_from_dir(args.config_dir)
+        return check_files(args, output_writer, output_filename, summary_aggregator)
+    finally:
+        output_writer.close()
+        if summary_aggregator is not None:
+            summary_filename = os.path.join(args.output_dir, "summary_" + timestamp + ".json")
+            summary_aggregator.save(summary_filename)
+            if not args.quiet:
+                print("Summary logged in file " + summary_filename)
+
+
+def check_files(args, output_writer, output_filename, summary_aggregator=None):
+    """
+    Checks the files given on the command line and writes the results
+    :param args: parsed command line arguments
+    :param output_writer: ResultWriter of the result file
+    :param output_filename: path of the result file
+    :param summary_aggregator: (optional) SummaryAggregator fed with the results
+    :return: the exit code of the command
+    """
+    profiler = profiling.get_profiler()
+
+    try:
+        with profiler.phase('structure.load'):
+            structure_index = structure.load_structure_index(args.config_dir)
+            config_obj = structure_index.structures
     except (structure.StructureParseException, structure.RowStructureParseException) as err:
-        output_csv.writerow([err.src_file,'','False','JSON_STRUCTURES_ERROR', err.args[0]])
+        output_writer.write_record(err.src_file, None, False, 'JSON_STRUCTURES_ERROR', err.args[0])
         print(err.args[0])
         return -1
 
-    if args.file_structure and args.file_structure not in config_obj.file_structures:
+    if args.file_structure and args.file_structure not in config_obj:
         print("Error : Could not load '" + args.file_structure + " structure from available structures ")
         return 1
 
     if args.file_structure:
-        args.file_structure = config_obj.file_structures[args.file_structure]
+        args.file_structure = config_obj[args.file_structure]
+
+    if args.sample and args.sandbox:
+        print("Error : --sample and --sandbox cannot be used together")
+        return 1
+
+    if args.coordinator and (args.sample or args.stats or args.sandbox):
+        print("Error : --coordinator cannot be used with --sample, --stats or --sandbox. Use --sandbox on the workers")
+        return 1
+
+    test_sandbox = None
+    if args.sandbox:
+        from ffparser import sandbox
+        test_sandbox = sandbox.Sandbox(args.sandbox_workers, args.test_timeout, args.test_memory_limit)
+
+    parse_cache = None
+    if args.cache_dir:
+        from ffparser import cache
+        parse_cache = cache.ParseCache(args.cache_dir, args.cache_size * 1024 * 1024 if args.cache_size
+                                       else cache.DEFAULT_CACHE_SIZE)
 
+    files_stats = {}
+    line_indexes = {}
     csv_files = []
     for csv_file in args.csv_files:
         csv_files += glob.glob(csv_file)
 
+    distributed_results = None
+    if args.coordinator:
+        from ffparser import distributed
+        file_structures = []
+        for csv_filename in csv_files:
+            file_structure = args.file_structure or structure_index.get_struct_from_pattern(csv_filename)
+            if file_structure is not None:
+                file_structures.append((csv_filename, file_structure))
+        with profiler.phase('distributed.check'):
+            distributed_results = distributed.check_files(
+                file_structures, distributed.parse_address(args.coordinator), args.local_workers, args.config_dir,
+                args.split_size * 1024 * 1024 if args.split_size else None, args.unit_timeout, args.quiet)
+
+    if summary_aggregator is not None and not args.sample:
+        # the steps of sampled files are summarized once their line numbers are translated to the file
+        keep_steps = not args.no_output or args.verbose or args.context is not None
+        testcase.set_step_summary(summary_aggregator, keep_steps)
+
+    tracker = progress.get_tracker()
+    tracker.start(csv_files)
     for csv_filename in csv_files:
+        tracker.start_file(csv_filename)
         if not args.quiet:
             print("Checking file " + csv_filename)
         if args.file_structure is None:
-            args.file_structure = structure.get_struct_from_pattern(config_obj, csv_filename)
+            with profiler.phase('structure.resolve'):
+                args.file_structure = structure_index.get_struct_from_pattern(csv_filename)
 
         if args.file_structure is None:
             if not args.quiet:
                 print("Could not find any file structure for file '" + csv_filename + "'. Skipping")
             continue
+        tracker.set_tests(args.file_structure.tests)
+
+        if args.stats:
+            csv_file = compression.open_binary(csv_filename)
+            flat_file = FlatFile(csv_file, args.file_structure, filename=csv_filename, stream=True)
+            file_stats = flat_file.collect_statistics(args.stats_top)
+            files_stats[csv_filename] = file_stats.to_dict()
+            if not args.quiet:
+                print("Collected statistics of " + str(file_stats.rows) + " rows in file " + csv_filename)
+            profiler.count('files')
+            args.file_structure = None
+            continue
 
-        csv_file = open(csv_filename, "r", encoding=args.file_structure.encoding)
-        flat_file = FlatFile(csv_file, args.file_structure)
+        flat_file = None
+        if distributed_results is not None:
+            test_result = distributed_results[csv_filename]
+            if isinstance(test_result, tuple):
+                error_type, test_name, message = test_result
+                output_writer.write_record(os.path.basename(csv_filename), None, False, error_type, message)
+                if summary_aggregator is not None:
+                    summary_aggregator.add_record(os.path.basename(csv_filename), None, False, error_type, message,
+                                                  test_name=test_name)
+                if not args.quiet:
+                    print(message)
+                args.file_structure = None
+                continue
+        elif args.sample:
+            from ffparser import sampling
+            with profiler.phase('flat_file.sample'):
+                flat_file = sampling.sample_flat_file(csv_filename, args.file_structure, args.sample,
+                                                      args.sample_seed, args.sample_confidence)
+        else:
+            try:
+                flat_file = load_flat_file(csv_filename, args.file_structure, parse_cache,
+                                           args.line_index or args.context is not None)
+            except Exception as err:
+                message = (str(err) or type(err).__name__) + ". File " + csv_filename
+                output_writer.write_record(os.path.basename(csv_filename), None, False, 'FILE_ERROR', message)
+                if summary_aggregator is not None:
+                    summary_aggregator.add_record(os.path.basename(csv_filename), None, False, 'FILE_ERROR', message)
+                if not args.quiet:
+                    print(message)
+                args.file_structure = None
+                continue
         try:
-            test_result = flat_file.run_defined_tests()
+            if flat_file is not None:
+                test_result = flat_file.run_defined_tests(test_sandbox)
         except testcase.TestExecException as err:
-            output_csv.writerow([err.filename, '', 'False', 'TEST_EXEC_ERROR_' + err.test_name, err.msg])
+            output_writer.write_record(err.filename, None, False, 'TEST_EXEC_ERROR_' + err.test_name, err.msg)
+            if summary_aggregator is not None:
+                summary_aggregator.add_record(err.filename, None, False, 'TEST_EXEC_ERROR_' + err.test_name, err.msg,
+                                              test_name=err.test_name)
             if not args.quiet and args.verbose:
                 print("Error while executing test " + err.test_name + " on file " + err.filename
                       + ". Skipping testing of file " + err.filename + ".")
+                import traceback
                 print(traceback.format_exc())
             continue
 
-        if not args.quiet and args.verbose:
-            print(test_result)
-        if not args.quiet:
-            print("Found " + str(test_result.count_failed()) + " errors in file " + csv_filename)
+        with profiler.phase('results.print'):
+            if not args.quiet and args.verbose:
+                print(test_result)
+            if not args.quiet:
+                print("Found " + str(test_result.count_failed()) + " errors in file " + csv_filename)
+                if getattr(test_result, 'estimate', None) is not None:
+                    print(test_result.estimate)
+
+        line_index = None
+        if args.line_index or args.context is not None:
+            line_index = flat_file.line_index if flat_file is not None else None
+            if line_index is None:
+                with profiler.phase('flat_file.line_index'):
+                    line_index = lineindex.build_line_index(csv_filename)
+            if args.line_index:
+                line_indexes[csv_filename] = line_index
+        if args.context is not None and not args.quiet:
+            with profiler.phase('results.context'):
+                print_context(test_result, csv_filename, line_index, args.context, args.file_structure.encoding)
+        if summary_aggregator is not None:
+            with profiler.phase('results.summary'):
+                summary_aggregator.add_suite(test_result)
         if not args.no_output:
-            test_result.to_csv(output_file)
+            with profiler.phase('results.output'):
+                output_writer.write_suite(test_result)
             if not args.quiet:
                 print("Results logged in file " + output_filename)
-        csv_file.close()
+        tracker.end_file(test_result)
+        profiler.count('files')
         args.file_structure = None
+    tracker.stop()
+    testcase.set_step_summary(None)
+
+    if line_indexes:
+        index_filename = os.path.splitext(output_filename)[0] + lineindex.INDEX_EXTENSION
+        lineindex.save_line_indexes(index_filename, line_indexes)
+        if not args.quiet:
+            print("Line index saved in file " + index_filename)
+
+    if args.stats:
+        stats_filename = os.path.join(args.output_dir, "stats_" + time.strftime("%Y%m%d%H%M%S") + ".json")
+        with open(stats_filename, "w") as stats_file:
+            json.dump(files_stats, stats_file, indent=4, separators=(',', ': '))
+        if not args.quiet:
+            print("Statistics logged in file " + stats_filename)
 
-    output_file.close()
     return 0
 
 
+def print_context(suite_result, filename, line_index, context, encoding=None):
+    """
+    Prints the failed steps of a test suite, each followed by its line and the lines around it. Coalesced steps are
+    followed by their first line
+    :param suite_result: TestSuiteResult of the file
+    :param filename: path of the file
+    :param line_index: LineIndex of the file
+    :param context: number of lines printed before and after each line
+    :param encoding: encoding of the file content
+    :return: None
+    """
+    for tc in suite_result.tcs:
+        for step in tc.steps:
+            if step.status:
+                continue
+            print(step)
+            if not isinstance(step.line_number, int) or not 1 <= step.line_number <= len(line_index):
+                continue
+            print(lineindex.format_lines(line_index.get_lines(filename, step.line_number, context, encoding),
+                                         step.line_number))
+
+
 if __name__ == "__main__":
     result = main()
     sys.exit(result)
@@ -0,0 +1,93 @@
+from ffparser import tokenizer
+
+
+class KeyGroup(object):
+    """
+    Consecutive rows of a file sharing the same key, the key being the key_pos field of their row structure
+    """
+    def __init__(self, key, first_line, rows, row_structures, previous_key=None):
+        """
+        :param key: key of the rows, None for consecutive rows without key
+        :param first_line: line number of the first row of the group
+        :param rows: list of the rows of the group
+        :param row_structures: list of the RowStructure of each row, or of the error message of the rows without row
+        structure
+        :param previous_key: (optional) key of the previous group when the key is out of order, i.e. not greater than
+        this key
+        """
+        self.key = key
+        self.first_line = first_line
+        self.rows = rows
+        self.row_structures = row_structures
+        self.previous_key = previous_key
+
+    @property
+    def out_of_order(self):
+        return self.previous_key is not None
+
+    def get_line_number(self, idx):
+        """
+        :param idx: position of a row in the group
+        :return: line number of the row in the file
+        """
+        return self.first_line + idx
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def iter_key_groups(flat_file_object, batch_size=tokenizer.DEFAULT_BATCH_SIZE):
+    """
+    Streams the groups of consecutive rows sharing a key of a file sorted by key, so that only the rows of one group are
+    held in memory, whereas FlatFile.parse_groups gathers the rows of each key over the whole file. Keys are compared as
+    strings: a key which is not greater than the key of the previous group is out of order, either because the file is
+    not sorted or because the rows of the key are not consecutive. Such groups are yielded as well, with their
+    previous_key set.
+    Rows which row structure has no key_pos, e.g. file headers and trailers, are yielded in groups of key None which do
+    not take part in the order. Rows without row structure, too short or with an empty key stay in the current group,
+    their row structure being the error message of get_row_structure_from_type for the former: they are reported by
+    the other tests
+    :param flat_file_object: FlatFile object
+    :param batch_size: number of rows read at once
+    :return: a generator of KeyGroup objects, in the order of the file
+    """
+    type_index = flat_file_object.structure.type_pos - 1
+    row_structures = {}
+    previous_key = None
+    key = None
+    first_line = 1
+    group_rows = []
+    group_structures = []
+    line_number = 0
+    for batch in flat_file_object.iter_batches(batch_size):
+        for row in batch:
+            line_number += 1
+            row_type = row[type_index] if len(row) > type_index else ""
+            row_struct = row_structures.get(row_type)
+            if row_struct is None:
+                row_struct = row_structures[row_type] = flat_file_object.get_row_structure_from_type(row_type)
+            if isinstance(row_struct, str) or (row_struct.key_pos and (len(row) < row_struct.key_pos
+                                                                        or row[row_struct.key_pos - 1] == "")):
+                row_key = key
+            else:
+                row_key = row[row_struct.key_pos - 1] if row_struct.key_pos else None
+            if row_key == key and group_rows:
+                group_rows.append(row)
+                group_structures.append(row_struct)
+                continue
+            if group_rows:
+                yield new_group(key, first_line, group_rows, group_structures, previous_key)
+                if key is not None:
+                    previous_key = key
+            key = row_key
+            first_line = line_number
+            group_rows = [row]
+            group_structures = [row_struct]
+    if group_rows:
+        yield new_group(key, first_line, group_rows, group_structures, previous_key)
+
+
+def new_group(key, first_line, rows, row_structures, previous_key):
+    if key is None or previous_key is None or key > previous_key:
+        previous_key = None
+    return KeyGroup(key, first_line, rows, row_structures, previous_key)
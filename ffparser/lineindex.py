@@ -0,0 +1,236 @@
+import argparse
+import array
+import itertools
+import json
+import os
+import os.path
+import struct
+import sys
+from ffparser import compression
+
+INDEX_MAGIC = b"FFL1"
+INDEX_VERSION = 1
+INDEX_EXTENSION = ".lines"
+HEADER_LENGTH_STRUCT = struct.Struct("<I")
+OFFSET_STRUCT = struct.Struct("<Q")
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class LineIndex(object):
+    """
+    Byte offsets of the start of each line of a file, used to read a given line without reading the lines before it.
+    Offsets are positions in the decompressed content of compressed files. Line numbers are physical line numbers:
+    they are the row numbers of the results unless a quoted csv field spans several lines
+    """
+    def __init__(self, offsets=None, size=0):
+        """
+        :param offsets: (optional) array of unsigned 64 bits offsets
+        :param size: size in bytes of the (decompressed) content
+        """
+        self.offsets = offsets if offsets is not None else array.array('Q')
+        self.size = size
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add_block(self, block, offset):
+        """
+        Adds the lines starting in a block of the file
+        :param block: bytes of the block. Blocks are read in order and only the last one may not end with a line feed
+        :param offset: offset of the block in the file
+        :return: None
+        """
+        pieces = block.split(b"\n")
+        starts = itertools.accumulate(map((1).__add__, map(len, pieces[:-1])), initial=offset)
+        # the piece after the last line feed starts a line only if it is not empty
+        self.offsets.extend(starts if pieces[-1] else itertools.islice(starts, len(pieces) - 1))
+        self.size = offset + len(block)
+
+    def get_span(self, first_line, last_line=None):
+        """
+        :param first_line: number of the first line, from 1
+        :param last_line: (optional) number of the last line. By default first_line
+        :return: the (start, end) byte offsets of the lines, end excluded
+        """
+        last_line = first_line if last_line is None else last_line
+        if not 1 <= first_line <= last_line <= len(self.offsets):
+            raise IndexError("Line " + str(first_line) + " is out of the " + str(len(self.offsets)) + " lines")
+        end = self.offsets[last_line] if last_line < len(self.offsets) else self.size
+        return self.offsets[first_line - 1], end
+
+    def get_lines(self, filename, line_number, context=0, encoding=None):
+        return get_lines(filename, len(self.offsets), self.get_span, line_number, context, encoding)
+
+
+def build_line_index(path):
+    """
+    Builds the line index of a file by reading it by blocks, for files loaded without index, e.g. from the parse cache
+    :param path: path of the file. Compressed files are decompressed on the fly
+    :return: a LineIndex object
+    """
+    line_index = LineIndex()
+    offset = 0
+    remainder = b""
+    with compression.open_binary(path) as file:
+        while True:
+            data = file.read(READ_BLOCK_SIZE)
+            if not data:
+                break
+            block = remainder + data
+            end = block.rfind(b"\n") + 1
+            remainder = block[end:]
+            if end:
+                line_index.add_block(block[:end], offset)
+                offset += end
+    if remainder:
+        line_index.add_block(remainder, offset)
+    return line_index
+
+
+def save_line_indexes(path, line_indexes):
+    """
+    Writes the line indexes of several files in one index file:
+    INDEX_MAGIC, the length of the json header (uint32 little endian), the json header listing the files with their
+    size and modification time when indexed, then the offsets of each file as uint64 little endian
+    :param path: path of the index file
+    :param line_indexes: dictionary path of the flat file -> LineIndex object
+    :return: None
+    """
+    files = []
+    position = 0
+    for filename, line_index in line_indexes.items():
+        stat = os.stat(filename)
+        files.append({'filename': os.path.abspath(filename), 'file_size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                      'size': line_index.size, 'lines': len(line_index), 'position': position})
+        position += len(line_index) * OFFSET_STRUCT.size
+    header = json.dumps({'version': INDEX_VERSION, 'files': files}).encode('utf-8')
+    with open(path, "wb") as index_file:
+        index_file.write(INDEX_MAGIC + HEADER_LENGTH_STRUCT.pack(len(header)) + header)
+        for line_index in line_indexes.values():
+            offsets = line_index.offsets
+            if sys.byteorder != 'little':
+                offsets = array.array('Q', offsets)
+                offsets.byteswap()
+            index_file.write(offsets.tobytes())
+
+
+class LineIndexFile(object):
+    """
+    Index file written by save_line_indexes. Offsets are read from the index file on demand, so a lookup reads a few
+    bytes of the index and the requested lines of the flat file whatever their sizes
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the index file
+        """
+        self.path = path
+        with open(path, "rb") as index_file:
+            if index_file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise Exception("File " + path + " is not a line index")
+            header_length = HEADER_LENGTH_STRUCT.unpack(index_file.read(HEADER_LENGTH_STRUCT.size))[0]
+            header = json.loads(index_file.read(header_length).decode('utf-8'))
+        if header['version'] != INDEX_VERSION:
+            raise Exception("Unsupported line index version " + str(header['version']))
+        self.data_start = len(INDEX_MAGIC) + HEADER_LENGTH_STRUCT.size + header_length
+        self.files = {entry['filename']: entry for entry in header['files']}
+
+    def get_entry(self, filename):
+        """
+        :param filename: path of an indexed flat file
+        :return: the header entry of the file. Raises an Exception if the file is not indexed or changed since
+        """
+        entry = self.files.get(os.path.abspath(filename))
+        if entry is None:
+            raise Exception("File " + filename + " is not in the line index " + self.path)
+        stat = os.stat(filename)
+        if stat.st_size != entry['file_size'] or stat.st_mtime_ns != entry['mtime_ns']:
+            raise Exception("File " + filename + " changed since it was indexed")
+        return entry
+
+    def get_span(self, filename, first_line, last_line=None):
+        """
+        :param filename: path of an indexed flat file
+        :param first_line: number of the first line, from 1
+        :param last_line: (optional) number of the last line. By default first_line
+        :return: the (start, end) byte offsets of the lines, end excluded
+        """
+        entry = self.get_entry(filename)
+        last_line = first_line if last_line is None else last_line
+        if not 1 <= first_line <= last_line <= entry['lines']:
+            raise IndexError("Line " + str(first_line) + " is out of the " + str(entry['lines']) + " lines")
+        with open(self.path, "rb") as index_file:
+            index_file.seek(self.data_start + entry['position'] + (first_line - 1) * OFFSET_STRUCT.size)
+            start = OFFSET_STRUCT.unpack(index_file.read(OFFSET_STRUCT.size))[0]
+            if last_line == entry['lines']:
+                return start, entry['size']
+            index_file.seek(self.data_start + entry['position'] + last_line * OFFSET_STRUCT.size)
+            return start, OFFSET_STRUCT.unpack(index_file.read(OFFSET_STRUCT.size))[0]
+
+    def get_lines(self, filename, line_number, context=0, encoding=None):
+        return get_lines(filename, self.get_entry(filename)['lines'],
+                         lambda first, last: self.get_span(filename, first, last), line_number, context, encoding)
+
+
+def get_lines(filename, line_count, get_span, line_number, context=0, encoding=None):
+    """
+    Reads a line of a file and the lines around it
+    :param filename: path of the flat file
+    :param line_count: number of lines of the file
+    :param get_span: function returning the (start, end) offsets of a range of lines
+    :param line_number: number of the line, from 1
+    :param context: number of lines read before and after the line
+    :param encoding: encoding of the file content. Invalid byte sequences are replaced
+    :return: a list of (line_number, line) tuples, lines without their line ending
+    """
+    first_line = max(1, line_number - context)
+    last_line = min(line_count, line_number + context)
+    start, end = get_span(first_line, last_line)
+    # seeking in a compressed file decompresses it up to the offset
+    with compression.open_binary(filename) as file:
+        file.seek(start)
+        data = file.read(end - start)
+    lines = data.decode(encoding or 'utf-8', errors='replace').split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    return [(first_line + idx, line.rstrip("\r")) for idx, line in enumerate(lines)]
+
+
+def format_lines(lines, line_number=None):
+    """
+    :param lines: list of (line_number, line) tuples as returned by get_lines
+    :param line_number: (optional) number of the line to highlight
+    :return: the lines prefixed by their number, the highlighted line marked with '>'
+    """
+    width = len(str(lines[-1][0])) if lines else 0
+    return "\n".join((">" if number == line_number else " ") + str(number).rjust(width) + " | " + line
+                     for number, line in lines)
+
+
+def main(argv=None):
+    """
+    Prints a line of a flat file and its context from a line index written by ffchecker --line-index
+    :param argv: (optional) list of command line arguments. By default the arguments of the process
+    :return: the exit code of the command
+    """
+    parser = argparse.ArgumentParser(description='Show lines of a flat file from its line index')
+    parser.add_argument('index_file', metavar='INDEX_FILE', help='Line index written by ffchecker --line-index')
+    parser.add_argument('flat_file', metavar='FILE', help='Indexed flat file')
+    parser.add_argument('line_numbers', metavar='LINE', type=int, nargs='+', help='Numbers of the lines to show')
+    parser.add_argument('--context', type=int, default=2, metavar='N', help='Number of lines shown before and '
+                                                                            'after each line. Default : 2')
+    parser.add_argument('--encoding', help='Encoding of the flat file. Default : utf-8')
+    args = parser.parse_args(argv)
+
+    try:
+        index_file = LineIndexFile(args.index_file)
+        for line_number in args.line_numbers:
+            print(format_lines(index_file.get_lines(args.flat_file, line_number, args.context, args.encoding),
+                               line_number))
+    except Exception as err:
+        print("ERROR. " + str(err))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
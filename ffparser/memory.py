@@ -0,0 +1,196 @@
+import os
+
+HIGH_WATER_MARK = 0.8
+SPILL_CHUNK_SIZE = 10000
+# memory used by the parsed rows of a file compared to its size on disk, fields being python strings in lists
+ROWS_MEMORY_FACTOR = 8
+# estimated memory of a parsed row in bytes
+ROW_MEMORY = 512
+MIN_BLOCK_SIZE = 256 * 1024
+
+
+def get_rss():
+    """
+    :return: the resident memory of the process in bytes, or None if it cannot be measured
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak resident memory, in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+
+
+class MemoryGovernor(object):
+    """
+    Keeps the memory of a run under a budget by sizing read blocks, batches and worker counts from the memory left,
+    and by spilling the results to disk when the resident memory reaches the high water mark. A disabled governor,
+    without budget, leaves the default sizes unchanged
+    """
+    def __init__(self, max_memory=None, high_water_mark=HIGH_WATER_MARK):
+        """
+        :param max_memory: (optional) memory budget of the process in bytes
+        :param high_water_mark: part of the budget above which the memory is under pressure
+        """
+        self.max_memory = max_memory
+        self.high_water_mark = high_water_mark
+        self.enabled = max_memory is not None and get_rss() is not None
+
+    def available(self):
+        """
+        :return: the number of bytes left in the budget, None if the governor is disabled
+        """
+        if not self.enabled:
+            return None
+        return max(0, self.max_memory - get_rss())
+
+    def under_pressure(self):
+        return self.enabled and get_rss() > self.max_memory * self.high_water_mark
+
+    def scale(self, size, minimum):
+        """
+        Sizes a block or a batch from the memory left: the default size while less than half of the budget is used, a
+        half then a quarter of it above
+        :param size: default size
+        :param minimum: minimum size
+        :return: the size to use
+        """
+        if not self.enabled:
+            return size
+        used = 1.0 - float(self.available()) / self.max_memory
+        if used < 0.5:
+            return size
+        if used < self.high_water_mark:
+            return max(minimum, size // 2)
+        return max(minimum, size // 4)
+
+    def limit_workers(self, workers, worker_memory):
+        """
+        :param workers: requested number of workers
+        :param worker_memory: estimated memory used by a worker in bytes
+        :return: the number of workers fitting in the memory left, at least 1
+        """
+        if not self.enabled or worker_memory <= 0:
+            return workers
+        return max(1, min(workers, self.available() // worker_memory))
+
+    def fits(self, memory):
+        """
+        :param memory: estimated number of bytes
+        :return: False if the memory exceeds the memory left
+        """
+        return not self.enabled or memory <= self.available()
+
+    def new_step_store(self):
+        """
+        :return: a list receiving the steps of a test case result, spilled to disk under memory pressure
+        """
+        if not self.enabled:
+            return []
+        return SpillList(self)
+
+
+class SpillList(object):
+    """
+    Append only list which items are moved to a temporary file by chunks while the memory is under pressure. Items
+    are read back when the list is iterated, so changes made to the items of an iteration are not kept
+    """
+    def __init__(self, governor, chunk_size=SPILL_CHUNK_SIZE):
+        """
+        :param governor: MemoryGovernor object
+        :param chunk_size: number of items kept in memory between two checks of the memory
+        """
+        self.governor = governor
+        self.chunk_size = chunk_size
+        self.items = []
+        self.spilled = 0
+        self.file = None
+
+    def __len__(self):
+        return self.spilled + len(self.items)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def append(self, item):
+        self.items.append(item)
+        if len(self.items) >= self.chunk_size:
+            self.check_memory()
+
+    def extend(self, items):
+        self.items.extend(items)
+        if len(self.items) >= self.chunk_size:
+            self.check_memory()
+
+    def check_memory(self):
+        if self.governor.under_pressure():
+            self.spill()
+        else:
+            # the memory is checked again once chunk_size more items are added
+            self.chunk_size = len(self.items) + SPILL_CHUNK_SIZE
+
+    def spill(self):
+        import pickle
+        import tempfile
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix="ffparser_steps_")
+        self.file.seek(0, os.SEEK_END)
+        pickle.dump(self.items, self.file, pickle.HIGHEST_PROTOCOL)
+        self.spilled += len(self.items)
+        self.items = []
+        self.chunk_size = SPILL_CHUNK_SIZE
+
+    def __iter__(self):
+        if self.file is not None:
+            import pickle
+            self.file.seek(0)
+            read = 0
+            while read < self.spilled:
+                chunk = pickle.load(self.file)
+                read += len(chunk)
+                for item in chunk:
+                    yield item
+        for item in self.items:
+            yield item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if index >= self.spilled:
+            return self.items[index - self.spilled]
+        for idx, item in enumerate(self):
+            if idx == index:
+                return item
+        raise IndexError("SpillList index out of range")
+
+    def __del__(self):
+        if self.file is not None:
+            self.file.close()
+
+
+_governor = MemoryGovernor()
+
+
+def get_governor():
+    """
+    :return: the active memory governor. By default a disabled governor
+    """
+    return _governor
+
+
+def set_governor(governor):
+    """
+    Sets the memory governor used by the loader, the results and the workers
+    :param governor: a MemoryGovernor object
+    :return: None
+    """
+    global _governor
+    _governor = governor
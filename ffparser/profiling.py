@@ -0,0 +1,150 @@
+import contextlib
+import json
+import time
+
+
+class Profiler(object):
+    """
+    Collects the time spent in each phase of a run, counters and statistics of each executed test. A disabled profiler
+    records nothing so that instrumented code keeps its speed
+    """
+    def __init__(self, enabled=True, cprofile=False, trace_memory=False):
+        """
+        :param enabled: if False, the profiler records nothing
+        :param cprofile: if enabled, the run is also captured with cProfile
+        :param trace_memory: if enabled, memory allocations are traced with tracemalloc
+        """
+        self.enabled = enabled
+        self.cprofile = None
+        if enabled and cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+        self.trace_memory = enabled and trace_memory
+        self.phases = {}
+        self.counters = {}
+        self.tests = []
+        self.start_time = None
+        self.stop_time = None
+        self.memory = None
+
+    def start(self):
+        """
+        Starts the capture of the run
+        :return: None
+        """
+        if not self.enabled:
+            return
+        self.start_time = time.perf_counter()
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        """
+        Stops the capture of the run
+        :return: None
+        """
+        if not self.enabled:
+            return
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.trace_memory:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                top_stats = tracemalloc.take_snapshot().statistics('lineno')[:20]
+                self.memory = {'current_bytes': current, 'peak_bytes': peak,
+                               'top_allocations': [{'location': str(stat.traceback), 'bytes': stat.size,
+                                                    'count': stat.count} for stat in top_stats]}
+                tracemalloc.stop()
+        self.stop_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager measuring the time spent in a phase. Phases with the same name are accumulated
+        :param name: name of the phase, e.g. 'flat_file.tokenize'
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = {'calls': 0, 'seconds': 0.0}
+            phase['calls'] += 1
+            phase['seconds'] += seconds
+
+    def count(self, name, value=1):
+        """
+        Increments a counter
+        :param name: name of the counter
+        :param value: value added to the counter
+        :return: None
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_test(self, filename, test_name, seconds, rows, errors):
+        """
+        Records the statistics of a test execution
+        :param filename: name of the tested file
+        :param test_name: name of the test
+        :param seconds: execution time of the test
+        :param rows: number of rows processed by the test
+        :param errors: number of errors emitted by the test
+        :return: None
+        """
+        if self.enabled:
+            self.tests.append({'filename': filename, 'test_name': test_name, 'seconds': seconds, 'rows': rows,
+                               'errors': errors})
+
+    def to_dict(self):
+        """
+        :return: the collected statistics as a dictionary
+        """
+        total_seconds = None
+        if self.start_time is not None:
+            total_seconds = (self.stop_time or time.perf_counter()) - self.start_time
+        return {'total_seconds': total_seconds, 'phases': self.phases, 'counters': self.counters,
+                'tests': self.tests, 'memory': self.memory}
+
+    def save(self, path):
+        """
+        Writes the collected statistics in a json file. When cProfile is enabled, its capture is written next to it
+        with the '.prof' extension, to be read with pstats or snakeviz
+        :param path: path of the json stats file
+        :return: None
+        """
+        stats = self.to_dict()
+        if self.cprofile is not None:
+            stats['cprofile_file'] = path + ".prof"
+            self.cprofile.dump_stats(stats['cprofile_file'])
+        with open(path, "w") as stats_file:
+            json.dump(stats, stats_file, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+_profiler = Profiler(enabled=False)
+
+
+def get_profiler():
+    """
+    :return: the active profiler. By default a disabled profiler
+    """
+    return _profiler
+
+
+def set_profiler(profiler):
+    """
+    Sets the profiler used by the instrumented code
+    :param profiler: a Profiler object
+    :return: None
+    """
+    global _profiler
+    _profiler = profiler
@@ -0,0 +1,414 @@
+import json
+import os
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL = 10.0
+CONSOLE_INTERVAL = 1.0
+METRIC_PREFIX = "ffchecker_"
+
+
+class ProgressTracker(object):
+    """
+    Tracks the progress of a run: bytes and rows processed, throughput, errors per test and estimated time left per
+    file and overall. The instrumented code only adds to counters once per block or batch, the console line and the
+    status files are written by a background thread at a fixed interval. A disabled tracker starts no thread
+    """
+    def __init__(self, enabled=True, console=False, status_file=None, prometheus_file=None,
+                 interval=DEFAULT_INTERVAL, stream=None):
+        """
+        :param enabled: if False, nothing is reported
+        :param console: if enabled a progress line is updated in place on the console, or printed at each interval
+        when the console is not a terminal
+        :param status_file: (optional) path of a json file where the status is written at each interval
+        :param prometheus_file: (optional) path of a Prometheus textfile where the metrics are written at each interval
+        :param interval: number of seconds between two writes of the status files
+        :param stream: (optional) console stream. By default the standard error
+        """
+        self.enabled = enabled
+        self.console = console
+        self.status_file = status_file
+        self.prometheus_file = prometheus_file
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.in_place = console and hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.start_time = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        # whole run
+        self.files = []
+        self.total_size = 0
+        self.done_size = 0
+        self.files_done = 0
+        self.bytes = 0
+        self.rows = 0
+        self.errors = {}
+        # current file
+        self.filename = None
+        self.file_size = None
+        self.file_start = None
+        self.file_position = 0
+        self.file_rows = 0
+        self.tests = []
+        self.tests_done = 0
+        self.test_name = None
+        self.file_errors = {}
+        # previous console sample, for the recent throughput
+        self.last_sample = None
+        self.console_line = False
+
+    def start(self, files):
+        """
+        Starts the tracking of a run
+        :param files: list of the paths of the files of the run
+        :return: None
+        """
+        if not self.enabled:
+            return
+        self.start_time = time.monotonic()
+        self.files = list(files)
+        self.total_size = 0
+        for filename in self.files:
+            try:
+                self.total_size += os.path.getsize(filename)
+            except OSError:
+                pass
+        self.last_sample = (self.start_time, 0)
+        self.thread = threading.Thread(target=self.report_loop, name="ffparser-progress", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the tracking and writes the final status
+        :return: None
+        """
+        if not self.enabled or self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.end_file()
+        self.write_status_files(self.get_status(done=True))
+        if self.console:
+            self.write_console(self.format_console(self.get_status(done=True)), final=True)
+
+    def start_file(self, filename, tests=None):
+        """
+        Starts the tracking of a file. The previous file is ended if it was not
+        :param filename: path of the file being checked
+        :param tests: (optional) list of the names of the tests of the file, see set_tests
+        :return: None
+        """
+        if not self.enabled:
+            return
+        if self.filename is not None:
+            self.end_file()
+        try:
+            file_size = os.path.getsize(filename)
+        except OSError:
+            file_size = None
+        with self.lock:
+            self.filename = filename
+            self.file_size = file_size
+            self.file_start = time.monotonic()
+            self.file_position = 0
+            self.file_rows = 0
+            self.tests = list(tests or [])
+            self.tests_done = 0
+            self.test_name = None
+            self.file_errors = {}
+        self.clear_console()
+
+    def set_tests(self, tests):
+        """
+        :param tests: list of the names of the tests of the current file, once its structure is known
+        :return: None
+        """
+        self.tests = list(tests)
+
+    def end_file(self, suite_result=None):
+        """
+        :param suite_result: (optional) TestSuiteResult of the file, giving the errors of the tests run elsewhere, e.g.
+        in a sandbox
+        :return: None
+        """
+        if not self.enabled or self.filename is None:
+            return
+        with self.lock:
+            if suite_result is not None:
+                self.file_errors = {}
+                for tc in suite_result.tcs:
+                    test_name = getattr(tc, 'test_name', None) or 'unknown'
+                    self.file_errors[test_name] = self.file_errors.get(test_name, 0) + tc.count_failed()
+            for test_name, errors in self.file_errors.items():
+                self.errors[test_name] = self.errors.get(test_name, 0) + errors
+            self.files_done += 1
+            self.done_size += self.file_size or 0
+            self.filename = None
+            self.file_errors = {}
+        self.clear_console()
+
+    def add_read(self, size, position):
+        """
+        Called for each block read from the current file
+        :param size: number of bytes of the block
+        :param position: offset of the end of the block in the file
+        :return: None
+        """
+        self.bytes += size
+        if position > self.file_position:
+            self.file_position = position
+
+    def add_rows(self, count):
+        """
+        Called for each batch of rows tokenized
+        :param count: number of rows of the batch
+        :return: None
+        """
+        self.rows += count
+        self.file_rows += count
+
+    def start_test(self, test_name):
+        self.test_name = test_name
+
+    def end_test(self, test_name, errors):
+        """
+        :param test_name: name of the test
+        :param errors: number of errors found by the test
+        :return: None
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.file_errors[test_name] = self.file_errors.get(test_name, 0) + errors
+            self.tests_done += 1
+            self.test_name = None
+
+    def get_file_fraction(self):
+        """
+        :return: the estimated part of the work done on the current file: its first read then each of its tests. None
+        if the size of the file is unknown
+        """
+        if not self.file_size:
+            return None
+        # compressed files are read further than their size
+        read_fraction = min(1.0, float(self.file_position) / self.file_size)
+        return min(1.0, (read_fraction + self.tests_done) / (len(self.tests) + 1))
+
+    def get_status(self, done=False):
+        """
+        :param done: True for the final status of the run
+        :return: a dictionary of the progress of the run
+        """
+        now = time.monotonic()
+        with self.lock:
+            elapsed = now - self.start_time
+            status = {
+                'state': 'done' if done else 'running',
+                'elapsed_seconds': round(elapsed, 3),
+                'files_total': len(self.files),
+                'files_done': self.files_done,
+                'bytes_total': self.total_size,
+                'bytes_processed': self.bytes,
+                'rows_processed': self.rows,
+                'rows_per_second': round(self.rows / elapsed, 1) if elapsed > 0 else 0.0,
+                'errors': dict(self.errors),
+                'eta_seconds': None,
+                'file': None,
+            }
+            done_size = self.done_size
+            if self.filename is not None:
+                fraction = self.get_file_fraction()
+                file_elapsed = now - self.file_start
+                errors = dict(self.errors)
+                for test_name, count in self.file_errors.items():
+                    errors[test_name] = errors.get(test_name, 0) + count
+                status['errors'] = errors
+                status['file'] = {
+                    'filename': self.filename,
+                    'size': self.file_size,
+                    'position': self.file_position,
+                    'rows': self.file_rows,
+                    'tests_total': len(self.tests),
+                    'tests_done': self.tests_done,
+                    'test': self.test_name,
+                    'errors': dict(self.file_errors),
+                    'progress': round(fraction, 4) if fraction is not None else None,
+                    'eta_seconds': round(file_elapsed * (1 - fraction) / fraction, 1) if fraction else None,
+                }
+                if fraction is not None:
+                    done_size += fraction * self.file_size
+        if done:
+            status['eta_seconds'] = 0.0
+        elif done_size > 0 and self.total_size:
+            status['eta_seconds'] = round(elapsed * max(0.0, self.total_size - done_size) / done_size, 1)
+        return status
+
+    def format_console(self, status):
+        """
+        :param status: dictionary returned by get_status
+        :return: the progress line
+        """
+        now = time.monotonic()
+        last_time, last_rows = self.last_sample
+        rate = (status['rows_processed'] - last_rows) / (now - last_time) if now > last_time else 0.0
+        self.last_sample = (now, status['rows_processed'])
+        parts = ["files " + str(status['files_done']) + "/" + str(status['files_total'])]
+        file_status = status['file']
+        if file_status is not None:
+            name = os.path.basename(file_status['filename'])
+            if file_status['progress'] is not None:
+                name += " " + format(file_status['progress'], ".0%")
+            if file_status['test'] is not None:
+                name += " " + file_status['test'] + " (" + str(file_status['tests_done'] + 1) + "/" \
+                        + str(file_status['tests_total']) + ")"
+            parts.append(name)
+        parts.append(format_count(status['rows_processed']) + " rows")
+        parts.append(format_count(rate) + " rows/s")
+        parts.append(format_count(sum(status['errors'].values())) + " errors")
+        if file_status is not None and file_status['eta_seconds'] is not None:
+            parts.append("file ETA " + format_duration(file_status['eta_seconds']))
+        if status['eta_seconds'] is not None:
+            parts.append("ETA " + format_duration(status['eta_seconds']))
+        return " | ".join(parts)
+
+    def format_prometheus(self, status):
+        """
+        :param status: dictionary returned by get_status
+        :return: the metrics in the Prometheus text exposition format
+        """
+        lines = []
+
+        def add_metric(name, metric_type, help_text, samples):
+            lines.append("# HELP " + METRIC_PREFIX + name + " " + help_text)
+            lines.append("# TYPE " + METRIC_PREFIX + name + " " + metric_type)
+            for labels, value in samples:
+                label_text = ",".join(key + '="' + escape_label(label) + '"' for key, label in labels)
+                lines.append(METRIC_PREFIX + name + ("{" + label_text + "}" if label_text else "") + " "
+                             + repr(float(value)))
+
+        add_metric("files_total", "gauge", "Number of files of the run", [((), status['files_total'])])
+        add_metric("files_done", "gauge", "Number of files checked", [((), status['files_done'])])
+        add_metric("bytes_processed_total", "counter", "Bytes read from the files", [((), status['bytes_processed'])])
+        add_metric("rows_processed_total", "counter", "Rows tokenized", [((), status['rows_processed'])])
+        add_metric("rows_per_second", "gauge", "Average rows tokenized per second", [((), status['rows_per_second'])])
+        add_metric("errors_total", "counter", "Errors found per test",
+                   [((('test', test_name),), count) for test_name, count in sorted(status['errors'].items())])
+        add_metric("elapsed_seconds", "gauge", "Duration of the run", [((), status['elapsed_seconds'])])
+        if status['eta_seconds'] is not None:
+            add_metric("eta_seconds", "gauge", "Estimated time left for the run", [((), status['eta_seconds'])])
+        file_status = status['file']
+        if file_status is not None and file_status['progress'] is not None:
+            labels = (('file', file_status['filename']),)
+            add_metric("file_progress_ratio", "gauge", "Estimated part of the current file checked",
+                       [(labels, file_status['progress'])])
+            if file_status['eta_seconds'] is not None:
+                add_metric("file_eta_seconds", "gauge", "Estimated time left for the current file",
+                           [(labels, file_status['eta_seconds'])])
+        add_metric("last_update_timestamp_seconds", "gauge", "Time of the last update", [((), time.time())])
+        return "\n".join(lines) + "\n"
+
+    def report_loop(self):
+        tick = CONSOLE_INTERVAL if self.in_place else self.interval
+        next_write = time.monotonic()
+        while True:
+            now = time.monotonic()
+            status = self.get_status()
+            if now >= next_write:
+                self.write_status_files(status)
+                next_write = now + self.interval
+            if self.console:
+                self.write_console(self.format_console(status))
+            if self.stop_event.wait(tick):
+                return
+
+    def write_status_files(self, status):
+        try:
+            if self.status_file:
+                write_atomic(self.status_file, json.dumps(status, indent=4, separators=(',', ': ')))
+            if self.prometheus_file:
+                write_atomic(self.prometheus_file, self.format_prometheus(status))
+        except OSError:
+            # progress reports must not stop the run
+            pass
+
+    def write_console(self, line, final=False):
+        if self.in_place:
+            self.stream.write("\r\033[K" + line + ("\n" if final else ""))
+            self.console_line = not final
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def clear_console(self):
+        """
+        Clears the progress line so that the messages of the run are printed from the start of the line
+        :return: None
+        """
+        if self.in_place and self.console_line:
+            self.stream.write("\r\033[K")
+            self.stream.flush()
+            self.console_line = False
+
+
+def write_atomic(path, content):
+    """
+    Writes a file through a temporary file renamed over it, so that readers never see a partial file
+    :param path: path of the file
+    :param content: text content
+    :return: None
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_path, path)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_count(value):
+    """
+    :param value: a number
+    :return: the number with a k, M or G suffix, e.g. 1.5M
+    """
+    for limit, suffix in ((1e9, "G"), (1e6, "M"), (1e3, "k")):
+        if value >= limit:
+            return format(value / limit, ".1f") + suffix
+    return str(int(value))
+
+
+def format_duration(seconds):
+    """
+    :param seconds: a duration in seconds
+    :return: the duration as [H:]MM:SS
+    """
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return str(hours) + ":" + str(minutes).zfill(2) + ":" + str(seconds).zfill(2)
+    return str(minutes).zfill(2) + ":" + str(seconds).zfill(2)
+
+
+_tracker = ProgressTracker(enabled=False)
+
+
+def get_tracker():
+    """
+    :return: the active progress tracker. By default a disabled tracker
+    """
+    return _tracker
+
+
+def set_tracker(tracker):
+    """
+    Sets the progress tracker updated by the loader and the tests
+    :param tracker: a ProgressTracker object
+    :return: None
+    """
+    global _tracker
+    _tracker = tracker
@@ -0,0 +1,279 @@
+import io
+import math
+import os
+import random
+from ffparser import compression, config, ffchecker, testcase
+
+DEFAULT_SAMPLE_SIZE = 10000
+DEFAULT_CONFIDENCE = 0.95
+
+
+def reservoir_sample(items, size, rng):
+    """
+    Draws a uniform sample of an iterable of unknown length in a single pass, keeping at most size items in memory
+    :param items: iterable
+    :param size: size of the sample
+    :param rng: random.Random object
+    :return: a (sample, count) tuple. sample is a list of (index, item) tuples sorted by index and count is the number
+    of items of the iterable
+    """
+    reservoir = []
+    count = 0
+    for count, item in enumerate(items, 1):
+        if count <= size:
+            reservoir.append((count - 1, item))
+        else:
+            slot = rng.randrange(count)
+            if slot < size:
+                reservoir[slot] = (count - 1, item)
+    reservoir.sort(key=lambda entry: entry[0])
+    return reservoir, count
+
+
+def iter_csv_records(lines, quotechar):
+    """
+    Groups the lines of a csv file into records, a quoted field holding a line break making a record span several
+    lines. A record is complete when it holds an even number of quote characters
+    :param lines: iterable of text lines
+    :param quotechar: quote character of the file
+    :return: a generator of record texts
+    """
+    record = []
+    quotes = 0
+    for line in lines:
+        if record or quotechar in line:
+            quotes += line.count(quotechar)
+            record.append(line)
+            if quotes % 2 == 0:
+                yield "".join(record)
+                record = []
+                quotes = 0
+        else:
+            yield line
+    if record:
+        yield "".join(record)
+
+
+def get_record_length(path):
+    """
+    Finds the length of the lines of a file where all the lines have the same length, as many positional files
+    :param path: path of an uncompressed file
+    :return: the length in bytes of a line, line ending included, or None if the first lines differ in length
+    """
+    with open(path, "rb") as file:
+        first_lines = [file.readline() for idx in range(3)]
+    if not first_lines[0].endswith(b"\n"):
+        return None
+    record_length = len(first_lines[0])
+    if any(len(line) != record_length for line in first_lines[1:] if line.endswith(b"\n")):
+        return None
+    return record_length
+
+
+def seek_sample(path, record_length, size, rng):
+    """
+    Draws a simple random sample of a file with fixed length lines, reading only the sampled lines. The lines are
+    drawn at random rather than every n lines, which would follow the periodic patterns of the file, e.g. alternating
+    header and detail rows, and would not support the confidence interval of the estimate
+    :param path: path of an uncompressed file
+    :param record_length: length in bytes of each line
+    :param size: size of the sample
+    :param rng: random.Random object
+    :return: a (sample, count) tuple. sample is a list of (index, raw_line) tuples and count the number of lines.
+    Returns None if a sampled line does not have the expected length
+    """
+    count = int(math.ceil(float(os.path.getsize(path)) / record_length))
+    if count <= size:
+        indexes = range(count)
+    else:
+        # the lines are read in the order of the file
+        indexes = sorted(rng.sample(range(count), size))
+    sample = []
+    with open(path, "rb") as file:
+        for index in indexes:
+            file.seek(index * record_length)
+            raw_line = file.read(record_length)
+            if index < count - 1 and (len(raw_line) != record_length or not raw_line.endswith(b"\n")):
+                return None
+            sample.append((index, raw_line))
+    return sample, count
+
+
+def wilson_interval(failures, total, confidence=DEFAULT_CONFIDENCE):
+    """
+    Wilson score confidence interval of a proportion
+    :param failures: number of failures in the sample
+    :param total: size of the sample
+    :param confidence: confidence level, e.g. 0.95
+    :return: a (low, high) tuple
+    """
+    if total == 0:
+        return 0.0, 1.0
+    import statistics
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2.0)
+    rate = float(failures) / total
+    denominator = 1 + z * z / total
+    center = (rate + z * z / (2 * total)) / denominator
+    half_width = z * math.sqrt(rate * (1 - rate) / total + z * z / (4.0 * total * total)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+class ErrorRateEstimate(object):
+    """
+    Estimated proportion of lines of a file with at least one error, from the results of a sample
+    """
+    def __init__(self, sample_size, total_lines, failed_lines, failed_lines_by_type, confidence=DEFAULT_CONFIDENCE,
+                 skipped_tests=None):
+        """
+        :param sample_size: number of sampled lines
+        :param total_lines: number of lines of the file
+        :param failed_lines: number of sampled lines with at least one error
+        :param failed_lines_by_type: dictionary error_type -> number of sampled lines with this error
+        :param confidence: confidence level of the intervals
+        :param skipped_tests: (optional) list of the tests not run on the sample, see testcase.whole_file_test
+        """
+        self.sample_size = sample_size
+        self.total_lines = total_lines
+        self.failed_lines = failed_lines
+        self.failed_lines_by_type = failed_lines_by_type
+        self.confidence = confidence
+        self.skipped_tests = skipped_tests or []
+
+    @property
+    def rate(self):
+        return float(self.failed_lines) / self.sample_size if self.sample_size else 0.0
+
+    def interval(self, error_type=None):
+        """
+        :param error_type: (optional) error type. By default the interval of all the errors
+        :return: the (low, high) confidence interval of the error rate
+        """
+        failures = self.failed_lines if error_type is None else self.failed_lines_by_type.get(error_type, 0)
+        return wilson_interval(failures, self.sample_size, self.confidence)
+
+    def to_dict(self):
+        low, high = self.interval()
+        return {
+            'sample_size': self.sample_size,
+            'total_lines': self.total_lines,
+            'failed_lines': self.failed_lines,
+            'error_rate': self.rate,
+            'interval': [low, high],
+            'estimated_failed_lines': [int(low * self.total_lines), int(math.ceil(high * self.total_lines))],
+            'confidence': self.confidence,
+            'error_types': {error_type: {'failed_lines': count, 'interval': list(self.interval(error_type))}
+                            for error_type, count in self.failed_lines_by_type.items()},
+            'skipped_tests': self.skipped_tests,
+        }
+
+    def __str__(self):
+        low, high = self.interval()
+        text = "Estimated error rate " + format(self.rate, ".2%") + " [" + format(low, ".2%") + ", " \
+            + format(high, ".2%") + "] at " + format(self.confidence, ".0%") + " confidence, on " \
+            + str(self.sample_size) + " of " + str(self.total_lines) + " lines"
+        if self.skipped_tests:
+            text += ". Not run on the sample, as they need the whole file : " + ", ".join(self.skipped_tests)
+        return text
+
+
+class SampledFlatFile(ffchecker.FlatFile):
+    """
+    FlatFile holding a sample of the lines of a file. Tests run on the sampled lines only, open_raw included, and
+    the line numbers of their results are those of the full file. csv records are sampled as a whole, even when a
+    quoted field spans several lines
+    """
+    def __init__(self, sample, total_lines, file_structure, filename, confidence=DEFAULT_CONFIDENCE):
+        """
+        :param sample: list of (index, line) tuples, index being the position of the line, or of the csv record, in
+        the file from 0 and line its text with its line ending
+        :param total_lines: number of lines, or of csv records, of the file
+        :param file_structure: file structure used to parse the lines
+        :param filename: path of the file
+        :param confidence: confidence level of the error rate estimate
+        """
+        self.sample_text = "".join([line for index, line in sample])
+        self.line_numbers = [index + 1 for index, line in sample]
+        self.total_lines = total_lines
+        self.confidence = confidence
+        ffchecker.FlatFile.__init__(self, io.StringIO(self.sample_text, newline=''), file_structure,
+                                    filename=filename)
+
+    def open_raw(self, encoding=None, newline=None, errors=None):
+        return io.StringIO(self.sample_text, newline=newline)
+
+    def run_test_suite(self, test_list, test_sandbox=None):
+        """
+        Runs tests on the sample, translates the line numbers of the results to the full file and estimates the error
+        rate of the file. The estimate is set as the estimate attribute of the result. The tests needing the whole file
+        (see testcase.whole_file_test), such as control totals or duplicates, would report false errors on a sample:
+        they are not run and are listed in the estimate
+        :param test_list: list of tests
+        :param test_sandbox: must be None, sampled files cannot be sent to worker processes
+        :return: a TestSuiteResult object
+        """
+        if test_sandbox is not None:
+            raise Exception("Sampled files cannot be tested in a sandbox")
+        plugin_dirs = [config.get_global_config().plugin_dir]
+        skipped_tests = [test_name for test_name in test_list
+                         if testcase.is_whole_file_test(testcase.get_test_callable_by_name(test_name, plugin_dirs))]
+        suite_result = ffchecker.FlatFile.run_test_suite(self, [test_name for test_name in test_list
+                                                                if test_name not in skipped_tests])
+        line_numbers = self.line_numbers
+        failed_lines = set()
+        failed_lines_by_type = {}
+        for tc in suite_result.tcs:
+            # steps spilled to disk are copies, the updated steps are stored again
+            steps = testcase.new_step_store()
+            for step in tc.steps:
+                if not isinstance(step.line_number, int) or not 1 <= step.line_number <= len(line_numbers):
+                    steps.append(step)
+                    continue
+                # consecutive lines of the sample are not consecutive in the file: coalesced steps are split per line
+                ref_line = step.ref_line
+                if isinstance(ref_line, int) and 1 <= ref_line <= len(line_numbers):
+                    ref_line = line_numbers[ref_line - 1]
+                for sample_line in range(step.line_number, step.last_line + 1):
+                    line_number = line_numbers[sample_line - 1]
+                    if not step.status:
+                        failed_lines.add(line_number)
+                        failed_lines_by_type.setdefault(step.error_type, set()).add(line_number)
+                    steps.append(testcase.TestCaseStepResult(line_number, step.status, step.error_type, step.message,
+                                                             step.filename, step.field_pos, ref_line=ref_line))
+            tc.steps = steps
+        suite_result.estimate = ErrorRateEstimate(len(line_numbers), self.total_lines, len(failed_lines),
+                                                  {error_type: len(lines)
+                                                   for error_type, lines in failed_lines_by_type.items()},
+                                                  self.confidence, skipped_tests)
+        return suite_result
+
+
+def sample_flat_file(filename, file_structure, size=DEFAULT_SAMPLE_SIZE, seed=None, confidence=DEFAULT_CONFIDENCE):
+    """
+    Loads a sample of the lines of a file. Uncompressed positional files with fixed length lines are sampled by
+    seeking to the sampled lines. Other files are read once and sampled with a reservoir, csv files by record.
+    Invalid byte sequences are replaced without being reported
+    :param filename: path of the file
+    :param file_structure: structure of the file
+    :param size: number of sampled lines
+    :param seed: (optional) seed of the random generator, for reproducible samples
+    :param confidence: confidence level of the error rate estimate
+    :return: a SampledFlatFile object
+    """
+    rng = random.Random(seed)
+    sample = None
+    if file_structure.conf_type == 'pos' and compression.detect_compression(filename) is None:
+        record_length = get_record_length(filename)
+        if record_length is not None:
+            sample = seek_sample(filename, record_length, size, rng)
+        if sample is not None:
+            raw_sample, total_lines = sample
+            sample = ([(index, raw_line.decode(file_structure.encoding, errors='replace'))
+                       for index, raw_line in raw_sample], total_lines)
+    if sample is None:
+        with compression.open_text(filename, encoding=file_structure.encoding, newline='', errors='replace') as file:
+            records = file
+            quotechar = getattr(file_structure, 'quotechar', None)
+            if file_structure.conf_type == 'csv' and quotechar:
+                records = iter_csv_records(file, quotechar)
+            sample = reservoir_sample(records, size, rng)
+    return SampledFlatFile(sample[0], sample[1], file_structure, filename, confidence)
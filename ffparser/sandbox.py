@@ -0,0 +1,278 @@
+import gc
+import multiprocessing
+import multiprocessing.connection
+import os.path
+import pickle
+import time
+from ffparser import memory, testcase
+
+STEPS_CHUNK_SIZE = 10000
+
+
+class Sandbox(object):
+    """
+    Runs the tests of a file in a pool of worker processes, at most max_workers of them. Each worker loads the rows of
+    the file once and runs the tests it is given one after the other. With the fork start method the workers share the
+    rows already parsed by the parent process, otherwise the rows are pickled once in a shared memory block read by
+    each worker. A worker running a test beyond its time limit is killed and replaced, and the address space of the
+    workers can be limited. A test which fails, times out or crashes its worker produces a TEST_EXEC_ERROR_<test name>
+    step and the other tests of the file keep running
+    """
+    def __init__(self, max_workers=None, timeout=None, memory_limit=None):
+        """
+        :param max_workers: maximum number of worker processes of a file. By default the number of CPUs
+        :param timeout: (optional) wall clock time limit of a test in seconds
+        :param memory_limit: (optional) address space limit of a worker in megabytes. Only enforced on POSIX systems
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+
+    def run_test_suite(self, flat_file_object, test_list):
+        """
+        Runs a set of tests on a file
+        :param flat_file_object: FlatFile object to be tested
+        :param test_list: list of test names
+        :return: a TestSuiteResult object, its test cases being in the order of test_list
+        """
+        context = multiprocessing.get_context()
+        shm = None
+        source = None
+        if flat_file_object.rows is not None:
+            if context.get_start_method() == 'fork':
+                # the forked workers inherit the rows, the objects created until now are left out of their garbage
+                # collections so that the pages of the rows are not copied
+                source = ('rows', flat_file_object.rows, flat_file_object.structure, flat_file_object.filename)
+                gc.freeze()
+            else:
+                from multiprocessing import shared_memory
+                data = pickle.dumps((flat_file_object.rows, flat_file_object.structure, flat_file_object.filename),
+                                    pickle.HIGHEST_PROTOCOL)
+                shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+                shm.buf[:len(data)] = data
+                source = ('shm', shm.name, len(data))
+                del data
+        if source is None:
+            source = ('file', None, flat_file_object.structure, flat_file_object.filename)
+        try:
+            results = WorkerPool(self, context, source, flat_file_object).run_tests(test_list)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            if source[0] == 'rows':
+                gc.unfreeze()
+
+        suite_result = testcase.TestSuiteResult()
+        suite_result.tcs = results
+        return suite_result
+
+
+class WorkerPool(object):
+    """
+    Worker processes running the tests of a file for a Sandbox
+    """
+    def __init__(self, test_sandbox, context, source, flat_file_object):
+        """
+        :param test_sandbox: Sandbox object
+        :param context: multiprocessing context
+        :param source: rows source given to the workers, see run_worker
+        :param flat_file_object: FlatFile object to be tested
+        """
+        self.sandbox = test_sandbox
+        self.context = context
+        self.source = source
+        self.flat_file_object = flat_file_object
+        self.filename = os.path.basename(flat_file_object.filename)
+        # connection -> process of the idle workers, and of the busy workers with their test
+        self.idle = {}
+        self.busy = {}
+
+    def start_worker(self):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=run_worker, args=(child_conn, self.source, self.sandbox.memory_limit))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        self.idle[parent_conn] = process
+
+    def stop_worker(self, conn, process, kill=False):
+        if kill:
+            process.kill()
+        else:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        process.join()
+        conn.close()
+
+    def run_tests(self, test_list):
+        """
+        :param test_list: list of test names
+        :return: list of the TestCaseResult objects of the tests, in the order of test_list
+        """
+        flat_file_object = self.flat_file_object
+        results = [None] * len(test_list)
+        pending = list(enumerate(test_list))
+        # with a memory budget, only the workers fitting in the memory left run at the same time
+        rows = flat_file_object.rows
+        worker_memory = len(rows) * memory.ROW_MEMORY if rows is not None else 0
+        max_workers = memory.get_governor().limit_workers(min(self.sandbox.max_workers, len(test_list)),
+                                                          worker_memory)
+        try:
+            while pending or self.busy:
+                while pending and len(self.idle) + len(self.busy) < max_workers:
+                    self.start_worker()
+                while pending and self.idle:
+                    conn, process = self.idle.popitem()
+                    idx, test_name = pending.pop(0)
+                    deadline = time.monotonic() + self.sandbox.timeout if self.sandbox.timeout else None
+                    conn.send(('test', test_name))
+                    self.busy[conn] = (process, idx, test_name, deadline, testcase.TestCaseResult())
+
+                deadlines = [entry[3] for entry in self.busy.values() if entry[3] is not None]
+                wait_timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                for conn in multiprocessing.connection.wait(list(self.busy), wait_timeout):
+                    process, idx, test_name, deadline, tc_result = self.busy[conn]
+                    error = None
+                    try:
+                        message = conn.recv()
+                    except EOFError:
+                        process.join()
+                        message = None
+                        error = "Worker process of test " + test_name + " exited with code " + str(process.exitcode)
+                    if message is not None and message[0] == 'steps':
+                        tc_result.steps.extend([testcase.TestCaseStepResult(*step) for step in message[1]])
+                        continue
+                    del self.busy[conn]
+                    if message is None:
+                        conn.close()
+                    else:
+                        self.idle[conn] = process
+                    if message is not None and message[0] == 'error':
+                        error = message[1]
+                    # in stream mode the encoding errors are found by the workers reading the file
+                    if message is not None and message[0] == 'done' and message[1] and rows is None:
+                        flat_file_object.encoding_errors = message[1]
+                    if error is not None:
+                        tc_result.steps.append(testcase.TestCaseStepResult(None, False, 'TEST_EXEC_ERROR_' + test_name,
+                                                                           error, self.filename))
+                    tc_result.test_name = test_name
+                    results[idx] = tc_result
+
+                now = time.monotonic()
+                for conn, (process, idx, test_name, deadline, tc_result) in list(self.busy.items()):
+                    if deadline is None or now < deadline:
+                        continue
+                    del self.busy[conn]
+                    self.stop_worker(conn, process, kill=True)
+                    tc_result.steps.append(testcase.TestCaseStepResult(
+                        None, False, 'TEST_EXEC_ERROR_' + test_name, "Test " + test_name + " timed out after "
+                        + str(self.sandbox.timeout) + " seconds", self.filename))
+                    tc_result.test_name = test_name
+                    results[idx] = tc_result
+        finally:
+            for conn, process in list(self.idle.items()):
+                self.stop_worker(conn, process)
+            for conn, entry in list(self.busy.items()):
+                self.stop_worker(conn, entry[0], kill=True)
+            self.idle = {}
+            self.busy = {}
+        return results
+
+
+def limit_memory(memory_limit):
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = memory_limit * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def load_worker_file(source):
+    """
+    :param source: ('rows', rows, file_structure, filename) for rows inherited from the parent process,
+    ('shm', shm_name, size) for rows pickled in a shared memory block or ('file', None, file_structure, filename) to
+    read the file in stream mode
+    :return: a FlatFile object
+    """
+    from ffparser import ffchecker
+    if source[0] == 'rows':
+        return ffchecker.FlatFile.from_rows(source[1], source[2], source[3])
+    if source[0] == 'shm':
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=source[1])
+        try:
+            rows, file_structure, filename = pickle.loads(shm.buf[:source[2]])
+        finally:
+            shm.close()
+        return ffchecker.FlatFile.from_rows(rows, file_structure, filename)
+    return None
+
+
+def run_worker(conn, source, memory_limit):
+    """
+    Entry point of a worker process. Loads the rows of the file once, then runs each test received through conn as
+    ('test', test_name) until None is received. The steps of a test are sent by chunks, followed by
+    ('done', encoding_errors) or by ('error', message)
+    :param conn: duplex connection to the parent process
+    :param source: rows source, see load_worker_file
+    :param memory_limit: (optional) address space limit in megabytes
+    :return: None
+    """
+    # the steps are summarized by the parent process
+    testcase.set_step_summary(None)
+    flat_file = None
+    load_error = None
+    try:
+        if memory_limit:
+            limit_memory(memory_limit)
+        flat_file = load_worker_file(source)
+    except MemoryError:
+        load_error = "Worker could not load the file within the memory limit of " + str(memory_limit) + " MB"
+    except Exception as err:
+        load_error = (str(err) or type(err).__name__) + ". Worker could not load the file"
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                return
+            if message is None:
+                return
+            test_name = message[1]
+            if load_error is not None:
+                conn.send(('error', load_error))
+                continue
+            conn.send(run_worker_test(conn, test_name, flat_file, source, memory_limit))
+    finally:
+        conn.close()
+
+
+def run_worker_test(conn, test_name, flat_file, source, memory_limit):
+    """
+    Runs a test in a worker process and sends its steps through conn by chunks
+    :return: the last message of the test, ('done', encoding_errors) or ('error', message)
+    """
+    from ffparser import ffchecker
+    try:
+        if flat_file is None:
+            # in stream mode the file is read again by each test
+            flat_file = ffchecker.FlatFile(ffchecker.compression.open_binary(source[3]), source[2],
+                                           filename=source[3], stream=True)
+        tc_result = flat_file.run_test_case(test_name)
+        steps = [(step.line_number, step.status, step.error_type, step.message, step.filename,
+                  getattr(step, 'field_pos', None), step.last_line, getattr(step, 'ref_line', None))
+                 for step in tc_result.steps]
+        del tc_result
+        for start in range(0, len(steps), STEPS_CHUNK_SIZE):
+            conn.send(('steps', steps[start:start + STEPS_CHUNK_SIZE]))
+        return 'done', flat_file.encoding_errors if flat_file.rows is None else []
+    except testcase.TestExecException as err:
+        return 'error', err.msg
+    except MemoryError:
+        return 'error', "Test " + test_name + " exceeded the memory limit of " + str(memory_limit) + " MB"
+    except Exception as err:
+        return 'error', (str(err) or type(err).__name__) + ". Error during execution of test " + test_name
@@ -0,0 +1,318 @@
+import argparse
+import http.server
+import ipaddress
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import urllib.parse
+from ffparser import cache, config, ffchecker, structure, testcase, writers
+
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_TIMEOUT = 60
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+RESULT_BATCH_SIZE = 1000
+
+
+class ChunkedResponse(object):
+    """
+    Text file like object writing an HTTP/1.1 chunked response body
+    """
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        if data:
+            self.wfile.write(("%x\r\n" % len(data)).encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+    def close(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class CheckerServer(http.server.ThreadingHTTPServer):
+    """
+    HTTP server checking flat files with warm structures, configuration and test registry. At most max_workers
+    checks run at the same time, other requests wait up to queue_timeout seconds before being refused with a 503
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, config_dir=None, max_workers=None, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 test_sandbox=None, parse_cache=None, root_dir=None):
+        """
+        :param server_address: (host, port) tuple
+        :param config_dir: (optional) directory of the file structures. By default the one of the global config
+        :param max_workers: (optional) number of checks running at the same time. By default the number of CPUs
+        :param queue_timeout: number of seconds a request waits for a free worker
+        :param test_sandbox: (optional) Sandbox object running the tests in worker processes
+        :param parse_cache: (optional) ParseCache object
+        :param root_dir: (optional) directory the checked paths must belong to
+        """
+        http.server.ThreadingHTTPServer.__init__(self, server_address, CheckerRequestHandler)
+        global_config = config.get_global_config()
+        self.config_dir = config_dir or global_config.structures_dir
+        self.plugin_dirs = [global_config.plugin_dir]
+        self.workers = threading.BoundedSemaphore(max_workers or os.cpu_count() or 1)
+        self.queue_timeout = queue_timeout
+        self.test_sandbox = test_sandbox
+        self.parse_cache = parse_cache
+        self.root_dir = os.path.realpath(root_dir) if root_dir else None
+        self.structure_lock = threading.Lock()
+        self.structure_index = None
+        self.warm_up()
+
+    def warm_up(self):
+        """
+        Loads the structures, the test configurations and the test modules used by the structures
+        :return: None
+        """
+        structure_index = self.get_structure_index()
+        testcase.get_test_index(self.plugin_dirs)
+        test_names = set()
+        for file_structure in structure_index.structures.values():
+            test_names.update(file_structure.tests)
+        for test_name in sorted(test_names):
+            try:
+                testcase.get_test_case_config_from_name(test_name)
+                testcase.get_test_callable_by_name(test_name, self.plugin_dirs)
+            except Exception:
+                # missing tests are reported as TEST_EXEC_ERROR when a file uses them
+                pass
+
+    def get_structure_index(self):
+        """
+        :return: the StructureIndex of the structures directory, reloaded when a structure file changes
+        """
+        with self.structure_lock:
+            self.structure_index = structure.load_structure_index(self.config_dir)
+            return self.structure_index
+
+    def check_path(self, path):
+        """
+        Checks that a path may be read by the server
+        :param path: path of a file
+        :return: the real path of the file. Raises an Exception if it is outside of the root directory
+        """
+        real_path = os.path.realpath(path)
+        if self.root_dir is not None and os.path.commonpath([self.root_dir, real_path]) != self.root_dir:
+            raise Exception("Path " + path + " is outside of the root directory of the server")
+        return real_path
+
+
+class CheckerRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /health : status of the server
+    GET /structures : names of the available file structures
+    POST /check : checks files. Either a json body {"paths": [...], "structure": "name"} listing files readable by the
+    server, or the content of a file with the query parameters filename (used to find its structure) and optionally
+    structure. Results are streamed back as JSON Lines, one line per result, followed by a line
+    {"done": true, "files": [{"filename": ..., "errors": ...}]}
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, content):
+        data = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/health":
+            self.send_json(200, {'status': 'ok'})
+        elif path == "/structures":
+            self.send_json(200, {'structures': sorted(self.server.get_structure_index().structures)})
+        else:
+            self.send_json(404, {'error': "Unknown path " + path})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/check":
+            self.read_body(None)
+            self.send_json(404, {'error': "Unknown path " + url.path})
+            return
+        query = urllib.parse.parse_qs(url.query)
+        upload_dir = None
+        try:
+            if "filename" in query:
+                upload_dir = tempfile.mkdtemp(prefix="ffparser_")
+                filename = os.path.join(upload_dir, os.path.basename(query["filename"][0]))
+                with open(filename, "wb") as upload_file:
+                    self.read_body(upload_file)
+                paths = [filename]
+                structure_name = query.get("structure", [None])[0]
+            else:
+                body = json.loads(self.read_body(None).decode('utf-8') or "{}")
+                paths = [self.server.check_path(path) for path in body.get('paths', [])]
+                structure_name = body.get('structure')
+        except Exception as err:
+            if upload_dir is not None:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+            self.send_json(400, {'error': str(err)})
+            return
+
+        try:
+            if not self.server.workers.acquire(timeout=self.server.queue_timeout):
+                self.send_json(503, {'error': "All the workers are busy"})
+                return
+            try:
+                self.check_files(paths, structure_name)
+            finally:
+                self.server.workers.release()
+        finally:
+            if upload_dir is not None:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def read_body(self, file):
+        """
+        Reads the request body, sent with a Content-Length or chunked
+        :param file: (optional) binary file object the body is written to
+        :return: the body if file is None, otherwise b""
+        """
+        chunks = []
+
+        def consume(size):
+            while size > 0:
+                data = self.rfile.read(min(size, UPLOAD_CHUNK_SIZE))
+                if not data:
+                    raise Exception("Incomplete request body")
+                size -= len(data)
+                if file is not None:
+                    file.write(data)
+                else:
+                    chunks.append(data)
+
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    # trailers end with an empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                consume(size)
+                self.rfile.readline()
+        else:
+            consume(int(self.headers.get("Content-Length", 0)))
+        return b"".join(chunks)
+
+    def check_files(self, paths, structure_name=None):
+        """
+        Checks files and streams the results
+        :param paths: paths of the files
+        :param structure_name: (optional) name of the structure of the files. By default found from the filenames
+        :return: None
+        """
+        structure_index = self.server.get_structure_index()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        response = ChunkedResponse(self.wfile)
+        result_writer = writers.JsonLinesResultWriter(response, RESULT_BATCH_SIZE)
+        files = []
+        for path in paths:
+            basename = os.path.basename(path)
+            if structure_name is not None:
+                file_structure = structure_index.structures.get(structure_name)
+            else:
+                file_structure = structure_index.get_struct_from_pattern(path)
+            if file_structure is None:
+                result_writer.write_record(basename, None, False, 'STRUCTURE_NOT_FOUND',
+                                           "Could not find any file structure for file '" + basename + "'")
+                files.append({'filename': basename, 'errors': None})
+                continue
+            try:
+                flat_file = ffchecker.load_flat_file(path, file_structure, self.server.parse_cache)
+                test_result = flat_file.run_defined_tests(self.server.test_sandbox)
+            except testcase.TestExecException as err:
+                result_writer.write_record(basename, None, False, 'TEST_EXEC_ERROR_' + err.test_name, err.msg)
+                files.append({'filename': basename, 'errors': None})
+                continue
+            except Exception as err:
+                result_writer.write_record(basename, None, False, 'FILE_ERROR', str(err) or type(err).__name__)
+                files.append({'filename': basename, 'errors': None})
+                continue
+            result_writer.write_suite(test_result)
+            result_writer.flush()
+            files.append({'filename': basename, 'errors': test_result.count_failed()})
+        result_writer.flush()
+        response.write(json.dumps({'done': True, 'files': files}) + "\n")
+        response.close()
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def main(argv=None):
+    """
+    Entry point of the ffchecker-server command
+    :param argv: (optional) list of command line arguments. By default the arguments of the process
+    :return: the exit code of the command
+    """
+    parser = argparse.ArgumentParser(description='Serve flat file checks over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='Address the server listens on. Default : 127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port the server listens on. Default : '
+                                                                       + str(DEFAULT_PORT))
+    parser.add_argument('--allow-remote', action='store_true', help='Allow listening on a non loopback address. The '
+                                                                    'server has no authentication')
+    parser.add_argument('--config-dir', metavar='CONFIG-DIR',
+                        help='Directory with the file structures. Default : the structures directory of the global '
+                             'config')
+    parser.add_argument('--root', metavar='ROOT_DIR', help='If given, only the files of this directory can be checked '
+                                                           'by path')
+    parser.add_argument('--workers', type=int, metavar='N', help='Number of checks running at the same time. '
+                                                                 'Default : number of CPUs')
+    parser.add_argument('--queue-timeout', type=float, default=DEFAULT_QUEUE_TIMEOUT, metavar='SECONDS',
+                        help='Time a request waits for a free worker before being refused. Default : '
+                             + str(DEFAULT_QUEUE_TIMEOUT))
+    parser.add_argument('--sandbox', action='store_true', help='If enabled each test runs in a worker process with '
+                                                               'the time and memory limits below')
+    parser.add_argument('--test-timeout', type=float, metavar='SECONDS', help='With --sandbox, time limit of a test')
+    parser.add_argument('--test-memory-limit', type=int, metavar='MB', help='With --sandbox, memory limit of a test '
+                                                                            'worker in megabytes')
+    parser.add_argument('--cache-dir', metavar='CACHE_DIR', help='Directory of the parse cache')
+    parser.add_argument('--cache-size', type=int, default=cache.DEFAULT_CACHE_SIZE // (1024 * 1024), metavar='MB',
+                        help='Size limit of the parse cache in megabytes')
+    args = parser.parse_args(argv)
+
+    if not is_loopback(args.host) and not args.allow_remote:
+        print("ERROR. Listening on " + args.host + " requires --allow-remote")
+        return 1
+
+    test_sandbox = None
+    if args.sandbox:
+        from ffparser import sandbox
+        test_sandbox = sandbox.Sandbox(args.workers, args.test_timeout, args.test_memory_limit)
+    parse_cache = None
+    if args.cache_dir:
+        parse_cache = cache.ParseCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    server = CheckerServer((args.host, args.port), args.config_dir, args.workers, args.queue_timeout, test_sandbox,
+                           parse_cache, args.root)
+    print("Serving on http://" + args.host + ":" + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
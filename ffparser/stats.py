@@ -0,0 +1,343 @@
+import collections
+import itertools
+import json
+import math
+
+DEFAULT_HLL_PRECISION = 12
+DEFAULT_TOP_N = 10
+MAX_ROW_TYPES = 1000
+MAX_VALUE_LENGTH = 100
+OTHER_ROW_TYPES = "*other*"
+
+
+class HyperLogLog(object):
+    """
+    Estimates the number of distinct values of a stream in a fixed memory of 2^precision bytes. The standard error of
+    the estimate is about 1.04 / sqrt(2^precision), 1.6% with the default precision.
+    Values are hashed with the built-in hash so estimates of different processes must not be merged
+    """
+    def __init__(self, precision=DEFAULT_HLL_PRECISION):
+        """
+        :param precision: number of bits of the hash used to select a register, between 4 and 16
+        """
+        if not 4 <= precision <= 16:
+            raise Exception("HyperLogLog precision must be between 4 and 16. Not " + str(precision))
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """
+        Adds a value to the estimator
+        :param value: a hashable value
+        :return: None
+        """
+        self.update((value,))
+
+    def update(self, values):
+        """
+        Adds values to the estimator
+        :param values: iterable of hashable values
+        :return: None
+        """
+        registers = self.registers
+        shift = 64 - self.precision
+        rest_mask = (1 << shift) - 1
+        for value in values:
+            hashed = hash(value) & 0xFFFFFFFFFFFFFFFF
+            index = hashed >> shift
+            # rank of the first 1 bit in the remaining bits
+            rank = shift - (hashed & rest_mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other):
+        """
+        Merges the registers of another estimator with the same precision
+        :param other: a HyperLogLog object
+        :return: None
+        """
+        if other.precision != self.precision:
+            raise Exception("Cannot merge HyperLogLog estimators of different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        """
+        :return: the estimated number of distinct values
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        # small cardinalities are better estimated by linear counting
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+class TopValues(object):
+    """
+    Keeps the most frequent values of a stream in bounded memory with the Misra-Gries algorithm. Counts are lower
+    bounds of the real counts, underestimated by at most total / (capacity + 1)
+    """
+    def __init__(self, top_n=DEFAULT_TOP_N, capacity=None):
+        """
+        :param top_n: number of values reported
+        :param capacity: number of values tracked. By default 10 times top_n
+        """
+        self.top_n = top_n
+        self.capacity = capacity or top_n * 10
+        self.counts = {}
+
+    def update(self, counter):
+        """
+        Adds counted values
+        :param counter: dictionary of value -> count
+        :return: None
+        """
+        counts = self.counts
+        for value, count in counter.items():
+            counts[value] = counts.get(value, 0) + count
+        if len(counts) > self.capacity:
+            # decrement all the counts by the first count left out, values falling to 0 are dropped
+            ordered = sorted(counts.values(), reverse=True)
+            threshold = ordered[self.capacity]
+            self.counts = {value: count - threshold for value, count in counts.items() if count > threshold}
+
+    def most_common(self):
+        """
+        :return: a list of (value, count) tuples of the top_n most frequent values
+        """
+        return collections.Counter(self.counts).most_common(self.top_n)
+
+
+class FieldStatistics(object):
+    """
+    Statistics of a field of a row type
+    """
+    def __init__(self, position, numeric=None, decimal_sep=".", top_n=DEFAULT_TOP_N,
+                 hll_precision=DEFAULT_HLL_PRECISION):
+        """
+        :param position: position of the field in the row, starting at 1
+        :param numeric: 'digit' or 'decimal' if the numeric range of the field is computed, otherwise None
+        :param decimal_sep: decimal separator of the decimal fields
+        :param top_n: number of most frequent values reported
+        :param hll_precision: precision of the distinct values estimator
+        """
+        self.position = position
+        self.numeric = numeric
+        self.decimal_sep = decimal_sep
+        self.count = 0
+        self.nulls = 0
+        self.missing = 0
+        self.min_length = None
+        self.max_length = None
+        self.min_value = None
+        self.max_value = None
+        self.numeric_errors = 0
+        self.distinct = HyperLogLog(hll_precision)
+        self.top_values = TopValues(top_n)
+
+    def parse_number(self, value):
+        if self.numeric == 'digit':
+            return int(value)
+        return float(value.replace(self.decimal_sep, "."))
+
+    def update(self, counter):
+        """
+        Adds the values of a column
+        :param counter: dictionary of value -> count, None counting the rows too short to have the field
+        :return: None
+        """
+        missing = counter.pop(None, 0)
+        self.missing += missing
+        if not counter:
+            return
+        self.count += sum(counter.values())
+        null_values = [value for value in counter if not value.strip()]
+        for value in null_values:
+            self.nulls += counter.pop(value)
+        # each statistic is computed on the distinct values of the batch
+        lengths = [len(value) for value in counter] + [len(value) for value in null_values]
+        min_length = min(lengths)
+        max_length = max(lengths)
+        if self.min_length is None or min_length < self.min_length:
+            self.min_length = min_length
+        if self.max_length is None or max_length > self.max_length:
+            self.max_length = max_length
+        if not counter:
+            return
+        self.distinct.update(counter)
+        self.top_values.update({value[:MAX_VALUE_LENGTH]: count for value, count in counter.items()})
+
+        if self.numeric is not None:
+            numbers = []
+            for value, count in counter.items():
+                try:
+                    numbers.append(self.parse_number(value.strip()))
+                except ValueError:
+                    self.numeric_errors += count
+            if numbers:
+                min_value = min(numbers)
+                max_value = max(numbers)
+                if self.min_value is None or min_value < self.min_value:
+                    self.min_value = min_value
+                if self.max_value is None or max_value > self.max_value:
+                    self.max_value = max_value
+
+    def to_dict(self):
+        """
+        :return: the statistics as a dictionary
+        """
+        stats = {
+            'position': self.position,
+            'count': self.count,
+            'nulls': self.nulls,
+            'null_rate': float(self.nulls) / self.count if self.count else None,
+            'missing': self.missing,
+            'min_length': self.min_length,
+            'max_length': self.max_length,
+            'distinct': self.distinct.count(),
+            'top_values': [[value, count] for value, count in self.top_values.most_common()],
+        }
+        if self.numeric is not None:
+            stats.update({'numeric': self.numeric, 'min_value': self.min_value, 'max_value': self.max_value,
+                          'numeric_errors': self.numeric_errors})
+        return stats
+
+
+class RowTypeStatistics(object):
+    """
+    Statistics of the rows of a given type and of their fields
+    """
+    def __init__(self, row_type, row_structure=None, decimal_sep=".", top_n=DEFAULT_TOP_N,
+                 hll_precision=DEFAULT_HLL_PRECISION):
+        """
+        :param row_type: row type as found in the file
+        :param row_structure: (optional) RowStructure of the row type, used to find the digit and decimal fields
+        :param decimal_sep: decimal separator of the decimal fields
+        :param top_n: number of most frequent values reported per field
+        :param hll_precision: precision of the distinct values estimators
+        """
+        self.row_type = row_type
+        self.rows = 0
+        self.decimal_sep = decimal_sep
+        self.top_n = top_n
+        self.hll_precision = hll_precision
+        self.digit_fields = set()
+        self.decimal_fields = set()
+        if row_structure is not None:
+            self.digit_fields = set(getattr(row_structure, 'digit_fields', []))
+            self.decimal_fields = set(getattr(row_structure, 'decimal_fields', []))
+        self.fields = []
+
+    def get_field(self, position):
+        while len(self.fields) < position:
+            field_pos = len(self.fields) + 1
+            numeric = None
+            if field_pos in self.decimal_fields:
+                numeric = 'decimal'
+            elif field_pos in self.digit_fields:
+                numeric = 'digit'
+            self.fields.append(FieldStatistics(field_pos, numeric, self.decimal_sep, self.top_n, self.hll_precision))
+        return self.fields[position - 1]
+
+    def update(self, rows):
+        """
+        Adds rows of this type
+        :param rows: list of rows, a row being a list of fields
+        :return: None
+        """
+        previous_rows = self.rows
+        self.rows += len(rows)
+        width = 0
+        for position, column in enumerate(itertools.zip_longest(*rows), 1):
+            new_field = position > len(self.fields)
+            field = self.get_field(position)
+            if new_field:
+                # a field created late was missing from the rows of the previous batches
+                field.missing += previous_rows
+            field.update(collections.Counter(column))
+            width = position
+        # fields absent from all the rows of the batch
+        for field in self.fields[width:]:
+            field.missing += len(rows)
+
+    def to_dict(self):
+        """
+        :return: the statistics as a dictionary
+        """
+        return {'row_type': self.row_type, 'rows': self.rows, 'fields': [field.to_dict() for field in self.fields]}
+
+
+class FileStatistics(object):
+    """
+    Statistics of the rows of a flat file, per row type and per field. Rows are added by batches and only aggregated
+    values are kept, so that memory does not depend on the size of the file
+    """
+    def __init__(self, file_structure, row_structure_lookup=None, top_n=DEFAULT_TOP_N,
+                 hll_precision=DEFAULT_HLL_PRECISION):
+        """
+        :param file_structure: FlatFileStructure of the file
+        :param row_structure_lookup: (optional) callable returning the row structure of a given row type
+        :param top_n: number of most frequent values reported per field
+        :param hll_precision: precision of the distinct values estimators
+        """
+        self.type_index = file_structure.type_pos - 1
+        self.decimal_sep = getattr(file_structure, 'decimal_sep', ".")
+        self.row_structure_lookup = row_structure_lookup
+        self.top_n = top_n
+        self.hll_precision = hll_precision
+        self.rows = 0
+        self.row_types = {}
+
+    def get_row_type(self, row_type):
+        row_type_stats = self.row_types.get(row_type)
+        if row_type_stats is None:
+            # garbage in the type field must not make the statistics grow with the file
+            if len(self.row_types) >= MAX_ROW_TYPES and row_type != OTHER_ROW_TYPES:
+                return self.get_row_type(OTHER_ROW_TYPES)
+            row_structure = None
+            if self.row_structure_lookup is not None and row_type != OTHER_ROW_TYPES:
+                try:
+                    row_structure = self.row_structure_lookup(row_type)
+                except Exception:
+                    row_structure = None
+                # the lookup returns an error message when no row structure matches
+                if isinstance(row_structure, str):
+                    row_structure = None
+            row_type_stats = RowTypeStatistics(row_type, row_structure, self.decimal_sep, self.top_n,
+                                               self.hll_precision)
+            self.row_types[row_type] = row_type_stats
+        return row_type_stats
+
+    def update(self, rows):
+        """
+        Adds a batch of rows
+        :param rows: list of rows, a row being a list of fields
+        :return: None
+        """
+        self.rows += len(rows)
+        type_index = self.type_index
+        rows_by_type = {}
+        for row in rows:
+            row_type = row[type_index] if len(row) > type_index else ""
+            rows_by_type.setdefault(row_type, []).append(row)
+        for row_type, type_rows in rows_by_type.items():
+            self.get_row_type(row_type).update(type_rows)
+
+    def to_dict(self):
+        """
+        :return: the statistics as a dictionary
+        """
+        return {'rows': self.rows,
+                'row_types': {row_type: row_type_stats.to_dict()
+                              for row_type, row_type_stats in self.row_types.items()}}
+
+    def save(self, path):
+        """
+        Writes the statistics in a json file
+        :param path: path of the json file
+        :return: None
+        """
+        with open(path, "w") as stats_file:
+            json.dump(self.to_dict(), stats_file, indent=4, separators=(',', ': '))
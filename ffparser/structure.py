@@ -2,6 +2,8 @@ import json
 import glob
 import os.path
 import re
+import weakref
+from ffparser import compression
 
 CSV_FILE_STRUCT_MANDATORY_PROPS = ["name","conf_type","sep","quotechar","encoding","type_pos","date_fmt","decimal_sep","tests","file_pattern","carriage_return","row_structures"]
 CSV_ROW_MANDATORY_PROPS = ['length', 'date_fields', 'key_pos', 'optional_fields', 'decimal_fields', 'digit_fields',
@@ -112,16 +114,132 @@ class FlatFileStructure(object):
         return result
 
 
-def get_structure_from_json(file_path):
+DIGITS = "[0-9]"
+LINE_PATTERN_FIELDS = ('digit_fields', 'decimal_fields')
+# below this number of checked fields a line pattern is slower than checking the fields one by one
+MIN_LINE_PATTERN_FIELDS = 4
+
+
+def get_field_pattern(length, kind, decimal_sep):
+    """
+    :param length: length of a positional field, or a shorter length when the field ends the line
+    :param kind: 'digit_fields' or 'decimal_fields' for a checked field, None otherwise
+    :param decimal_sep: decimal separator of the file, a single character
+    :return: a (chars, length) tuple, the valid contents of the field being length chars of the chars class, or a
+    (pattern, None) tuple. Digits are matched as ASCII digits, faster than \\d: fields with other unicode digits fail
+    the pattern and are checked field by field
+    """
+    if kind == 'digit_fields' or (kind == 'decimal_fields' and not decimal_sep):
+        return DIGITS, length
+    if kind is None:
+        return ".", length
+    # digits and separators, with at least one digit
+    return "(?!" + re.escape(decimal_sep * length) + ")[0-9" + re.escape(decimal_sep) + "]{" + str(length) + "}", None
+
+
+def join_field_patterns(field_patterns):
+    """
+    Concatenates field patterns, merging the consecutive fields with the same chars, e.g. [0-9]{4}[0-9]{6} into
+    [0-9]{10}
+    :param field_patterns: list of tuples returned by get_field_pattern
+    :return: the pattern
+    """
+    merged = []
+    for chars, length in field_patterns:
+        if length is not None and merged and merged[-1][0] == chars and merged[-1][1] is not None:
+            merged[-1] = (chars, merged[-1][1] + length)
+        else:
+            merged.append((chars, length))
+    return "".join(chars if length is None else chars + "{" + str(length) + "}" for chars, length in merged)
+
+
+class LinePattern(object):
+    """
+    Anchored regular expression of the lines of a positional row structure which checked fields are valid: digit
+    fields made of digits and decimal fields made of digits and of the decimal separator. It is matched against the
+    line cut by the tokenizer, i.e. the concatenation of the fields of the row, so that a single match validates a good
+    line. Lines of the full length of the row structure are matched by a flat pattern. Shorter lines, which end was
+    stripped, are matched by a pattern where each field is followed by the rest of the line or is the shortened last
+    one
+    """
+    def __init__(self, row_struct, decimal_sep, checked_fields=LINE_PATTERN_FIELDS):
+        """
+        :param row_struct: RowStructure of a positional file
+        :param decimal_sep: decimal separator of the file
+        :param checked_fields: row structure attributes listing the checked fields, among LINE_PATTERN_FIELDS
+        """
+        kinds = {}
+        for checked in checked_fields:
+            for field_pos in getattr(row_struct, checked):
+                kinds.setdefault(field_pos, checked)
+        fields = [(length, kinds.get(field_pos)) for field_pos, length in enumerate(row_struct.lengths, 1)
+                  if length > 0]
+        self.checked_count = sum(1 for length, kind in fields if kind is not None)
+        self.length = sum(length for length, kind in fields)
+        self.full_pattern = re.compile(join_field_patterns([get_field_pattern(length, kind, decimal_sep)
+                                                            for length, kind in fields]), re.DOTALL)
+        pattern = ""
+        for length, kind in reversed(fields):
+            alternatives = [join_field_patterns([get_field_pattern(length, kind, decimal_sep)]) + pattern]
+            alternatives.extend(join_field_patterns([get_field_pattern(partial_length, kind, decimal_sep)])
+                                for partial_length in range(length - 1, 0, -1))
+            pattern = "(?:" + "|".join(alternatives) + ")?"
+        self.short_pattern = re.compile(pattern, re.DOTALL)
+
+    def fullmatch(self, line):
+        """
+        :param line: concatenation of the fields of a row
+        :return: a match object if the checked fields are valid, None otherwise
+        """
+        if len(line) == self.length:
+            return self.full_pattern.fullmatch(line)
+        return self.short_pattern.fullmatch(line)
+
+
+_line_patterns = weakref.WeakKeyDictionary()
+
+
+def get_line_pattern(file_structure, row_struct, checked_fields=LINE_PATTERN_FIELDS):
+    """
+    Returns the line pattern of a row structure, compiled once per row structure and checked fields. Lines matching
+    it pass the checks of these fields, the others are checked field by field
+    :param file_structure: FlatFileStructure of the file
+    :param row_struct: RowStructure of the line
+    :param checked_fields: row structure attributes listing the checked fields, among LINE_PATTERN_FIELDS
+    :return: a LinePattern object. None for csv files, for decimal separators of several characters and for row
+    structures with less than MIN_LINE_PATTERN_FIELDS checked fields, which are faster to check one by one
+    """
+    if file_structure.conf_type != 'pos':
+        return None
+    # a separator of several characters cannot be matched as a character of the decimal fields
+    if 'decimal_fields' in checked_fields and len(file_structure.decimal_sep) > 1:
+        return None
+    patterns = _line_patterns.get(row_struct)
+    if patterns is None:
+        patterns = _line_patterns[row_struct] = {}
+    checked_fields = tuple(checked_fields)
+    if checked_fields not in patterns:
+        line_pattern = LinePattern(row_struct, file_structure.decimal_sep, checked_fields)
+        patterns[checked_fields] = line_pattern if line_pattern.checked_count >= MIN_LINE_PATTERN_FIELDS else None
+    return patterns[checked_fields]
+
+
+def read_structure_json(file_path):
+    """
+    :param file_path: path of a structure file
+    :return: the dictionary of the structure file
+    """
     try:
         with open(file_path, 'r') as struct_file:
-            structure_dict = json.load(struct_file)
+            return json.load(struct_file)
     except json.JSONDecodeError as err:
         msg = "ERROR: Could not decode " + file_path + " configuration file due to following error : " \
               + err.msg + " line " + str(err.lineno) + " column " + str(err.colno)
         raise StructureParseException(msg, file_path)
 
-    result = FlatFileStructure(structure_dict)
+
+def get_structure_from_json(file_path):
+    result = FlatFileStructure(read_structure_json(file_path))
 
     return result
 
@@ -148,12 +266,206 @@ def get_struct_from_pattern(structures, filepath):
     :return: A CsvFlatFileStructure object
     """
     basename = os.path.basename(filepath)
+    # compressed files are matched on the name of the file they contain as well, e.g. 'ART_01.csv.gz' as 'ART_01.csv'
+    uncompressed_basename = compression.strip_compression_extension(basename)
     structures = [structures[struct_name] for struct_name in structures
-                  if re.match(structures[struct_name].file_pattern, basename)]
+                  if re.match(structures[struct_name].file_pattern, basename)
+                  or re.match(structures[struct_name].file_pattern, uncompressed_basename)]
 
     if len(structures) == 0:
         return None
     if len(structures) != 1:
         raise Exception("More than one structure found for this pattern")
 
-    return structures[0]
\ No newline at end of file
+    return structures[0]
+
+
+# the index is persisted as json, so that a writable structures directory cannot hold code run by the processes
+STRUCTURE_INDEX_FILENAME = ".struct_index.json"
+STRUCTURE_INDEX_VERSION = 2
+REGEX_SPECIAL_CHARS = ".^$*+?{}[]|()\\"
+REGEX_QUANTIFIERS = "*+?{"
+
+
+def split_alternatives(pattern):
+    """
+    Splits a regular expression on its top level '|' alternatives
+    :param pattern: regular expression
+    :return: list of alternatives, the pattern itself when it has none
+    """
+    alternatives = []
+    depth = 0
+    in_set = False
+    start = 0
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char == "\\":
+            idx += 1
+        elif in_set:
+            in_set = char != "]"
+        elif char == "[":
+            in_set = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            alternatives.append(pattern[start:idx])
+            start = idx + 1
+        idx += 1
+    alternatives.append(pattern[start:])
+    return alternatives
+
+
+def get_literal_prefix(pattern):
+    """
+    Extracts the literal text any string matching a file pattern must start with, e.g. 'ART_' for '^ART_\\d+\\.csv$'
+    :param pattern: regular expression without top level alternatives, applied with re.match
+    :return: the literal prefix, possibly empty
+    """
+    prefix = ""
+    idx = 1 if pattern.startswith("^") else 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char == "\\" and idx + 1 < len(pattern) and not pattern[idx + 1].isalnum():
+            literal = pattern[idx + 1]
+            idx += 2
+        elif char in REGEX_SPECIAL_CHARS:
+            break
+        else:
+            literal = char
+            idx += 1
+        if idx < len(pattern) and pattern[idx] in REGEX_QUANTIFIERS:
+            # the quantified char may be absent or repeated, it is not part of the prefix
+            break
+        prefix += literal
+    return prefix
+
+
+class StructureIndex(object):
+    """
+    Index of the file structures of a directory. File patterns are compiled once and stored in a trie of their literal
+    prefixes, so that a filename is only matched against the few patterns sharing its first characters
+    """
+    def __init__(self, structures, files=None, pattern="struct_*.json"):
+        """
+        :param structures: dictionary {structure name: FlatFileStructure}
+        :param files: (optional) dictionary {structure file path: (mtime_ns, size, structure name)} used to invalidate
+        a persisted index
+        :param pattern: pattern of the structure files the index was built from
+        """
+        self.version = STRUCTURE_INDEX_VERSION
+        self.structures = structures
+        self.files = files or {}
+        self.pattern = pattern
+        self.compiled_patterns = {}
+        self.trie = {}
+        for name, file_structure in structures.items():
+            self.compiled_patterns[name] = re.compile(file_structure.file_pattern)
+            for alternative in split_alternatives(file_structure.file_pattern):
+                node = self.trie
+                for char in get_literal_prefix(alternative):
+                    node = node.setdefault(char, {})
+                if name not in node.setdefault(None, []):
+                    node[None].append(name)
+
+    def get_candidates(self, basename):
+        """
+        Lists the structures which literal prefix is a prefix of a filename
+        :param basename: name of the file
+        :return: list of structure names
+        """
+        candidates = []
+        node = self.trie
+        for char in basename:
+            candidates += node.get(None, [])
+            node = node.get(char)
+            if node is None:
+                return candidates
+        return candidates + node.get(None, [])
+
+    def get_struct_from_pattern(self, filepath):
+        """
+        Search in the index for a file structure matching the pattern of the file, as get_struct_from_pattern does
+        :param filepath: path to the file to parse
+        :return: A FlatFileStructure object or None if no structure matches
+        """
+        basename = os.path.basename(filepath)
+        # compressed files are matched on the name of the file they contain as well, e.g. 'ART_01.csv.gz' as 'ART_01.csv'
+        uncompressed_basename = compression.strip_compression_extension(basename)
+        names = set(self.get_candidates(basename))
+        if uncompressed_basename != basename:
+            names.update(self.get_candidates(uncompressed_basename))
+        matching = [name for name in names if self.compiled_patterns[name].match(basename)
+                    or self.compiled_patterns[name].match(uncompressed_basename)]
+
+        if len(matching) == 0:
+            return None
+        if len(matching) != 1:
+            raise Exception("More than one structure found for this pattern")
+
+        return self.structures[matching[0]]
+
+
+def get_structure_files(structures_dir_path, pattern="struct_*.json"):
+    """
+    Lists the structure files of a directory with their modification time and size
+    :return: a dictionary {path: (mtime_ns, size)}
+    """
+    files = {}
+    for structure_filename in glob.glob(os.path.join(structures_dir_path, pattern)):
+        stat = os.stat(structure_filename)
+        files[structure_filename] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def load_structure_index(structures_dir_path, pattern="struct_*.json", cache_path=None):
+    """
+    Returns the index of the structures of a directory. The index is persisted in the directory and only the
+    structure files added or modified since it was written are parsed again
+    :param structures_dir_path: path to a directory containing the structure jsons
+    :param pattern: pattern of the structure filenames
+    :param cache_path: (optional) path of the persisted index. By default STRUCTURE_INDEX_FILENAME in the structures
+    directory. The index is not persisted when the path is not writable
+    :return: a StructureIndex object
+    """
+    if cache_path is None:
+        cache_path = os.path.join(structures_dir_path, STRUCTURE_INDEX_FILENAME)
+    files = get_structure_files(structures_dir_path, pattern)
+
+    # the persisted index holds the dictionary of each structure file with its modification time and size
+    cached_files = {}
+    try:
+        with open(cache_path, "r") as cache_file:
+            cached_index = json.load(cache_file)
+        if cached_index.get('version') == STRUCTURE_INDEX_VERSION and cached_index.get('pattern') == pattern:
+            cached_files = cached_index['files']
+    except (OSError, ValueError, AttributeError, KeyError):
+        pass
+
+    structures = {}
+    indexed_files = {}
+    index_entries = {}
+    for structure_filename in sorted(files):
+        mtime_ns, size = files[structure_filename]
+        cached_entry = cached_files.get(structure_filename)
+        if cached_entry is not None and tuple(cached_entry[:2]) == (mtime_ns, size):
+            structure_dict = cached_entry[2]
+        else:
+            structure_dict = read_structure_json(structure_filename)
+        index_entries[structure_filename] = [mtime_ns, size, structure_dict]
+        file_structure = FlatFileStructure(structure_dict)
+        structures[file_structure.name] = file_structure
+        indexed_files[structure_filename] = (mtime_ns, size, file_structure.name)
+
+    index = StructureIndex(structures, indexed_files, pattern)
+    if {path: tuple(entry[:2]) for path, entry in cached_files.items()} != files:
+        try:
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "w") as cache_file:
+                json.dump({'version': STRUCTURE_INDEX_VERSION, 'pattern': pattern, 'files': index_entries}, cache_file)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+    return index
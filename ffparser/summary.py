@@ -0,0 +1,117 @@
+import collections
+import json
+
+
+class SummaryAggregator(object):
+    """
+    Aggregates result steps as they are emitted into a small report: counts per error type, per field position and per
+    file, the most offending fields and the first examples of each error type. Memory does not grow with the number
+    of steps
+    """
+    def __init__(self, max_examples=5, top_n=10):
+        """
+        :param max_examples: number of examples kept per error type
+        :param top_n: number of fields listed in the most offending fields
+        """
+        self.max_examples = max_examples
+        self.top_n = top_n
+        self.steps = 0
+        self.passed = 0
+        self.failed = 0
+        self.error_types = collections.Counter()
+        self.files = collections.Counter()
+        self.field_positions = collections.Counter()
+        self.fields = collections.Counter()
+        self.tests = collections.Counter()
+        self.examples = {}
+
+    def add_record(self, filename, line_number, status, error_type, message, field_pos=None, test_name=None,
+                   count=1):
+        """
+        Adds a result to the summary
+        :param filename: name of the tested file
+        :param line_number: line of the result, None for results concerning the whole file
+        :param status: True if the step passed
+        :param error_type: type of error
+        :param message: description of the result
+        :param field_pos: (optional) position of the field concerned by the result
+        :param test_name: (optional) name of the test which emitted the result
+        :param count: number of identical results represented by the record
+        :return: None
+        """
+        self.steps += count
+        if status:
+            self.passed += count
+            return
+        self.failed += count
+        self.error_types[error_type] += count
+        self.files[filename] += count
+        if test_name is not None:
+            self.tests[test_name] += count
+        if field_pos is not None:
+            self.field_positions[field_pos] += count
+            self.fields[(filename, error_type, field_pos)] += count
+        examples = self.examples.setdefault(error_type, [])
+        if len(examples) < self.max_examples:
+            examples.append({'filename': filename, 'line_number': line_number, 'field_pos': field_pos,
+                             'message': message})
+
+    def add_step(self, step, test_name=None):
+        """
+        Adds a TestCaseStepResult to the summary. A coalesced step counts for each of its lines
+        :param step: a TestCaseStepResult object
+        :param test_name: (optional) name of the test which emitted the step
+        :return: None
+        """
+        self.add_record(step.filename, step.line_number, step.status, step.error_type, step.get_message(),
+                        getattr(step, 'field_pos', None), test_name, step.count)
+
+    def add_suite(self, suite_result):
+        """
+        Adds all the steps of a TestSuiteResult to the summary. The steps already added as they were emitted (see
+        testcase.SummarizedSteps) only count for their test
+        :param suite_result: a TestSuiteResult object
+        :return: None
+        """
+        for tc in suite_result.tcs:
+            test_name = getattr(tc, 'test_name', None)
+            if getattr(tc.steps, 'aggregator', None) is self:
+                if test_name is not None and tc.steps.failed:
+                    self.tests[test_name] += tc.steps.failed
+                continue
+            for step in tc.steps:
+                self.add_step(step, test_name)
+
+    def to_dict(self):
+        """
+        :return: the summary as a dictionary
+        """
+        return {
+            'steps': self.steps,
+            'passed': self.passed,
+            'failed': self.failed,
+            'error_types': dict(self.error_types.most_common()),
+            'files': dict(self.files.most_common()),
+            'tests': dict(self.tests.most_common()),
+            'field_positions': {str(pos): count for pos, count in self.field_positions.most_common()},
+            'top_fields': [{'filename': filename, 'error_type': error_type, 'field_pos': field_pos, 'count': count}
+                           for (filename, error_type, field_pos), count in self.fields.most_common(self.top_n)],
+            'examples': self.examples,
+        }
+
+    def save(self, path):
+        """
+        Writes the summary in a json file
+        :param path: path of the summary file
+        :return: None
+        """
+        with open(path, "w") as summary_file:
+            json.dump(self.to_dict(), summary_file, indent=4, separators=(',', ': '))
+
+    def __str__(self):
+        lines = ["Steps : " + str(self.steps) + ", passed : " + str(self.passed) + ", failed : " + str(self.failed)]
+        for error_type, count in self.error_types.most_common():
+            lines.append("\t" + error_type + " : " + str(count))
+        for (filename, error_type, field_pos), count in self.fields.most_common(self.top_n):
+            lines.append("\t" + filename + " field " + str(field_pos) + " " + error_type + " : " + str(count))
+        return "\n".join(lines)
@@ -1,10 +1,13 @@
-import csv
-import pkgutil
+import collections
 import importlib
+import importlib.util
+import itertools
 import ffparser.testlib
-from ffparser.config import GlobalConfig, GLOBAL_CONFIG_PATH
-import inspect
+from ffparser.config import get_global_config, TEST_INDEX_PATH
 import json
+import os.path
+import time
+from ffparser import groups, memory, profiling, progress, structure, tokenizer, writers
 
 
 class TestExecException(Exception):
@@ -15,57 +18,206 @@ class TestExecException(Exception):
         self.test_name = test_name
 
 
-def list_available_tests(plugin_dirs=None):
+DEFAULT_BATCH_WORKERS = 1
+MIN_BATCH_SIZE = 1000
+
+_test_index_entries = None
+_test_modules = {}
+_test_configs = {}
+_coalesce_steps = False
+_step_summary = None
+_keep_steps = True
+
+
+def iter_source_modules(directory):
     """
-    Lists all available test cases
-    :param plugin_dirs:
-    :return: Test names as a list of strings
+    Lists the python source modules and packages of a directory in the order used by pkgutil
+    :param directory: path of the directory
+    :return: a generator of (module_name, origin) tuples
+    """
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.endswith(".py") and name != "__init__.py" and name[:-3].isidentifier():
+            yield name[:-3], path
+        elif name.isidentifier() and os.path.isfile(os.path.join(path, "__init__.py")):
+            yield name, os.path.join(path, "__init__.py")
+
+
+def iter_test_modules(plugin_dirs=None, sources_only=True):
+    """
+    Lists the modules that may define tests, without importing them. Modules of testlib come first, then the modules
+    of the plugin directories
+    :param plugin_dirs: (optional) list of plugin directories
+    :param sources_only: if enabled only python source modules are listed, which does not require pkgutil. Otherwise
+    compiled modules are listed as well
+    :return: a generator of (module_name, origin, is_plugin) tuples, origin being the path of the module source
     """
-    tests = []
+    if sources_only:
+        for directory in ffparser.testlib.__path__:
+            for modname, origin in iter_source_modules(directory):
+                yield "ffparser.testlib." + modname, origin, False
+        for directory in plugin_dirs or []:
+            for modname, origin in iter_source_modules(directory):
+                yield modname, origin, True
+        return
+
+    import pkgutil
     for importer, modname, ispkg in pkgutil.iter_modules(ffparser.testlib.__path__):
-        module = importlib.import_module("ffparser.testlib." + modname)
-        tests += [attribute for attribute in dir(module) if callable(getattr(module, attribute))
-                  and not inspect.isclass(getattr(module, attribute))]
-        del module
+        spec = importer.find_spec(modname)
+        yield "ffparser.testlib." + modname, spec.origin, False
 
     if plugin_dirs:
         for importer, modname, ispkg in pkgutil.iter_modules(plugin_dirs):
-            module = importer.find_spec(modname).loader.load_module()
-            tests += [attribute for attribute in dir(module) if callable(getattr(module, attribute))
-                      and not inspect.isclass(getattr(module, attribute))]
-            del module
+            spec = importer.find_spec(modname)
+            yield modname, spec.origin, True
 
-    return list(set(tests))
 
+def scan_test_names(origin):
+    """
+    Lists the functions defined at the top level of a module by parsing its source, without executing it. Private
+    functions, which name starts with an underscore, are helpers and not tests
+    :param origin: path of the module source
+    :return: list of function names
+    """
+    import ast
+    with open(origin, "rb") as module_file:
+        tree = ast.parse(module_file.read(), origin)
+    return [node.name for node in tree.body
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not node.name.startswith("_")]
 
-def get_test_callable_by_name(test_name, plugin_dirs=None):
-    if test_name not in (list_available_tests(plugin_dirs)):
-        raise Exception("Could not find the test " + test_name + " in modules")
 
-    for importer, modname, ispkg in pkgutil.iter_modules(ffparser.testlib.__path__):
-        module = importlib.import_module("ffparser.testlib." + modname)
-        if test_name in dir(module):
-            test_callable = getattr(module, test_name)
-            del module
+def get_test_index(plugin_dirs=None, index_path=TEST_INDEX_PATH):
+    """
+    Maps each test name to the module defining it. The test names of each module are persisted in the index file and
+    only scanned again when the module is modified, so that no test module is imported to find a test. Modules since
+    deleted are removed from the index
+    :param plugin_dirs: (optional) list of plugin directories
+    :param index_path: (optional) path of the persisted index. By default TEST_INDEX_PATH
+    :return: a dictionary {test_name: (module_name, origin, is_plugin)}. When two modules define the same test, the
+    first one is used
+    """
+    global _test_index_entries
+    if _test_index_entries is None:
+        try:
+            with open(index_path, "r") as index_file:
+                _test_index_entries = json.load(index_file)
+        except (OSError, ValueError):
+            _test_index_entries = {}
+
+    index = {}
+    updated = False
+    for module_name, origin, is_plugin in iter_test_modules(plugin_dirs):
+        mtime = os.path.getmtime(origin)
+        entry = _test_index_entries.get(origin)
+        if entry is None or entry['mtime'] != mtime:
+            entry = _test_index_entries[origin] = {'mtime': mtime, 'tests': scan_test_names(origin)}
+            updated = True
+        for test_name in entry['tests']:
+            # entries persisted by previous versions may list private functions
+            if not test_name.startswith("_"):
+                index.setdefault(test_name, (module_name, origin, is_plugin))
+    # modules since deleted are dropped. Modules of other plugin directories are kept
+    for origin in [origin for origin in _test_index_entries if not os.path.exists(origin)]:
+        del _test_index_entries[origin]
+        updated = True
+
+    if updated:
+        try:
+            tmp_path = index_path + ".tmp"
+            with open(tmp_path, "w") as index_file:
+                json.dump(_test_index_entries, index_file)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            # the index is only a cache, it is rebuilt on next run when the data directory is read only
+            pass
+
+    return index
+
+
+def load_test_module(module_name, origin, is_plugin):
+    """
+    Imports a test module once per process. Plugin modules are loaded from their path
+    :param module_name: name of the module
+    :param origin: path of the module source
+    :param is_plugin: True if the module is located in a plugin directory
+    :return: the module
+    """
+    mtime = os.path.getmtime(origin)
+    cached = _test_modules.get(origin)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    if is_plugin:
+        spec = importlib.util.spec_from_file_location(module_name, origin)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    _test_modules[origin] = (mtime, module)
+    return module
+
+
+def is_test_callable(attribute):
+    return callable(attribute) and not isinstance(attribute, type)
+
+
+def list_available_tests(plugin_dirs=None):
+    """
+    Lists all available test cases
+    :param plugin_dirs:
+    :return: Test names as a list of strings
+    """
+    return list(get_test_index(plugin_dirs))
+
+
+def get_test_callable_by_name(test_name, plugin_dirs=None):
+    """
+    Finds a test by its name. Only the module defining the test is imported
+    :param test_name: name of the test
+    :param plugin_dirs: (optional) list of plugin directories
+    :return: the test callable
+    """
+    entry = get_test_index(plugin_dirs).get(test_name)
+    if entry is not None:
+        test_callable = getattr(load_test_module(*entry), test_name, None)
+        if is_test_callable(test_callable):
             return test_callable
-        del module
 
-    if plugin_dirs:
-        for importer, modname, ispkg in pkgutil.iter_modules(plugin_dirs):
-            module = importer.find_spec(modname).loader.load_module()
-            if test_name in dir(module):
-                test_callable = getattr(module, test_name)
-                return test_callable
-            del module
+    if test_name.startswith("_"):
+        raise Exception("Could not find the test " + test_name + " in modules. Private functions are not tests")
+
+    # tests which are not defined by a def statement, e.g. imported or generated callables, or defined in compiled
+    # modules are searched by importing the modules
+    for module_name, origin, is_plugin in iter_test_modules(plugin_dirs, sources_only=False):
+        if origin is None:
+            continue
+        test_callable = getattr(load_test_module(module_name, origin, is_plugin), test_name, None)
+        if is_test_callable(test_callable):
+            return test_callable
 
     raise Exception("Could not find the test " + test_name + " in modules")
 
 
+def load_test_configs(test_confs_path):
+    """
+    Reads the test configurations file. It is read again only when modified
+    :param test_confs_path: path of the test configurations file
+    :return: the list of test configuration dictionaries
+    """
+    mtime = os.path.getmtime(test_confs_path)
+    cached = _test_configs.get(test_confs_path)
+    if cached is None or cached[0] != mtime:
+        with open(test_confs_path, 'r') as test_confs_file:
+            cached = _test_configs[test_confs_path] = (mtime, json.load(test_confs_file)['configs'])
+    return cached[1]
+
+
 def get_test_case_config_from_name(test_name):
-    global_config = GlobalConfig(GLOBAL_CONFIG_PATH)
-    test_confs_path = global_config.test_configs
-    with open(test_confs_path, 'r') as test_confs_file:
-        test_confs_dict = json.load(test_confs_file)['configs']
+    test_confs_dict = load_test_configs(get_global_config().test_configs)
 
     if test_name not in [conf['test_conf_name'] for conf in test_confs_dict]:
         test_conf_dict = [conf for conf in test_confs_dict if conf['test_conf_name'] == 'default'][0]
@@ -75,6 +227,243 @@ def get_test_case_config_from_name(test_name):
     return TestCaseConf(test_conf_dict)
     
 
+def batch_test(columns=False, line_pattern=None):
+    """
+    Declares a test working on batches of rows instead of a whole FlatFile. The decorated function is called as
+    test(rows, row_structure, flat_file_object) with the rows of a batch sharing the same row structure, or with the
+    list of their columns (one tuple of values per field) if columns is enabled. It returns an iterable of failures
+    (index, error_type, message) or (index, error_type, message, field_pos), index being the position of the failing
+    row in the batch.
+    The engine reads the file by batches, resolves the row structures, reports the rows without row structure or with
+    a wrong number of fields as ROW_STRUCT_ERROR and builds the TestCaseResult. The batch size and the number of
+    threads are read from the optional 'batch_size' and 'workers' keys of the test configuration
+    :param columns: if enabled the test receives the columns of the batch instead of its rows
+    :param line_pattern: (optional) row structure attributes listing the only fields checked by the test, among
+    structure.LINE_PATTERN_FIELDS. The rows of positional files matching the line pattern of these fields (see
+    structure.get_line_pattern) pass the test and are not passed to it
+    :return: the decorator
+    """
+    def decorator(test_function):
+        test_function.batch_test = True
+        test_function.batch_columns = columns
+        test_function.batch_line_pattern = line_pattern
+        return test_function
+    return decorator
+
+
+def is_batch_test(test_callable):
+    return getattr(test_callable, 'batch_test', False)
+
+
+def group_test():
+    """
+    Declares a test working on the groups of consecutive rows sharing a key of a file sorted by key, e.g. to check the
+    consistency of a header row and its detail rows. The decorated function is called as test(group, flat_file_object)
+    with a groups.KeyGroup, the rows of the group being in group.rows and their row structures in group.row_structures.
+    It returns an iterable of failures (index, error_type, message) or (index, error_type, message, field_pos), index
+    being the position of the failing row in the group.
+    The engine streams the groups (see groups.iter_key_groups), so that only one group is held in memory, and builds
+    the TestCaseResult. The previous_key of the groups which key is out of order is set, the order itself being checked
+    by check_key_order only. Groups of rows without key are passed to the test as well, with None as key. The batch
+    size is read from the optional 'batch_size' key of the test configuration
+    :return: the decorator
+    """
+    def decorator(test_function):
+        test_function.group_test = True
+        return test_function
+    return decorator
+
+
+def is_group_test(test_callable):
+    return getattr(test_callable, 'group_test', False)
+
+
+def whole_file_test(streaming=False):
+    """
+    Declares a test which result depends on all the rows of the file, e.g. the control totals of a trailer or the keys
+    found twice. Such a test gives wrong results on a part of the file: it does not run on the samples of a file (see
+    sampling.SampledFlatFile) and the files of a structure with such a test are not split into work units by a
+    distributed run (see distributed.split_file)
+    :param streaming: if enabled the test only reads the rows through FlatFile.iter_batches, so that the file can be
+    tested in stream mode when it does not fit in the memory budget
+    :return: the decorator
+    """
+    def decorator(test_function):
+        test_function.whole_file_test = True
+        test_function.streaming_test = streaming
+        return test_function
+    return decorator
+
+
+def is_whole_file_test(test_callable):
+    return getattr(test_callable, 'whole_file_test', False)
+
+
+def is_streaming_test(test_callable):
+    """
+    :param test_callable: test callable
+    :return: True if the test can run on a FlatFile in stream mode, i.e. is a batch or group test or is declared with
+    whole_file_test(streaming=True)
+    """
+    return is_batch_test(test_callable) or is_group_test(test_callable) \
+        or getattr(test_callable, 'streaming_test', False)
+
+
+class BatchTestRunner(object):
+    """
+    Runs a test declared with batch_test on a FlatFile
+    """
+    def __init__(self, test_method, flat_file_object):
+        """
+        :param test_method: function decorated with batch_test
+        :param flat_file_object: FlatFile object to be tested
+        """
+        self.test_method = test_method
+        self.columns = getattr(test_method, 'batch_columns', False)
+        self.line_pattern = getattr(test_method, 'batch_line_pattern', None)
+        self.flat_file_object = flat_file_object
+        self.filename = os.path.basename(flat_file_object.filename)
+        self.type_index = flat_file_object.structure.type_pos - 1
+        self.row_structures = {}
+        self.rows = 0
+
+    def get_row_structure(self, row_type):
+        row_struct = self.row_structures.get(row_type)
+        if row_struct is None:
+            row_struct = self.row_structures[row_type] = self.flat_file_object.get_row_structure_from_type(row_type)
+        return row_struct
+
+    def run_batch(self, first_line, rows):
+        """
+        Tests a batch of rows
+        :param first_line: line number of the first row of the batch
+        :param rows: list of rows
+        :return: list of (line_number, error_type, message, field_pos) tuples sorted by line
+        """
+        failures = []
+        groups = collections.OrderedDict()
+        type_index = self.type_index
+        for idx, row in enumerate(rows):
+            row_struct = self.get_row_structure(row[type_index])
+            # the lookup returns an error message when no single row structure matches
+            if isinstance(row_struct, str):
+                failures.append((first_line + idx, 'ROW_STRUCT_ERROR', row_struct, None))
+                continue
+            length = getattr(row_struct, 'length', None)
+            if length is not None and len(row) != length:
+                failures.append((first_line + idx, 'ROW_STRUCT_ERROR', "Wrong number or fields for this row. "
+                                 + str(len(row)) + " fields instead of " + str(length), None))
+                continue
+            group = groups.get(id(row_struct))
+            if group is None:
+                line_pattern = self.line_pattern and structure.get_line_pattern(self.flat_file_object.structure,
+                                                                                 row_struct, self.line_pattern)
+                group = groups[id(row_struct)] = (row_struct, [], [], line_pattern.fullmatch if line_pattern else None)
+            # rows matching the line pattern pass the test
+            if group[3] is not None and group[3]("".join(row)):
+                continue
+            group[1].append(first_line + idx)
+            group[2].append(row)
+
+        for row_struct, line_numbers, group_rows, row_match in groups.values():
+            if not group_rows:
+                continue
+            data = list(zip(*group_rows)) if self.columns else group_rows
+            for failure in self.test_method(data, row_struct, self.flat_file_object) or []:
+                field_pos = failure[3] if len(failure) > 3 else None
+                failures.append((line_numbers[failure[0]], failure[1], failure[2], field_pos))
+
+        failures.sort(key=lambda failure: failure[0])
+        return failures
+
+    def iter_batches(self, batch_size):
+        first_line = 1
+        for rows in self.flat_file_object.iter_batches(batch_size):
+            self.rows += len(rows)
+            yield first_line, rows
+            first_line += len(rows)
+
+    def run(self, batch_size=tokenizer.DEFAULT_BATCH_SIZE, workers=DEFAULT_BATCH_WORKERS):
+        """
+        Runs the test on all the rows of the file
+        :param batch_size: number of rows per batch
+        :param workers: number of threads testing batches concurrently. Batches are read ahead by at most twice the
+        number of workers and their results are gathered in the order of the file. With a memory budget, the batch size
+        and the number of workers are reduced when the memory left is short
+        :return: a TestCaseResult object
+        """
+        governor = memory.get_governor()
+        batch_size = governor.scale(batch_size, MIN_BATCH_SIZE)
+        workers = governor.limit_workers(workers, 2 * batch_size * memory.ROW_MEMORY)
+        result = TestCaseResult()
+        if workers <= 1:
+            batch_failures = (self.run_batch(first_line, rows) for first_line, rows in self.iter_batches(batch_size))
+            for failures in batch_failures:
+                self.add_failures(result, failures)
+            return result
+
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            pending = collections.deque()
+            for first_line, rows in self.iter_batches(batch_size):
+                pending.append(executor.submit(self.run_batch, first_line, rows))
+                if len(pending) >= 2 * workers:
+                    self.add_failures(result, pending.popleft().result())
+            while pending:
+                self.add_failures(result, pending.popleft().result())
+        return result
+
+    def add_failures(self, result, failures):
+        filename = self.filename
+        result.steps.extend([TestCaseStepResult(line_number, False, error_type, message, filename, field_pos=field_pos)
+                             for line_number, error_type, message, field_pos in failures])
+
+
+class GroupTestRunner(object):
+    """
+    Runs a test declared with group_test on a FlatFile
+    """
+    def __init__(self, test_method, flat_file_object):
+        """
+        :param test_method: function decorated with group_test
+        :param flat_file_object: FlatFile object to be tested
+        """
+        self.test_method = test_method
+        self.flat_file_object = flat_file_object
+        self.filename = os.path.basename(flat_file_object.filename)
+        self.rows = 0
+
+    def run_group(self, group):
+        """
+        Tests a group of rows
+        :param group: KeyGroup object
+        :return: list of (line_number, error_type, message, field_pos) tuples sorted by line
+        """
+        failures = []
+        for failure in self.test_method(group, self.flat_file_object) or []:
+            field_pos = failure[3] if len(failure) > 3 else None
+            failures.append((group.get_line_number(failure[0]), failure[1], failure[2], field_pos))
+        failures.sort(key=lambda failure: failure[0])
+        return failures
+
+    def run(self, batch_size=tokenizer.DEFAULT_BATCH_SIZE):
+        """
+        Runs the test on all the groups of the file
+        :param batch_size: number of rows read at once
+        :return: a TestCaseResult object
+        """
+        batch_size = memory.get_governor().scale(batch_size, MIN_BATCH_SIZE)
+        result = TestCaseResult()
+        filename = self.filename
+        steps = result.steps
+        for group in groups.iter_key_groups(self.flat_file_object, batch_size):
+            self.rows += len(group)
+            for line_number, error_type, message, field_pos in self.run_group(group):
+                steps.append(TestCaseStepResult(line_number, False, error_type, message, filename,
+                                                field_pos=field_pos))
+        return result
+
+
 class TestCaseConf:
     def __init__(self, tc_conf_dict):
         required_keys = ['test_conf_name','allowed_file_types','allowed_structures','required_structure_fields','required_row_fields']
@@ -91,15 +480,60 @@ class TestCaseConf:
 
 class TestCase:
     def __init__(self, test_name, conf_obj, plugin_dirs=None):
-        self.test_method = get_test_callable_by_name(test_name, plugin_dirs)
+        with profiling.get_profiler().phase('test_case.discovery'):
+            self.test_method = get_test_callable_by_name(test_name, plugin_dirs)
         self.test_name = test_name
         self.test_conf_name = conf_obj.test_conf_name
         self.allowed_file_types = conf_obj.allowed_file_types
         self.allowed_structures = conf_obj.allowed_structures
         self.required_structure_fields = conf_obj.required_structure_fields
         self.required_row_fields = conf_obj.required_row_fields
+        self.batch_size = getattr(conf_obj, 'batch_size', tokenizer.DEFAULT_BATCH_SIZE)
+        self.workers = getattr(conf_obj, 'workers', DEFAULT_BATCH_WORKERS)
 
     def run(self, flat_file_object):
+        profiler = profiling.get_profiler()
+        with profiler.phase('test_case.requirements'):
+            self.check_requirements(flat_file_object)
+
+        tracker = progress.get_tracker()
+        tracker.start_test(self.test_name)
+        start = time.perf_counter()
+        batch_runner = None
+        with profiler.phase('test_case.execute'):
+            try:
+                if is_batch_test(self.test_method):
+                    batch_runner = BatchTestRunner(self.test_method, flat_file_object)
+                    tc_result = batch_runner.run(self.batch_size, self.workers)
+                elif is_group_test(self.test_method):
+                    batch_runner = GroupTestRunner(self.test_method, flat_file_object)
+                    tc_result = batch_runner.run(self.batch_size)
+                else:
+                    tc_result = self.test_method(flat_file_object)
+            except Exception as err:
+                msg = (str(err) or type(err).__name__) + ". Error during execution of test " + self.test_name
+                raise TestExecException(msg, flat_file_object.filename, self.test_name)
+
+        if getattr(tc_result, 'test_name', None) is None:
+            tc_result.test_name = self.test_name
+        if profiler.enabled:
+            errors = tc_result.count_failed()
+            rows = batch_runner.rows if batch_runner is not None else len(flat_file_object.rows)
+            profiler.record_test(flat_file_object.filename, self.test_name, time.perf_counter() - start,
+                                 rows, errors)
+            profiler.count('errors', errors)
+        if tracker.enabled:
+            tracker.end_test(self.test_name, tc_result.count_failed())
+
+        return tc_result
+
+    def check_requirements(self, flat_file_object):
+        """
+        Checks that the test is allowed for the structure of the file and that the structure defines the fields
+        required by the test
+        :param flat_file_object: FlatFile object to be tested
+        :return: None. Raises a TestExecException if a requirement is not met
+        """
         if self.allowed_structures != 'all' and (flat_file_object.structure.name not in self.allowed_structures):
             msg = "Test '" + self.test_name + "' is not allowed for file structure '" \
                   + flat_file_object.structure.name + "'"
@@ -129,32 +563,219 @@ class TestCase:
                       + flat_file_object.structure.name + "'"
                 raise TestExecException(msg, flat_file_object.filename, self.test_name)
 
-        try:
-            tc_result = self.test_method(flat_file_object)
-        except Exception as err:
-            msg = err.args[0] + ". Error during execution of test " + self.test_name
-            raise TestExecException(msg, flat_file_object.filename, self.test_name)
-
-        return tc_result
-
 
 class TestCaseStepResult(object):
-    def __init__(self, line_number, status, error_type, message, filename=""):
+    def __init__(self, line_number, status, error_type, message, filename="", field_pos=None, last_line=None,
+                 ref_line=None):
         self.status = status
         self.error_type = error_type
         self.message = message
         self.filename = filename
         self.line_number = line_number
+        # position of the field concerned by the step, None if it concerns the whole line
+        self.field_pos = field_pos
+        # last line of a step coalesced from the identical steps of consecutive lines, see CoalescedSteps
+        self.last_line = line_number if last_line is None else last_line
+        # line of the first occurrence of what the line of the step repeats, e.g. of a duplicate key. Kept out of the
+        # message so that the line numbers of sampled and split files can be translated
+        self.ref_line = ref_line
+
+    @property
+    def count(self):
+        """
+        :return: number of lines of the step, more than 1 for a coalesced step
+        """
+        if not isinstance(self.line_number, int) or self.last_line == self.line_number:
+            return 1
+        return self.last_line - self.line_number + 1
+
+    def get_message(self, with_range=True):
+        """
+        :param with_range: False to leave out the range of lines of a coalesced step
+        :return: the message of the step, followed by its reference line and by its range of lines for a coalesced step
+        """
+        message = self.message
+        if self.ref_line is not None:
+            message += " (first found at line " + str(self.ref_line) + ")"
+        if self.count == 1 or not with_range:
+            return message
+        return message + " (" + str(self.count) + " lines from " + str(self.line_number) + " to " \
+            + str(self.last_line) + ")"
 
     def __str__(self):
-        return self.filename + ";line " + str(self.line_number) + ";" + str(self.status) + ";" \
-               + self.error_type + ";" + self.message
+        lines = str(self.line_number) if self.count == 1 else str(self.line_number) + "-" + str(self.last_line)
+        return self.filename + ";line " + lines + ";" + str(self.status) + ";" + self.error_type + ";" \
+            + self.get_message(with_range=False)
+
+
+class CoalescedSteps(object):
+    """
+    Step store merging the steps of consecutive lines with the same filename, status, error type, field position and
+    reference line into a single step covering the range of lines, with the message of its first line. Steps are
+    expected in the order of their lines, as emitted by the tests: a range is stored once a step of a later line shows
+    it cannot be extended, so the steps are ordered by the last line of their range. Steps without line number are
+    stored as is
+    """
+    def __init__(self, store):
+        """
+        :param store: list like store receiving the coalesced steps
+        """
+        self.store = store
+        # open ranges by (filename, status, error_type, field_pos, ref_line)
+        self.ranges = {}
+        self.current_line = None
+
+    def append(self, step):
+        line_number = step.line_number
+        if not isinstance(line_number, int):
+            self.store.append(step)
+            return
+        if line_number != self.current_line:
+            self.close_ranges(line_number)
+            self.current_line = line_number
+        key = (step.filename, step.status, step.error_type, step.field_pos, step.ref_line)
+        open_range = self.ranges.get(key)
+        if open_range is not None and open_range.last_line + 1 == line_number:
+            open_range.last_line = step.last_line
+            return
+        if open_range is not None:
+            self.store.append(open_range)
+        self.ranges[key] = step
+
+    def extend(self, steps):
+        for step in steps:
+            self.append(step)
+
+    def close_ranges(self, line_number=None):
+        """
+        Stores the ranges which cannot be extended by the steps of a line
+        :param line_number: (optional) line of the next steps. By default all the ranges are stored
+        :return: None
+        """
+        closed = [(key, open_range) for key, open_range in self.ranges.items()
+                  if line_number is None or not open_range.last_line <= line_number <= open_range.last_line + 1]
+        closed.sort(key=lambda item: item[1].line_number)
+        for key, open_range in closed:
+            del self.ranges[key]
+            self.store.append(open_range)
+
+    def __len__(self):
+        self.close_ranges()
+        return len(self.store)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        self.close_ranges()
+        return iter(self.store)
+
+    def __getitem__(self, index):
+        self.close_ranges()
+        return self.store[index]
+
+
+def get_step_coalescing():
+    """
+    :return: True if the steps of the test case results are coalesced, see set_step_coalescing
+    """
+    return _coalesce_steps
+
+
+def set_step_coalescing(enabled):
+    """
+    Enables the coalescing of the steps of the test case results created afterwards, see CoalescedSteps
+    :param enabled: True to coalesce the steps
+    :return: None
+    """
+    global _coalesce_steps
+    _coalesce_steps = enabled
+
+
+class SummarizedSteps(object):
+    """
+    Step store adding each step to a SummaryAggregator as it is emitted, before passing it on to the store it wraps.
+    Without store the steps are dropped once summarized and only their counts are kept
+    """
+    def __init__(self, store, aggregator):
+        """
+        :param store: list like store receiving the steps, None to drop them
+        :param aggregator: SummaryAggregator object
+        """
+        self.store = store
+        self.aggregator = aggregator
+        self.steps = 0
+        self.passed = 0
+        self.failed = 0
+
+    def append(self, step):
+        # the test name is only known once the test is run, see SummaryAggregator.add_suite
+        self.aggregator.add_step(step)
+        self.steps += 1
+        if step.status:
+            self.passed += step.count
+        else:
+            self.failed += step.count
+        if self.store is not None:
+            self.store.append(step)
+
+    def extend(self, steps):
+        for step in steps:
+            self.append(step)
+
+    def __len__(self):
+        return len(self.store) if self.store is not None else self.steps
+
+    def __bool__(self):
+        return self.steps > 0
+
+    def __iter__(self):
+        return iter(self.store) if self.store is not None else iter(())
+
+    def __getitem__(self, index):
+        if self.store is None:
+            raise IndexError("The steps are not kept, only their summary")
+        return self.store[index]
+
+
+def set_step_summary(aggregator, keep_steps=True):
+    """
+    Adds the steps of the test case results created afterwards to a summary as they are emitted, see SummarizedSteps
+    :param aggregator: SummaryAggregator object, None to stop summarizing the steps
+    :param keep_steps: if False the steps are not kept once summarized, e.g. when no result file is written
+    :return: None
+    """
+    global _step_summary, _keep_steps
+    _step_summary = aggregator
+    _keep_steps = keep_steps
+
+
+def new_step_store():
+    """
+    :return: a list like store receiving the steps of a test case result, spilled to disk under memory pressure when
+    a memory budget is set, coalescing the identical steps of consecutive lines when enabled and feeding the summary
+    of the results when set
+    """
+    if _step_summary is not None and not _keep_steps:
+        return SummarizedSteps(None, _step_summary)
+    store = memory.get_governor().new_step_store()
+    if _coalesce_steps:
+        store = CoalescedSteps(store)
+    if _step_summary is not None:
+        return SummarizedSteps(store, _step_summary)
+    return store
 
 
 class TestCaseResult(object):
     def __init__(self):
         self.status = None
-        self.steps = []
+        # list of TestCaseStepResult, see new_step_store
+        self.steps = new_step_store()
+        self.test_name = None
+        self._counted_steps = None
+        self._counted = 0
+        self._passed = 0
+        self._failed = 0
 
     def set_status(self):
         if len(self.steps) == 0:
@@ -172,11 +793,43 @@ class TestCaseResult(object):
     def __str__(self):
         return "\n".join([step.__str__() for step in self.steps])
 
+    def update_counts(self):
+        """
+        Counts the steps appended since the last count, so that counting does not go through all the steps each time
+        :return: None
+        """
+        steps = self.steps
+        if isinstance(steps, SummarizedSteps):
+            # counted as they are emitted
+            self._passed = steps.passed
+            self._failed = steps.failed
+            return
+        if steps is not self._counted_steps or len(steps) < self._counted:
+            self._counted_steps = steps
+            self._counted = self._passed = self._failed = 0
+        if len(steps) == self._counted:
+            return
+        passed = 0
+        failed = 0
+        new_steps = 0
+        # a coalesced step counts for each of its lines
+        for step in itertools.islice(steps, self._counted, None):
+            new_steps += 1
+            if step.status:
+                passed += step.count
+            else:
+                failed += step.count
+        self._counted += new_steps
+        self._passed += passed
+        self._failed += failed
+
     def count_passed(self):
-        return len([step for step in self.steps if step.status])
+        self.update_counts()
+        return self._passed
 
     def count_failed(self):
-        return len([step for step in self.steps if not step.status])
+        self.update_counts()
+        return self._failed
 
 
 class TestSuiteResult(object):
@@ -207,8 +860,6 @@ class TestSuiteResult(object):
         return "\n".join([tc.__str__() for tc in self.tcs])
 
     def to_csv(self, file):
-        csv_writer = csv.writer(file, delimiter=';', quotechar="\"")
-        for tc in self.tcs:
-            for step in tc.steps:
-                csv_writer.writerow([step.filename, str(step.line_number),  str(step.status),
-                                     step.error_type, step.message])
\ No newline at end of file
+        writer = writers.CsvResultWriter(file)
+        writer.write_suite(self)
+        writer.flush()
\ No newline at end of file
@@ -1,45 +1,40 @@
 import time
 import os.path
-from ffparser.testcase import TestCaseStepResult, TestCaseResult
+from ffparser import duplicates, memory, structure, tokenizer, totals
+from ffparser.testcase import TestCaseStepResult, TestCaseResult, batch_test, group_test, whole_file_test
+from ffparser.testcase import get_test_case_config_from_name, DEFAULT_BATCH_WORKERS, MIN_BATCH_SIZE
 
 
-def check_dates(flat_file_object):
+@batch_test()
+def check_dates(rows, row_struct, flat_file_object):
     """
     Check the date format of a given csv according to its structure
+    :param rows: rows of a batch sharing the row structure row_struct
+    :param row_struct: the RowStructure of the rows
     :param flat_file_object: the FlatFile object containing the content of the flat file and file structure
-    :return: a TesCaseResult object with all the lines and position containing date format error
+    :return: the failures of the batch, for all the lines and position containing date format error
     """
-    result = TestCaseResult()
-    for idx, row in enumerate(flat_file_object.rows):
-        row_type = row[flat_file_object.structure.type_pos - 1]
-        row_struct = flat_file_object.get_row_structure_from_type(row_type)
-
-        # DISGUSTING : to be handled with custom exceptions in method get_row_structure_from_type
-        if type(row_struct).__name__ == 'str':
-            step_result = TestCaseStepResult(idx + 1, False, 'ROW_STRUCT_ERROR', row_struct,
-                                             os.path.basename(flat_file_object.filename))
-            result.steps.append(step_result)
-            continue
-
-        if len(row) != row_struct.length:
-            step_result = TestCaseStepResult(idx + 1, False, 'ROW_STRUCT_ERROR', "Wrong number or fields for this row. "
-                                             + str(len(row)) + " fields instead of " + str(row_struct.length),
-                                             os.path.basename(flat_file_object.filename))
-            result.steps.append(step_result)
-            continue
-
+    date_fmt = flat_file_object.structure.date_fmt
+    failures = []
+    # each distinct date is parsed once per batch
+    valid_dates = {}
+    for idx, row in enumerate(rows):
         for pos in row_struct.date_fields:
             date_string = row[pos - 1]
             if date_string == '':
                 continue
-            try:
-                date = time.strptime(date_string, flat_file_object.structure.date_fmt)
-            except ValueError:
-                step_result = TestCaseStepResult(idx + 1, False, 'DATE_FORMAT', "DATE format is incorrect at position "
-                                                 + str(pos) + " should be '" + flat_file_object.structure.date_fmt + "'",
-                                                 os.path.basename(flat_file_object.filename))
-                result.steps.append(step_result)
-    return result
+            valid = valid_dates.get(date_string)
+            if valid is None:
+                try:
+                    time.strptime(date_string, date_fmt)
+                    valid = True
+                except ValueError:
+                    valid = False
+                valid_dates[date_string] = valid
+            if not valid:
+                failures.append((idx, 'DATE_FORMAT', "DATE format is incorrect at position " + str(pos)
+                                 + " should be '" + date_fmt + "'", pos))
+    return failures
 
 
 def check_required(flat_file_object):
@@ -70,7 +65,8 @@ def check_required(flat_file_object):
                 continue
             if row[pos] == '':
                 step_result = TestCaseStepResult(idx + 1, False, 'REQUIRED_FIELD', "Missing required field at position "
-                                             + str(pos + 1), os.path.basename(flat_file_object.filename))
+                                             + str(pos + 1), os.path.basename(flat_file_object.filename),
+                                             field_pos=pos + 1)
                 result.steps.append(step_result)
     return result
 
@@ -104,7 +100,8 @@ def check_field_lengths(flat_file_object):
                 continue
             if len(field_content) != fixed_length[1]:
                 step_result = TestCaseStepResult(idx + 1, False, 'FIELD_LENGTH_ERROR', "Wrong field length at position "
-                                                 + str(fixed_length[0]) + ". Should be " + str(fixed_length[1]), os.path.basename(flat_file_object.filename))
+                                                 + str(fixed_length[0]) + ". Should be " + str(fixed_length[1]), os.path.basename(flat_file_object.filename),
+                                                 field_pos=fixed_length[0])
                 result.steps.append(step_result)
     return result
 
@@ -116,6 +113,7 @@ def check_digit_fields(flat_file_object):
     :return: a TesCaseResult object with all the lines and position containing alpha instead of digit fields
     """
     result = TestCaseResult()
+    line_patterns = {}
     for idx, row in enumerate(flat_file_object.rows):
         row_type = row[flat_file_object.structure.type_pos - 1]
         row_struct = flat_file_object.get_row_structure_from_type(row_type)
@@ -132,6 +130,14 @@ def check_digit_fields(flat_file_object):
             result.steps.append(step_result)
             continue
 
+        # positional lines matching the line pattern of their row structure have valid digit fields
+        if id(row_struct) not in line_patterns:
+            line_patterns[id(row_struct)] = structure.get_line_pattern(flat_file_object.structure, row_struct,
+                                                                       ['digit_fields'])
+        line_pattern = line_patterns[id(row_struct)]
+        if line_pattern is not None and line_pattern.fullmatch("".join(row)):
+            continue
+
         for digit_field in row_struct.digit_fields:
             field_content = row[digit_field - 1]
             if field_content == '':
@@ -139,7 +145,8 @@ def check_digit_fields(flat_file_object):
             if not field_content.isdigit():
                 step_result = TestCaseStepResult(idx + 1, False, 'FIELD_FORMAT_ERROR',
                                                  "Field should be numeric at field " + str(digit_field) + " : '"
-                                                 + field_content + "'", os.path.basename(flat_file_object.filename))
+                                                 + field_content + "'", os.path.basename(flat_file_object.filename),
+                                                 field_pos=digit_field)
                 result.steps.append(step_result)
     return result
 
@@ -152,7 +159,7 @@ def check_carriage_return(flat_file_object):
     """
     result = TestCaseResult()
     carriage_return = flat_file_object.structure.carriage_return
-    with open(flat_file_object.filename, "r", newline='', encoding='utf8') as file:
+    with flat_file_object.open_raw(newline='', encoding='utf8', errors='replace') as file:
         lines = file.readlines()
     for idx, line in enumerate(lines):
         if line.endswith("\r\n"):
@@ -170,40 +177,30 @@ def check_carriage_return(flat_file_object):
     return result
 
 
-def check_decimal(flat_file_object):
-    result = TestCaseResult()
-    for idx, row in enumerate(flat_file_object.rows):
-        row_type = row[flat_file_object.structure.type_pos - 1]
-        row_struct = flat_file_object.get_row_structure_from_type(row_type)
-
-        if type(row_struct).__name__ == 'str':
-            step_result = TestCaseStepResult(idx + 1, False, 'ROW_STRUCT_ERROR', row_struct,
-                                             os.path.basename(flat_file_object.filename))
-            result.steps.append(step_result)
-            continue
-
-        if len(row) != row_struct.length:
-            step_result = TestCaseStepResult(idx + 1, False, 'ROW_STRUCT_ERROR', "Wrong number or fields for this row. "
-                                             + str(len(row)) + " fields instead of " + str(row_struct.length),
-                                             os.path.basename(flat_file_object.filename))
-            result.steps.append(step_result)
-            continue
-
-        for decimal_field in row_struct.decimal_fields:
-            field_content = row[decimal_field - 1]
+@batch_test(columns=True, line_pattern=['decimal_fields'])
+def check_decimal(columns, row_struct, flat_file_object):
+    """
+    Check that the decimal fields are made of digits and of the decimal separator
+    :param columns: columns of a batch of rows sharing the row structure row_struct
+    :param row_struct: the RowStructure of the rows
+    :param flat_file_object: the FlatFile object containing the content of the flat file and file structure
+    :return: the failures of the batch, for all the lines and position containing wrong decimals
+    """
+    decimal_sep = flat_file_object.structure.decimal_sep
+    failures = []
+    for decimal_field in row_struct.decimal_fields:
+        for idx, field_content in enumerate(columns[decimal_field - 1]):
             if field_content == '':
                 continue
-
-            if not field_content.replace(flat_file_object.structure.decimal_sep,'').isdigit():
-                step_result = TestCaseStepResult(idx + 1, False, 'FIELD_FORMAT_ERROR', "Field " + str(decimal_field) +
-                                                 " should be numeric with separator '" + field_content + "'"
-                                                 , os.path.basename(flat_file_object.filename))
-                result.steps.append(step_result)
-    return result
+            if not field_content.replace(decimal_sep, '').isdigit():
+                failures.append((idx, 'FIELD_FORMAT_ERROR', "Field " + str(decimal_field)
+                                 + " should be numeric with separator '" + field_content + "'", decimal_field))
+    return failures
 
 
 def check_fixed_values(flat_file_object):
     result = TestCaseResult()
+    line_patterns = {}
     for idx, row in enumerate(flat_file_object.rows):
         row_type = row[flat_file_object.structure.type_pos - 1]
         row_struct = flat_file_object.get_row_structure_from_type(row_type)
@@ -221,6 +218,13 @@ def check_fixed_values(flat_file_object):
             result.steps.append(step_result)
             continue
 
+        if id(row_struct) not in line_patterns:
+            line_patterns[id(row_struct)] = structure.get_line_pattern(flat_file_object.structure, row_struct,
+                                                                       ['decimal_fields'])
+        line_pattern = line_patterns[id(row_struct)]
+        if line_pattern is not None and line_pattern.fullmatch("".join(row)):
+            continue
+
         for decimal_field in row_struct.decimal_fields:
             field_content = row[decimal_field - 1]
             if field_content == '':
@@ -229,6 +233,104 @@ def check_fixed_values(flat_file_object):
             if not field_content.replace(flat_file_object.structure.decimal_sep, '').isdigit():
                 step_result = TestCaseStepResult(idx + 1, False, 'FIELD_FORMAT_ERROR', "Field " + str(idx + 1) +
                                                  "should be numeric with separator '" + field_content + "'"
-                                                 , os.path.basename(flat_file_object.filename))
+                                                 , os.path.basename(flat_file_object.filename), field_pos=decimal_field)
                 result.steps.append(step_result)
     return result
+
+
+@whole_file_test(streaming=True)
+def check_duplicate_keys(flat_file_object):
+    """
+    Check that the key (key_pos field) of each row is unique among the rows of the same row structure. The rows are
+    read twice and never all held in memory in stream mode
+    :param flat_file_object: the FlatFile object containing the content of the flat file and file structure
+    :return: a TestCaseResult object with the rows which key was found on a previous line
+    """
+    result = TestCaseResult()
+    type_index = flat_file_object.structure.type_pos - 1
+    row_structures = {}
+
+    def get_key(row):
+        row_type = row[type_index] if len(row) > type_index else ""
+        row_struct = row_structures.get(row_type)
+        if row_struct is None:
+            row_struct = row_structures[row_type] = flat_file_object.get_row_structure_from_type(row_type)
+        # rows without row structure are reported by the other tests
+        if isinstance(row_struct, str) or not row_struct.key_pos or len(row) < row_struct.key_pos:
+            return None
+        key = row[row_struct.key_pos - 1]
+        if key == '':
+            return None
+        return row_struct.type + "\x1f" + key
+
+    key_positions = {row_struct.type: row_struct.key_pos for row_struct in flat_file_object.structure.row_structures}
+    filename = os.path.basename(flat_file_object.filename)
+    finder = duplicates.get_duplicate_finder(flat_file_object, get_key)
+    for line_number, first_line, key in finder.find(flat_file_object):
+        row_type, key_value = key.split("\x1f", 1)
+        step_result = TestCaseStepResult(line_number, False, 'DUPLICATE_KEY', "Duplicate key '" + key_value + "'",
+                                         filename, field_pos=key_positions.get(row_type), ref_line=first_line)
+        result.steps.append(step_result)
+    return result
+
+
+@whole_file_test()
+@group_test()
+def check_key_order(group, flat_file_object):
+    """
+    Check that the file is sorted by key (key_pos field), the rows of a key following each other. The groups are
+    streamed by the engine, in constant memory
+    :param group: KeyGroup of consecutive rows sharing a key
+    :param flat_file_object: the FlatFile object containing the content of the flat file and file structure
+    :return: a KEY_ORDER_ERROR failure on the first row of the group if its key is out of order
+    """
+    if not group.out_of_order:
+        return []
+    if group.key == group.previous_key:
+        message = "Rows of key '" + group.key + "' are not consecutive"
+    else:
+        message = "Key '" + group.key + "' found after key '" + group.previous_key + "'. The file is not sorted by key"
+    return [(0, 'KEY_ORDER_ERROR', message, group.row_structures[0].key_pos)]
+
+
+@whole_file_test(streaming=True)
+def check_duplicate_rows(flat_file_object):
+    """
+    Check that no row is the exact copy of a previous row, fields being compared once parsed. The rows are read twice
+    and never all held in memory in stream mode
+    :param flat_file_object: the FlatFile object containing the content of the flat file and file structure
+    :return: a TestCaseResult object with the rows found on a previous line
+    """
+    result = TestCaseResult()
+    filename = os.path.basename(flat_file_object.filename)
+    finder = duplicates.get_duplicate_finder(flat_file_object, lambda row: "\x1f".join(row))
+    for line_number, first_line, key in finder.find(flat_file_object):
+        step_result = TestCaseStepResult(line_number, False, 'DUPLICATE_ROW', "Duplicate row", filename,
+                                         ref_line=first_line)
+        result.steps.append(step_result)
+    return result
+
+
+@whole_file_test(streaming=True)
+def check_control_totals(flat_file_object):
+    """
+    Check the control totals of the header and trailer rows: number of rows and sums of decimal fields, as defined by
+    the 'control_totals' of their row structures (see totals.ControlTotal). The rows are read once, the batches being
+    summed by the number of threads of the optional 'workers' key of the test configuration
+    :param flat_file_object: the FlatFile object containing the content of the flat file and file structure
+    :return: a TestCaseResult object with the control rows which totals do not match
+    """
+    result = TestCaseResult()
+    control_totals = totals.get_control_totals(flat_file_object.structure)
+    if not control_totals:
+        return result
+    tc_config = get_test_case_config_from_name('check_control_totals')
+    governor = memory.get_governor()
+    batch_size = governor.scale(getattr(tc_config, 'batch_size', tokenizer.DEFAULT_BATCH_SIZE), MIN_BATCH_SIZE)
+    workers = governor.limit_workers(getattr(tc_config, 'workers', DEFAULT_BATCH_WORKERS),
+                                     2 * batch_size * memory.ROW_MEMORY)
+    accumulator = totals.accumulate_control_totals(flat_file_object, control_totals, workers, batch_size)
+    filename = os.path.basename(flat_file_object.filename)
+    for line_number, error_type, message, field_pos in accumulator.check():
+        result.steps.append(TestCaseStepResult(line_number, False, error_type, message, filename, field_pos=field_pos))
+    return result
@@ -14,7 +14,7 @@ def imp_article_filename_field(flat_file_object):
         if row[23] != os.path.basename(flat_file_object.filename).split('.')[0]:
             step_result = TestCaseStepResult(idx + 1, False, 'FIELD_FORMAT_ERROR',
                                              "Field should contain the name of the parsed file ",
-                                             os.path.basename(flat_file_object.filename))
+                                             os.path.basename(flat_file_object.filename), field_pos=24)
             result.steps.append(step_result)
     return result
 
@@ -37,7 +37,7 @@ def imp_article_check_cug_length(flat_file_object):
                                                  "Field " + str(field_nr) + " should contain CUG with length "
                                                  + " or ".join([str(length) for length in available_cug_lengths]) +
                                                  ". Instead of'" + fied_content + "'.",
-                                                 os.path.basename(flat_file_object.filename))
+                                                 os.path.basename(flat_file_object.filename), field_pos=field_nr)
                 result.steps.append(step_result)
     return result
 
@@ -60,7 +60,7 @@ def imp_article_check_ean_length(flat_file_object):
                                                  "Field " + str(field_nr) + " should contain EAN with length "
                                                  + " or ".join([str(length) for length in available_ean_lengths]) +
                                                  ". Instead of'" + fied_content + "'.",
-                                                 os.path.basename(flat_file_object.filename))
+                                                 os.path.basename(flat_file_object.filename), field_pos=field_nr)
                 result.steps.append(step_result)
     return result
 
@@ -36,6 +36,7 @@ def imp_rec_check_required(flat_file_object):
 
             if row[pos] == "":
                 step_result = TestCaseStepResult(idx + 1, False, 'REQUIRED_FIELD', "Missing required field at position "
-                                                 + str(pos + 1), os.path.basename(flat_file_object.filename))
+                                                 + str(pos + 1), os.path.basename(flat_file_object.filename),
+                                                 field_pos=pos + 1)
                 result.steps.append(step_result)
     return result
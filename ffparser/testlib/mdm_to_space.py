@@ -9,7 +9,8 @@ def mdm_to_space_check_quotes(flat_file_object):
     :return:
     """
     result = TestCaseResult()
-    lines = open(flat_file_object.filename,"r").readlines()
+    with flat_file_object.open_raw(errors='replace') as file:
+        lines = file.readlines()
     for idx, row in enumerate(lines):
         row = row.replace(flat_file_object.structure.carriage_return,"")
         row = row.split(flat_file_object.structure.sep)
@@ -36,12 +37,12 @@ def mdm_to_space_check_quotes(flat_file_object):
                 if len(field_content) < 2 or not(field_content[0] == "\"" and field_content[-1] == "\""):
                     step_result = TestCaseStepResult(idx + 1, False, 'FIELD_FORMAT_ERROR',
                                                      "Missing quote at field " + str(i+1),
-                                                     os.path.basename(flat_file_object.filename))
+                                                     os.path.basename(flat_file_object.filename), field_pos=i + 1)
                     result.steps.append(step_result)
             else:
                 if len(field_content) > 1 and (field_content[0] == "\"" or field_content[-1] == "\""):
                     step_result = TestCaseStepResult(idx + 1, False, 'FIELD_FORMAT_ERROR',
                                                      "Field " + str(i + 1) + " should not be quoted",
-                                                     os.path.basename(flat_file_object.filename))
+                                                     os.path.basename(flat_file_object.filename), field_pos=i + 1)
                     result.steps.append(step_result)
     return result
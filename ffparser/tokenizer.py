@@ -0,0 +1,149 @@
+import contextlib
+import csv
+import gc
+import itertools
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+class CsvTokenizer(object):
+    """
+    Splits the lines of a csv flat file into rows of fields according to the dialect of its structure. Lines are read
+    in chunks. Chunks with no quote character are split with str.split, the csv module is only used for the chunks
+    containing the quote char
+    """
+    def __init__(self, sep, quotechar="\"", batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param sep: field separator
+        :param quotechar: quote character. An empty string or None declares a file without quoting
+        :param batch_size: number of rows per yielded batch
+        """
+        self.sep = sep
+        self.quotechar = quotechar if quotechar else None
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_structure(cls, file_structure, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Builds a tokenizer from the dialect defined in a csv file structure
+        :param file_structure: a FlatFileStructure object with conf_type 'csv'
+        :param batch_size: number of rows per yielded batch
+        :return: a CsvTokenizer object
+        """
+        return cls(file_structure.sep, getattr(file_structure, 'quotechar', "\""), batch_size)
+
+    def iter_batches(self, lines):
+        """
+        Tokenizes lines and yields the resulting rows in batches
+        :param lines: iterable of text lines, typically a file object opened in text mode
+        :return: a generator of lists of rows, a row being a list of fields
+        """
+        sep = self.sep
+        quotechar = self.quotechar
+        lines = iter(lines)
+        while True:
+            chunk = list(itertools.islice(lines, self.batch_size))
+            if not chunk:
+                return
+            if quotechar is None or quotechar not in "".join(chunk):
+                batch = [line.rstrip("\r\n").split(sep) for line in chunk]
+                # the csv module returns an empty row for an empty line
+                if [''] in batch:
+                    batch = [row if row != [''] else [] for row in batch]
+            else:
+                batch = self.tokenize_quoted_chunk(chunk, lines)
+            yield batch
+
+    def tokenize_quoted_chunk(self, chunk, lines):
+        """
+        Tokenizes a chunk of lines containing the quote char with the csv module
+        :param chunk: list of lines
+        :param lines: iterator over the lines following the chunk, used when a quoted field spans past the chunk
+        :return: a list of rows
+        """
+        try:
+            # strict mode raises an error instead of silently closing a quoted field left open at the end of the chunk
+            return list(csv.reader(chunk, delimiter=self.sep, quotechar=self.quotechar, strict=True))
+        except csv.Error:
+            pass
+
+        # the reader only pulls the following lines when a quoted field spans past the end of the chunk, so the split
+        # path resumes right after the quoted record
+        reader = csv.reader(itertools.chain(chunk, lines), delimiter=self.sep, quotechar=self.quotechar)
+        chunk_length = len(chunk)
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if reader.line_num >= chunk_length:
+                break
+        return rows
+
+
+@contextlib.contextmanager
+def paused_gc():
+    """
+    Disables the cyclic garbage collector while a block runs. Rows are lists of strings which cannot hold reference
+    cycles, but allocating millions of them triggers many useless collections
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class PosTokenizer(object):
+    """
+    Cuts the lines of a positional flat file into rows of fields according to the lengths of their row structure
+    """
+    def __init__(self, file_structure, row_structure_lookup, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param file_structure: a FlatFileStructure object with conf_type 'pos'
+        :param row_structure_lookup: callable returning the row structure of a given row type
+        :param batch_size: number of rows per yielded batch
+        """
+        self.type_start = file_structure.type_limits[0] - 1
+        self.type_stop = file_structure.type_limits[1]
+        self.row_structure_lookup = row_structure_lookup
+        self.batch_size = batch_size
+        self._slices = {}
+
+    def get_slices(self, row_type):
+        """
+        Returns the (start, stop) positions of the fields of a row type. Positions are computed once per row type
+        :param row_type: row type as found in the line
+        :return: a list of (start, stop) tuples
+        """
+        slices = self._slices.get(row_type)
+        if slices is None:
+            row_structure = self.row_structure_lookup(row_type)
+            slices = []
+            line_index = 0
+            for length in row_structure.lengths:
+                slices.append((line_index, line_index + length))
+                line_index = line_index + length
+            self._slices[row_type] = slices
+        return slices
+
+    def iter_batches(self, lines):
+        """
+        Cuts lines into fields and yields the resulting rows in batches
+        :param lines: iterable of text lines, typically a file object opened in text mode
+        :return: a generator of lists of rows, a row being a list of fields
+        """
+        type_start = self.type_start
+        type_stop = self.type_stop
+        batch_size = self.batch_size
+        batch = []
+        for line in lines:
+            # strip is used to remove carriage return
+            raw_row = line.rstrip()
+            slices = self.get_slices(raw_row[type_start:type_stop])
+            batch.append([raw_row[start:stop] for start, stop in slices])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,247 @@
+import decimal
+from ffparser import tokenizer
+
+CONTROL_FUNCTIONS = ['count', 'sum']
+# context of the sums: the precision is large enough for any sum of file values to be exact. A sum beyond the
+# exponent limit raises Overflow instead of becoming Infinity
+EXACT_CONTEXT = decimal.Context(prec=decimal.MAX_PREC, traps=[decimal.InvalidOperation, decimal.Overflow])
+
+
+def parse_decimal(value, decimal_sep):
+    """
+    Parses a decimal field the way check_decimal validates it: digits and decimal separators only, without sign,
+    exponent, underscore or space
+    :param value: content of the field
+    :param decimal_sep: decimal separator of the file
+    :return: a decimal.Decimal object, None if the value is not a decimal
+    """
+    if not value.replace(decimal_sep, '').isdigit():
+        return None
+    try:
+        return decimal.Decimal(value.replace(decimal_sep, '.'))
+    except decimal.InvalidOperation:
+        return None
+
+
+class ControlTotal(object):
+    """
+    Control value of a header or trailer row: the number of rows of some row types, or the sum of a decimal field of
+    these rows. Defined in the optional 'control_totals' list of the row structure of the control row, e.g.
+    {"pos": 2, "function": "count", "row_types": ["D"]} or {"pos": 3, "function": "sum", "row_types": ["D"], "field": 5}.
+    By default row_types lists the row structures without control totals
+    """
+    def __init__(self, control_type, definition, file_structure):
+        """
+        :param control_type: type of the row structure of the control row
+        :param definition: dictionary defining the control total
+        :param file_structure: structure of the file
+        """
+        self.control_type = control_type
+        missing_keys = [key for key in ['pos', 'function'] if key not in definition]
+        if missing_keys:
+            raise Exception("Missing " + ", ".join(missing_keys) + " in a control total of row structure type '"
+                            + control_type + "'")
+        self.pos = definition['pos']
+        self.function = definition['function']
+        if self.function not in CONTROL_FUNCTIONS:
+            raise Exception("Control total function must be one of " + ", ".join(CONTROL_FUNCTIONS) + ". Not '"
+                            + str(self.function) + "'")
+        self.field = definition.get('field')
+        if self.function == 'sum' and self.field is None:
+            raise Exception("Missing field of a sum control total of row structure type '" + control_type + "'")
+        self.row_types = definition.get('row_types')
+        if self.row_types is None:
+            self.row_types = [row_struct.type for row_struct in file_structure.row_structures
+                              if not getattr(row_struct, 'control_totals', None)]
+
+    def describe(self):
+        if self.function == 'count':
+            return "number of rows of type " + "/".join(self.row_types)
+        return "sum of field " + str(self.field) + " of rows of type " + "/".join(self.row_types)
+
+
+def get_control_totals(file_structure):
+    """
+    :param file_structure: structure of the file
+    :return: list of the ControlTotal objects defined by the row structures
+    """
+    control_totals = []
+    for row_struct in file_structure.row_structures:
+        for definition in getattr(row_struct, 'control_totals', None) or []:
+            control_totals.append(ControlTotal(row_struct.type, definition, file_structure))
+    return control_totals
+
+
+class ControlTotalAccumulator(object):
+    """
+    Counts and exact decimal sums of the rows of a file, with the values of its control rows. Accumulators of
+    different parts of a file can be merged, in any order, into the accumulator of the whole file
+    """
+    def __init__(self, control_totals, file_structure, get_row_structure):
+        """
+        :param control_totals: list of ControlTotal objects
+        :param file_structure: structure of the file
+        :param get_row_structure: function returning the RowStructure of a row type, or an error message
+        """
+        self.control_totals = control_totals
+        self.decimal_sep = file_structure.decimal_sep
+        self.type_index = file_structure.type_pos - 1
+        self.get_row_structure = get_row_structure
+        self.counts = [0] * len(control_totals)
+        self.sums = [decimal.Decimal(0)] * len(control_totals)
+        # number of values of a sum which are not decimals, reported by check_decimal
+        self.invalid_values = [0] * len(control_totals)
+        # (line_number, control_type, values) of the control rows, values holding the field of each control total
+        self.control_rows = []
+        self.row_structures = {}
+        self.updates = {}
+        self.controls = {}
+        for idx, control_total in enumerate(control_totals):
+            for row_type in control_total.row_types:
+                self.updates.setdefault(row_type, []).append((idx, control_total))
+            self.controls.setdefault(control_total.control_type, []).append((idx, control_total))
+
+    def get_row_type(self, row):
+        if len(row) <= self.type_index:
+            return None
+        row_type = row[self.type_index]
+        row_struct = self.row_structures.get(row_type)
+        if row_struct is None:
+            row_struct = self.row_structures[row_type] = self.get_row_structure(row_type)
+        # rows without row structure are reported by the other tests
+        if isinstance(row_struct, str):
+            return None
+        return row_struct.type
+
+    def update(self, first_line, rows):
+        """
+        Adds a batch of rows
+        :param first_line: line number of the first row of the batch
+        :param rows: list of rows
+        :return: None
+        """
+        counts = self.counts
+        sums = self.sums
+        decimal_sep = self.decimal_sep
+        with decimal.localcontext(EXACT_CONTEXT):
+            for idx, row in enumerate(rows):
+                row_type = self.get_row_type(row)
+                if row_type is None:
+                    continue
+                controls = self.controls.get(row_type)
+                if controls is not None:
+                    self.control_rows.append((first_line + idx, row_type,
+                                              [row[control_total.pos - 1] if len(row) >= control_total.pos else None
+                                               for total_idx, control_total in controls]))
+                for total_idx, control_total in self.updates.get(row_type, ()):
+                    if control_total.function == 'count':
+                        counts[total_idx] += 1
+                        continue
+                    if len(row) < control_total.field:
+                        continue
+                    value = row[control_total.field - 1]
+                    if value == '':
+                        continue
+                    number = parse_decimal(value, decimal_sep)
+                    if number is None:
+                        self.invalid_values[total_idx] += 1
+                        continue
+                    try:
+                        sums[total_idx] += number
+                    except decimal.Overflow:
+                        self.invalid_values[total_idx] += 1
+
+    def merge(self, other):
+        """
+        Adds the totals of the accumulator of another part of the file
+        :param other: ControlTotalAccumulator object with the same control totals
+        :return: None
+        """
+        with decimal.localcontext(EXACT_CONTEXT):
+            for idx in range(len(self.control_totals)):
+                self.counts[idx] += other.counts[idx]
+                self.sums[idx] += other.sums[idx]
+                self.invalid_values[idx] += other.invalid_values[idx]
+        self.control_rows.extend(other.control_rows)
+
+    def get_total(self, idx):
+        if self.control_totals[idx].function == 'count':
+            return self.counts[idx]
+        return self.sums[idx]
+
+    def check(self):
+        """
+        Compares the values of the control rows with the totals
+        :return: list of (line_number, error_type, message, field_pos) failures sorted by line. Control totals without
+        control row are reported with no line number
+        """
+        failures = []
+        found_types = set()
+        self.control_rows.sort(key=lambda control_row: control_row[0])
+        for line_number, control_type, values in self.control_rows:
+            found_types.add(control_type)
+            for (idx, control_total), value in zip(self.controls[control_type], values):
+                total = self.get_total(idx)
+                if value is None:
+                    continue
+                if control_total.function == 'count':
+                    control_value = int(value) if value.isdecimal() else None
+                else:
+                    control_value = parse_decimal(value, self.decimal_sep)
+                if control_value is None:
+                    failures.append((line_number, 'CONTROL_TOTAL_ERROR', "Control total at position "
+                                     + str(control_total.pos) + " is not a number : '" + value + "'",
+                                     control_total.pos))
+                    continue
+                if control_value != total:
+                    message = "Control total at position " + str(control_total.pos) + " is " + value \
+                              + " while the " + control_total.describe() + " is " + str(total)
+                    if self.invalid_values[idx]:
+                        message += ". " + str(self.invalid_values[idx]) + " values are not decimals"
+                    failures.append((line_number, 'CONTROL_TOTAL_ERROR', message, control_total.pos))
+        for control_type in self.controls:
+            if control_type not in found_types:
+                failures.append((None, 'CONTROL_TOTAL_MISSING', "No row of type " + control_type
+                                 + " holding control totals", None))
+        return failures
+
+
+def accumulate_control_totals(flat_file_object, control_totals, workers=1, batch_size=tokenizer.DEFAULT_BATCH_SIZE):
+    """
+    Accumulates the control totals of a file in a single pass over its rows. With several workers each batch is
+    accumulated apart and the partial totals are merged
+    :param flat_file_object: FlatFile object
+    :param control_totals: list of ControlTotal objects
+    :param workers: number of threads accumulating batches concurrently
+    :param batch_size: number of rows per batch
+    :return: a ControlTotalAccumulator object
+    """
+    def new_accumulator():
+        return ControlTotalAccumulator(control_totals, flat_file_object.structure,
+                                       flat_file_object.get_row_structure_from_type)
+
+    accumulator = new_accumulator()
+    first_line = 1
+    if workers <= 1:
+        for rows in flat_file_object.iter_batches(batch_size):
+            accumulator.update(first_line, rows)
+            first_line += len(rows)
+        return accumulator
+
+    def accumulate_batch(batch_first_line, rows):
+        partial = new_accumulator()
+        partial.update(batch_first_line, rows)
+        return partial
+
+    import collections
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for rows in flat_file_object.iter_batches(batch_size):
+            pending.append(executor.submit(accumulate_batch, first_line, rows))
+            first_line += len(rows)
+            if len(pending) >= 2 * workers:
+                accumulator.merge(pending.popleft().result())
+        while pending:
+            accumulator.merge(pending.popleft().result())
+    return accumulator
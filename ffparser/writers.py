@@ -0,0 +1,253 @@
+import csv
+import json
+import os
+import struct
+
+RESULT_HEADER = ['FILENAME', 'LINE_NUMBER', 'STATUS', 'ERROR_TYPE', 'MESSAGE']
+DEFAULT_BATCH_SIZE = 10000
+
+
+class ResultWriter(object):
+    """
+    Base class of the result writers. Records are buffered and written by batches
+    """
+    extension = None
+    binary = False
+
+    def __init__(self, file, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param file: file object the results are written to, opened in binary mode for binary formats and in text mode
+        with newline='' for the others
+        :param batch_size: number of records buffered before being written
+        """
+        self.file = file
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def write_header(self):
+        """
+        Writes the header of the output, if the format has one
+        :return: None
+        """
+        pass
+
+    def write_record(self, filename, line_number, status, error_type, message, last_line=None):
+        """
+        Writes a result record
+        :param filename: name of the tested file
+        :param line_number: line of the result, None for results concerning the whole file
+        :param status: True if the step passed
+        :param error_type: type of error, e.g. 'DATE_FORMAT'
+        :param message: description of the result
+        :param last_line: (optional) last line of a result covering a range of lines. By default line_number
+        :return: None
+        """
+        self.buffer.append((filename, line_number, status, error_type, message,
+                            line_number if last_line is None else last_line))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def write_suite(self, suite_result):
+        """
+        Writes the steps of all the test cases of a TestSuiteResult. A coalesced step is written once, on its first line,
+        its message giving its range of lines. The structured formats also store its last line
+        :param suite_result: a TestSuiteResult object
+        :return: None
+        """
+        for tc in suite_result.tcs:
+            for step in tc.steps:
+                self.write_record(step.filename, step.line_number, step.status, step.error_type, step.get_message(),
+                                  step.last_line)
+
+    def write_batch(self, records):
+        raise NotImplementedError()
+
+    def flush(self):
+        """
+        Writes the buffered records
+        :return: None
+        """
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        """
+        Writes the buffered records and closes the file
+        :return: None
+        """
+        self.flush()
+        self.file.close()
+
+
+class CsvResultWriter(ResultWriter):
+    """
+    Writes results as ';' separated lines
+    """
+    extension = ".csv"
+
+    def __init__(self, file, batch_size=DEFAULT_BATCH_SIZE):
+        ResultWriter.__init__(self, file, batch_size)
+        self.csv_writer = csv.writer(file, delimiter=';', quotechar="\"")
+
+    def write_header(self):
+        self.csv_writer.writerow(RESULT_HEADER)
+
+    def write_batch(self, records):
+        self.csv_writer.writerows([(filename, '' if line_number is None else line_number, status, error_type, message)
+                                   for filename, line_number, status, error_type, message, last_line in records])
+
+
+class JsonLinesResultWriter(ResultWriter):
+    """
+    Writes results as one json object per line, last_line being the last line of a coalesced step
+    """
+    extension = ".jsonl"
+
+    def write_batch(self, records):
+        dumps = json.dumps
+        self.file.write("".join([dumps({'filename': filename, 'line_number': line_number, 'last_line': last_line,
+                                        'status': status, 'error_type': error_type, 'message': message}) + "\n"
+                                 for filename, line_number, status, error_type, message, last_line in records]))
+
+
+class ParquetResultWriter(ResultWriter):
+    """
+    Writes results in a parquet file, last_line being the last line of a coalesced step. Requires pyarrow
+    """
+    extension = ".parquet"
+    binary = True
+
+    def __init__(self, file, batch_size=DEFAULT_BATCH_SIZE):
+        ResultWriter.__init__(self, file, batch_size)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("The parquet output format requires pyarrow. Install it with 'pip install pyarrow'")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([('filename', pyarrow.string()), ('line_number', pyarrow.int64()),
+                                      ('status', pyarrow.bool_()), ('error_type', pyarrow.string()),
+                                      ('message', pyarrow.string()), ('last_line', pyarrow.int64())])
+        self.parquet_writer = pyarrow.parquet.ParquetWriter(file, self.schema)
+
+    def write_batch(self, records):
+        columns = list(zip(*records))
+        self.parquet_writer.write_table(self.pyarrow.Table.from_arrays(
+            [self.pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.flush()
+        self.parquet_writer.close()
+        self.file.close()
+
+
+BINARY_MAGIC = b"FFR2"
+BINARY_STRING = 1
+BINARY_RESULT = 2
+BINARY_STRING_STRUCT = struct.Struct("<BII")
+BINARY_RESULT_STRUCT = struct.Struct("<BIqqBII")
+NO_LINE_NUMBER = -1
+
+
+class BinaryResultWriter(ResultWriter):
+    """
+    Writes results in a compact binary format. Filenames and error types are stored once in a string table and
+    referenced by id. The file starts with BINARY_MAGIC, followed by records which are either:
+    - a string definition: tag BINARY_STRING, id, length (uint32) and the utf-8 string
+    - a result: tag BINARY_RESULT, filename id, line number (int64, -1 if none), last line of a coalesced step (int64,
+    -1 if none), status, error type id, message length and the utf-8 message
+    Integers are little endian. Files are read back with read_binary_results
+    """
+    extension = ".ffr"
+    binary = True
+
+    def __init__(self, file, batch_size=DEFAULT_BATCH_SIZE):
+        ResultWriter.__init__(self, file, batch_size)
+        self.string_ids = {}
+
+    def write_header(self):
+        self.file.write(BINARY_MAGIC)
+
+    def get_string_id(self, value, chunks):
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.string_ids)
+            encoded = value.encode('utf-8')
+            chunks.append(BINARY_STRING_STRUCT.pack(BINARY_STRING, string_id, len(encoded)))
+            chunks.append(encoded)
+        return string_id
+
+    def write_batch(self, records):
+        chunks = []
+        pack = BINARY_RESULT_STRUCT.pack
+        for filename, line_number, status, error_type, message, last_line in records:
+            filename_id = self.get_string_id(filename, chunks)
+            error_type_id = self.get_string_id(error_type, chunks)
+            encoded = message.encode('utf-8')
+            chunks.append(pack(BINARY_RESULT, filename_id, NO_LINE_NUMBER if line_number is None else int(line_number),
+                               NO_LINE_NUMBER if last_line is None else int(last_line), 1 if status else 0,
+                               error_type_id, len(encoded)))
+            chunks.append(encoded)
+        self.file.write(b"".join(chunks))
+
+
+def read_binary_results(file):
+    """
+    Reads a file written by BinaryResultWriter
+    :param file: file object opened in binary mode
+    :return: a generator of (filename, line_number, status, error_type, message, last_line) tuples
+    """
+    if file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise Exception("Not a binary result file")
+    strings = {}
+    while True:
+        tag = file.read(1)
+        if not tag:
+            return
+        if tag[0] == BINARY_STRING:
+            tag, string_id, length = BINARY_STRING_STRUCT.unpack(tag + file.read(BINARY_STRING_STRUCT.size - 1))
+            strings[string_id] = file.read(length).decode('utf-8')
+        elif tag[0] == BINARY_RESULT:
+            tag, filename_id, line_number, last_line, status, error_type_id, length = \
+                BINARY_RESULT_STRUCT.unpack(tag + file.read(BINARY_RESULT_STRUCT.size - 1))
+            message = file.read(length).decode('utf-8')
+            yield (strings[filename_id], None if line_number == NO_LINE_NUMBER else line_number, bool(status),
+                   strings[error_type_id], message, None if last_line == NO_LINE_NUMBER else last_line)
+        else:
+            raise Exception("Corrupted binary result file. Unknown record tag " + str(tag[0]))
+
+
+RESULT_WRITERS = {
+    'csv': CsvResultWriter,
+    'jsonl': JsonLinesResultWriter,
+    'parquet': ParquetResultWriter,
+    'binary': BinaryResultWriter,
+}
+
+
+def open_result_writer(path, output_format='csv', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Opens a result file and returns its writer, with the header already written
+    :param path: path of the result file
+    :param output_format: one of the keys of RESULT_WRITERS
+    :param batch_size: number of records buffered before being written
+    :return: a ResultWriter object
+    """
+    if output_format not in RESULT_WRITERS:
+        raise Exception("Unknown output format '" + output_format + "'. Must be one of "
+                        + ", ".join(RESULT_WRITERS))
+    writer_class = RESULT_WRITERS[output_format]
+    if writer_class.binary:
+        file = open(path, "wb")
+    else:
+        file = open(path, "w", newline='')
+    try:
+        writer = writer_class(file, batch_size)
+    except Exception:
+        file.close()
+        os.remove(path)
+        raise
+    writer.write_header()
+    return writer
@@ -109,7 +109,7 @@ setup(
     #
     #   py_modules=["my_module"],
     #
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests', 'tests.*']),
 
     # This field lists other packages that your project depends on to run.
     # Any package you put here will be installed by pip when your project is
@@ -127,10 +127,9 @@ setup(
     #
     # Similar to `install_requires` above, these must be valid existing
     # projects.
-    # extras_require={  # Optional
-    #     'dev': ['check-manifest'],
-    #     'test': ['coverage'],
-    # },
+    extras_require={  # Optional
+        'parquet': ['pyarrow'],
+    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.
@@ -158,6 +157,8 @@ setup(
     entry_points={  # Optional
         'console_scripts': [
             'ffchecker=ffparser.ffchecker:main',
+            'ffchecker-server=ffparser.server:main',
+            'ffdiff=ffparser.diff:main',
         ],
     },
 
@@ -0,0 +1,43 @@
+import io
+import unittest
+from ffparser import decoding
+
+
+class BlockDecoderTest(unittest.TestCase):
+    def decode(self, data, block_size=decoding.DEFAULT_BLOCK_SIZE):
+        decoder = decoding.BlockDecoder(io.BytesIO(data), "utf-8", block_size)
+        return list(decoder.iter_lines()), decoder.errors
+
+    def test_valid_lines(self):
+        lines, errors = self.decode(b"a;b\r\nc\xc3\xa9;d\n\ne")
+        self.assertEqual(lines, ["a;b\n", "c\xe9;d\n", "\n", "e"])
+        self.assertEqual(errors, [])
+
+    def test_every_invalid_sequence_is_recorded(self):
+        lines, errors = self.decode(b"a\xffb\xfe\nok\n\xc3\n")
+        self.assertEqual(lines, ["a\ufffdb\ufffd\n", "ok\n", "\ufffd\n"])
+        self.assertEqual([(line_number, offset) for line_number, offset, message in errors], [(1, 1), (1, 3), (3, 8)])
+        self.assertIn("b'\\xff'", errors[0][2])
+        self.assertIn("at byte offset 3", errors[1][2])
+
+    def test_errors_of_later_blocks(self):
+        data = b"".join(b"line " + str(idx).encode('ascii') + b"\n" for idx in range(100)) + b"bad \xff\n"
+        lines, errors = self.decode(data, block_size=16)
+        self.assertEqual(len(lines), 101)
+        self.assertEqual(lines[-1], "bad \ufffd\n")
+        self.assertEqual(errors[0][:2], (101, len(data) - 2))
+
+    def test_long_line_read_in_several_blocks(self):
+        data = b"x" * 1000 + b"\xff\ny\n"
+        lines, errors = self.decode(data, block_size=64)
+        self.assertEqual(lines, ["x" * 1000 + "\ufffd\n", "y\n"])
+        self.assertEqual(errors[0][:2], (1, 1000))
+
+    def test_carriage_return_line_ends_are_rejected(self):
+        with self.assertRaises(Exception) as context:
+            self.decode(b"a;b\rc;d\r")
+        self.assertIn("carriage returns only", str(context.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+from ffparser import distributed, ffchecker, structure
+
+STRUCTURE = {"name": "dist", "conf_type": "pos", "encoding": "utf-8", "type_pos": 1, "type_limits": [1, 1],
+             "date_fmt": "%Y%m%d", "decimal_sep": ".", "tests": ["check_dates", "check_decimal"],
+             "file_pattern": "^DIST_.*\\.txt$", "carriage_return": "\n",
+             "row_structures": [{"type": "D", "lengths": [1, 4, 8, 7], "date_fields": [3], "key_pos": 2,
+                                 "decimal_fields": [4], "digit_fields": [2], "fixed_values": []}]}
+
+
+def get_failures(suite_result):
+    return sorted((step.line_number, step.error_type) for tc in suite_result.tcs for step in tc.steps
+                  if step.status is False)
+
+
+class DistributedTest(unittest.TestCase):
+    """
+    Round trip of a file split in byte ranges between a coordinator and local workers on the loopback interface
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ffparser_test_")
+        with open(os.path.join(self.directory, "struct_dist.json"), "w") as structure_file:
+            json.dump(STRUCTURE, structure_file)
+        self.filename = os.path.join(self.directory, "DIST_1.txt")
+        with open(self.filename, "w") as flat_file:
+            for idx in range(500):
+                date = "20201340" if idx % 97 == 0 else "20200101"
+                amount = "1x.5000" if idx % 89 == 0 else "0012.50"
+                flat_file.write("D" + str(idx % 10000).zfill(4) + date + amount + "\n")
+        self.file_structure = structure.load_structure_index(self.directory).structures['dist']
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_round_trip(self):
+        units = distributed.split_file(self.filename, self.file_structure, 1000)
+        self.assertGreater(len(units), 1)
+        results = distributed.check_files([(self.filename, self.file_structure)], ('127.0.0.1', 0), local_workers=2,
+                                          config_dir=self.directory, split_size=1000, quiet=True)
+        expected = ffchecker.load_flat_file(self.filename, self.file_structure).run_defined_tests()
+        self.assertEqual(list(results), [self.filename])
+        failures = get_failures(results[self.filename])
+        self.assertEqual(failures, get_failures(expected))
+        self.assertEqual(len(failures), 6 + 6)
+
+    def test_unknown_structure(self):
+        self.file_structure.name = "unknown"
+        results = distributed.check_files([(self.filename, self.file_structure)], ('127.0.0.1', 0), local_workers=1,
+                                          config_dir=self.directory, quiet=True)
+        error_type, test_name, message = results[self.filename]
+        self.assertEqual(error_type, 'WORKER_ERROR')
+        self.assertIn("Unknown file structure 'unknown'", message)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from ffparser import duplicates, ffchecker
+
+
+def get_key(row):
+    return row[1] if len(row) > 1 else None
+
+
+class DuplicateFinderTest(unittest.TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp(prefix="ffparser_test_")
+        rows = [["D", "key" + str(idx % 700)] for idx in range(1000)] + [["H"], ["D", "key3"]]
+        self.flat_file = ffchecker.FlatFile.from_rows(rows, None, "DUP_1.csv")
+        self.expected = [(idx + 1, idx - 700 + 1, "key" + str(idx % 700)) for idx in range(700, 1000)] \
+            + [(1002, 4, "key3")]
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def find(self, memory_budget):
+        finder = duplicates.DuplicateFinder(get_key, memory_budget, self.spill_dir)
+        with mock.patch.object(duplicates, 'SpillPartitions', wraps=duplicates.SpillPartitions) as spill_partitions:
+            found = finder.find(self.flat_file)
+        return found, spill_partitions.called
+
+    def test_in_memory(self):
+        self.assertEqual(self.find(duplicates.DEFAULT_MEMORY_BUDGET), (self.expected, False))
+
+    def test_spill(self):
+        self.assertEqual(self.find(4096), (self.expected, True))
+        # the partitions are removed once read
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_no_duplicates(self):
+        flat_file = ffchecker.FlatFile.from_rows([["D", str(idx)] for idx in range(1000)], None, "DUP_2.csv")
+        finder = duplicates.DuplicateFinder(get_key, 4096, self.spill_dir)
+        self.assertEqual(finder.find(flat_file), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
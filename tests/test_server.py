@@ -0,0 +1,78 @@
+import http.client
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import unittest
+from ffparser import server
+
+STRUCTURE = {"name": "smoke", "conf_type": "csv", "sep": ";", "quotechar": "\"", "encoding": "utf-8", "type_pos": 1,
+             "date_fmt": "%Y%m%d", "decimal_sep": ".", "tests": ["check_decimal"], "file_pattern": "^SMOKE_.*\\.csv$",
+             "carriage_return": "\n",
+             "row_structures": [{"type": "D", "length": 3, "date_fields": [], "key_pos": 2, "optional_fields": [],
+                                 "decimal_fields": [3], "digit_fields": [], "fixed_lengths": [], "fixed_values": []}]}
+CONTENT = "D;1;12.50\nD;2;1x.5\nD;3;7\n"
+
+
+class CheckerServerTest(unittest.TestCase):
+    """
+    Smoke test of the server listening on the loopback interface
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ffparser_test_")
+        with open(os.path.join(self.directory, "struct_smoke.json"), "w") as structure_file:
+            json.dump(STRUCTURE, structure_file)
+        self.filename = os.path.join(self.directory, "SMOKE_1.csv")
+        with open(self.filename, "w") as flat_file:
+            flat_file.write(CONTENT)
+        self.server = server.CheckerServer(("127.0.0.1", 0), self.directory, max_workers=2, queue_timeout=5,
+                                           root_dir=self.directory)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=30)
+        try:
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            return response.status, response.read().decode('utf-8')
+        finally:
+            connection.close()
+
+    def check_results(self, text, filename):
+        lines = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual(lines[-1], {'done': True, 'files': [{'filename': filename, 'errors': 1}]})
+        failed = [line for line in lines[:-1] if line['status'] is False]
+        self.assertEqual([(line['line_number'], line['error_type']) for line in failed], [(2, 'FIELD_FORMAT_ERROR')])
+
+    def test_health_and_structures(self):
+        self.assertEqual(self.request("GET", "/health"), (200, json.dumps({'status': 'ok'})))
+        status, text = self.request("GET", "/structures")
+        self.assertEqual((status, json.loads(text)), (200, {'structures': ['smoke']}))
+
+    def test_check_path(self):
+        status, text = self.request("POST", "/check", json.dumps({'paths': [self.filename]}))
+        self.assertEqual(status, 200)
+        self.check_results(text, "SMOKE_1.csv")
+
+    def test_check_upload(self):
+        status, text = self.request("POST", "/check?filename=SMOKE_2.csv", CONTENT.encode('utf-8'))
+        self.assertEqual(status, 200)
+        self.check_results(text, "SMOKE_2.csv")
+
+    def test_path_outside_of_root(self):
+        status, text = self.request("POST", "/check", json.dumps({'paths': ["/etc/hostname"]}))
+        self.assertEqual(status, 400)
+        self.assertIn("outside of the root directory", json.loads(text)['error'])
+
+
+if __name__ == "__main__":
+    unittest.main()
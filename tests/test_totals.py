@@ -0,0 +1,88 @@
+import decimal
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+from ffparser import ffchecker, structure, totals
+
+STRUCTURE = {"name": "tot", "conf_type": "csv", "sep": ";", "quotechar": "\"", "encoding": "utf-8", "type_pos": 1,
+             "date_fmt": "%Y%m%d", "decimal_sep": ",", "tests": ["check_control_totals"],
+             "file_pattern": "^TOT_.*\\.csv$", "carriage_return": "\n",
+             "row_structures": [
+                 {"type": "D", "length": 3, "date_fields": [], "key_pos": 2, "optional_fields": [],
+                  "decimal_fields": [3], "digit_fields": [], "fixed_lengths": [], "fixed_values": []},
+                 {"type": "T", "length": 3, "date_fields": [], "key_pos": 2, "optional_fields": [],
+                  "decimal_fields": [3], "digit_fields": [2], "fixed_lengths": [], "fixed_values": [],
+                  "control_totals": [{"pos": 2, "function": "count"}, {"pos": 3, "function": "sum", "field": 3}]}]}
+
+
+class ControlTotalAccumulatorTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="ffparser_test_")
+        try:
+            path = os.path.join(directory, "struct_tot.json")
+            with open(path, "w") as structure_file:
+                json.dump(STRUCTURE, structure_file)
+            file_structure = structure.get_structure_from_json(path)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        self.rows = [["D", str(idx), "0,1"] for idx in range(1, 101)] + [["D", "101", "1E5"], ["T", "101", "10,00"]]
+        self.flat_file = ffchecker.FlatFile.from_rows(self.rows, file_structure, "TOT_1.csv")
+        self.control_totals = totals.get_control_totals(file_structure)
+
+    def new_accumulator(self):
+        return totals.ControlTotalAccumulator(self.control_totals, self.flat_file.structure,
+                                              self.flat_file.get_row_structure_from_type)
+
+    def accumulate_parts(self, bounds):
+        parts = []
+        for start, end in zip(bounds, bounds[1:]):
+            part = self.new_accumulator()
+            part.update(start + 1, self.rows[start:end])
+            parts.append(part)
+        return parts
+
+    def test_merge(self):
+        whole = self.new_accumulator()
+        whole.update(1, self.rows)
+        merged = self.new_accumulator()
+        # parts are merged in any order, the control rows being sorted by line
+        for part in reversed(self.accumulate_parts([0, 30, 31, 101, len(self.rows)])):
+            merged.merge(part)
+        self.assertEqual(merged.counts, [101, 0])
+        self.assertEqual(merged.sums, [0, decimal.Decimal("10.0")])
+        self.assertEqual(merged.invalid_values, [0, 1])
+        self.assertEqual((merged.counts, merged.sums, merged.invalid_values),
+                         (whole.counts, whole.sums, whole.invalid_values))
+        self.assertEqual(merged.check(), whole.check())
+        self.assertEqual(merged.check(), [])
+
+    def test_merge_reports_differences(self):
+        self.rows[-1] = ["T", "100", "9,90"]
+        merged = self.new_accumulator()
+        for part in self.accumulate_parts([0, 50, len(self.rows)]):
+            merged.merge(part)
+        self.assertEqual(merged.check(), [
+            (102, 'CONTROL_TOTAL_ERROR', "Control total at position 2 is 100 while the number of rows of type D is 101",
+             2),
+            (102, 'CONTROL_TOTAL_ERROR', "Control total at position 3 is 9,90 while the sum of field 3 of rows of type "
+                                         "D is 10.0. 1 values are not decimals", 3)])
+
+    def test_merge_keeps_exact_sums(self):
+        first = self.new_accumulator()
+        first.update(1, [["D", "1", "0,1"]] * 3)
+        second = self.new_accumulator()
+        second.update(4, [["D", "4", "99999999999999999999999999999999,9"]])
+        first.merge(second)
+        self.assertEqual(first.sums[1], decimal.Decimal("100000000000000000000000000000000.2"))
+
+    def test_workers(self):
+        single = totals.accumulate_control_totals(self.flat_file, self.control_totals, 1, 7)
+        threaded = totals.accumulate_control_totals(self.flat_file, self.control_totals, 3, 7)
+        self.assertEqual(threaded.check(), single.check())
+        self.assertEqual((threaded.counts, threaded.sums), (single.counts, single.sums))
+
+
+if __name__ == "__main__":
+    unittest.main()